@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file, make_response
+from flask import Flask, request, jsonify, send_from_directory, send_file, make_response, abort, g
 from flask_cors import CORS
 import redis
 import json
@@ -6,27 +6,46 @@ import os
 import uuid
 import base64
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from urllib.parse import quote
 from dotenv import load_dotenv
 import time
 from datetime import datetime
-import traceback
 import tempfile
+import shutil
+import mimetypes
+import re
+import hashlib
+import math
+from PIL import Image, UnidentifiedImageError
+from concurrent.futures import ThreadPoolExecutor
 
 # Import the modules we created
 from llm_client import get_llm_client
 from video_generator import get_video_generator
 from tts_client import get_tts_client
-from audio_video_sync import merge_audio_video
+from audio_video_sync import merge_audio_video, compose_clips
+from job_queue import enqueue_job, build_job, run_job
+from project_cache import ProjectCache, PROJECT_CHANNEL
+from image_hash import phash, hamming_distance
+from media_gc import MediaGarbageCollector
+from blob_store import LocalBlobStore, get_blob_store, image_record, parse_image_record, decode_image_value, load_image
+from python_ffmpeg import get_duration, plan_clip_timing, encode_rendition, package_hls
+from log_utils import get_logger, redact
+from metrics import registry as metrics_registry, time_stage, observe_http
+from tracing import TracedRedis, start_span, end_span, parse_traceparent, bind as bind_trace
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
 server_ip = os.getenv('SERVER_IP', '50.19.10.82')
 internal_server_ip = os.getenv('INTERNAL_SERVER_IP', '172.31.28.157')
 # Configure CORS to allow requests from all necessary origins
-CORS(app, resources={r"/api/*": {"origins": [
+CORS_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:8888",
     "http://127.0.0.1:3000",
@@ -36,15 +55,32 @@ CORS(app, resources={r"/api/*": {"origins": [
     f"http://{server_ip}:8888",
     f"http://{internal_server_ip}:3000",
     f"http://{internal_server_ip}:8888",
-], "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": "*"}})
-
-# Configure Redis
-redis_client = redis.Redis(
-    host=os.getenv('REDIS_HOST', 'localhost'),
-    port=int(os.getenv('REDIS_PORT', 6379)),
-    password=os.getenv('REDIS_PASSWORD', "123456"),
-    db=int(os.getenv('REDIS_DB', 0)),
-    decode_responses=True  # Automatically decode response to strings
+]
+CORS(app, resources={r"/api/*": {"origins": CORS_ORIGINS, "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": "*", "expose_headers": ["ETag", "X-Trace-Id"]}})
+
+# Configure Redis (the ASGI server builds its async client from the same settings)
+REDIS_CONFIG = {
+    'host': os.getenv('REDIS_HOST', 'localhost'),
+    'port': int(os.getenv('REDIS_PORT', 6379)),
+    'password': os.getenv('REDIS_PASSWORD', "123456"),
+    'db': int(os.getenv('REDIS_DB', 0)),
+    'decode_responses': True  # Automatically decode response to strings
+}
+# 请求链路追踪开启时（TRACING_ENABLED），每条Redis命令记录为一个span
+redis_client = TracedRedis(**REDIS_CONFIG)
+
+# 每个进程缓存最近读取的项目，写入时通过pub/sub通知所有进程失效（PROJECT_CACHE_SIZE=0关闭）
+project_cache = ProjectCache(
+    redis_client,
+    max_size=int(os.getenv('PROJECT_CACHE_SIZE', 256)),
+    ttl=float(os.getenv('PROJECT_CACHE_TTL', 60))
+)
+
+# 各进程把阶段耗时等指标累计在内存中，定期写入Redis，由 /metrics 汇总输出
+metrics_registry.configure(
+    redis_client,
+    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5)),
+    enabled=os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
 )
 
 # Configure upload folder
@@ -64,6 +100,17 @@ SPEECH_FOLDER = os.getenv('SPEECH_FOLDER', os.path.join(os.path.dirname(os.path.
 if not os.path.exists(SPEECH_FOLDER):
     os.makedirs(SPEECH_FOLDER)
 
+# Media serving: '' serves files from Python (Range/ETag/Last-Modified via Werkzeug, sendfile through
+# the WSGI server's file_wrapper), 'x-accel' hands off to nginx, 'x-sendfile' to Apache/lighttpd
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '').lower()
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media').rstrip('/')
+MEDIA_IMMUTABLE_MAX_AGE = int(os.getenv('MEDIA_IMMUTABLE_MAX_AGE', 365 * 24 * 3600))
+app.config['USE_X_SENDFILE'] = MEDIA_OFFLOAD == 'x-sendfile'
+# Files whose names are unique per content (uuid/hash/timestamp) never change and can be cached forever
+IMMUTABLE_MEDIA_NAME = re.compile(
+    r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{32,}|speech_\d+)\.\w+$'
+)
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -77,30 +124,295 @@ VIDEO_OUTPUT_PATH = os.getenv("VIDEO_OUTPUT_PATH", os.path.join(os.path.dirname(
 # Ensure video output directory exists
 os.makedirs(VIDEO_OUTPUT_PATH, exist_ok=True)
 
+# Maximum number of Kling tasks submitted in parallel for one project
+KLING_MAX_PARALLEL_TASKS = int(os.getenv('KLING_MAX_PARALLEL_TASKS', 4))
+# Clip durations supported by Kling and the maximum number of clips per video
+KLING_CLIP_DURATIONS = tuple(int(d) for d in os.getenv('KLING_CLIP_DURATIONS', '5,10').split(','))
+KLING_MAX_CLIPS = int(os.getenv('KLING_MAX_CLIPS', 6))
+
+# Narration is only time-stretched within 1 ± this ratio; the rest is covered by extending the video
+AUDIO_MAX_TEMPO_DEVIATION = float(os.getenv('AUDIO_MAX_TEMPO_DEVIATION', 0.1))
+# How to extend a video that is shorter than its narration: freeze or loop
+VIDEO_EXTEND_MODE = os.getenv('VIDEO_EXTEND_MODE', 'freeze')
+
+# Background jobs (video generation, final renders, HLS packaging):
+# 'redis' (default) queues them for worker.py so they stay out of the web workers;
+# 'thread' runs them on an in-process pool (development only: gunicorn recycles workers while jobs run)
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'redis').lower()
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', 2))
+job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS)
+# Optional lower-resolution renditions of the final render, e.g. "720,480"
+FINAL_RENDITION_HEIGHTS = [int(h) for h in os.getenv('FINAL_RENDITION_HEIGHTS', '').split(',') if h.strip()]
+# Optional HLS packaging of the final render, served from the project video folder
+HLS_ENABLED = os.getenv('HLS_ENABLED', 'false').lower() == 'true'
+HLS_SEGMENT_DURATION = int(os.getenv('HLS_SEGMENT_DURATION', 4))
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/mp2t', '.ts')
+
 # Test files directory for temporary test uploads
 TEST_FILES_DIR = os.path.join(tempfile.gettempdir(), "image_to_video_test")
 os.makedirs(TEST_FILES_DIR, exist_ok=True)
 
+# 媒体文件垃圾回收（见media_gc.py）：每MEDIA_GC_INTERVAL秒一次，0表示关闭；
+# 没有被引用的文件超过MEDIA_GC_GRACE_PERIOD秒后删除；MEDIA_GC_QUOTA_BYTES为磁盘配额，0表示不限制；
+# 超出配额时只淘汰修改时间早于MEDIA_GC_MIN_EVICT_AGE秒的文件（应长于最长的后台任务，任务完成前它的文件还没有被项目引用）
+MEDIA_GC_INTERVAL = int(os.getenv('MEDIA_GC_INTERVAL', 0))
+MEDIA_GC_GRACE_PERIOD = int(os.getenv('MEDIA_GC_GRACE_PERIOD', 86400))
+MEDIA_GC_QUOTA_BYTES = int(os.getenv('MEDIA_GC_QUOTA_BYTES', 0))
+MEDIA_GC_MIN_EVICT_AGE = int(os.getenv('MEDIA_GC_MIN_EVICT_AGE', 3600))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def send_media_file(directory, filename, kind):
+    """Serve a media file, offloading to the reverse proxy when configured
+
+    Args:
+        directory: Media root directory
+        filename: Path relative to the media root
+        kind: Name of the media root under MEDIA_ACCEL_PREFIX ('videos' or 'speeches')
+    """
+    if MEDIA_OFFLOAD == 'x-accel':
+        path = safe_join(directory, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = f"{MEDIA_ACCEL_PREFIX}/{kind}/{quote(filename)}"
+        response.headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    else:
+        response = send_from_directory(directory, filename, conditional=True, etag=True)
+
+    if IMMUTABLE_MEDIA_NAME.search(filename):
+        response.headers['Cache-Control'] = f"public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        # Fixed names (e.g. video_with_audio_preview.mp4) are overwritten in place, revalidate with ETag
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def init_clients():
+    """Create the LLM, video and TTS clients up front
+
+    Used by the WSGI entry point and the job worker so the first request doesn't pay for it.
+    A client that fails to initialize (e.g. missing credentials) is left to the lazy
+    initialization in the endpoints.
+    """
+    global llm_client, video_generator, tts_client
+    try:
+        if llm_client is None:
+            llm_client = get_llm_client(redis_client)
+    except Exception as e:
+        logger.warning("Failed to preload LLM client: %s", e)
+    try:
+        if video_generator is None:
+            video_generator = get_video_generator()
+    except Exception as e:
+        logger.warning("Failed to preload video generator: %s", e)
+    try:
+        if tts_client is None:
+            tts_client = get_tts_client()
+    except Exception as e:
+        logger.warning("Failed to preload TTS client: %s", e)
+
+def submit_job(name, *args):
+    """Run a background job registered in JOB_HANDLERS
+
+    Args:
+        name: Job name
+        *args: JSON-serializable job arguments
+    """
+    if JOB_BACKEND == 'redis':
+        return enqueue_job(redis_client, name, *args)
+    # 与worker.py相同的执行方式（任务span接续当前请求的trace）
+    job_executor.submit(run_job, JOB_HANDLERS, build_job(name, *args))
+
 def get_project_key(project_id):
     return f"project:{project_id}"
 
-def get_project(project_id):
-    """Retrieve project data from Redis"""
+# 项目以Redis hash保存，每个顶层字段单独JSON编码，修改时只写入变化的字段。
+# 每次写入version加1；指定了期望的版本号时，版本不一致则放弃写入（compare-and-set）。
+# 只在项目仍存在时写入，避免后台任务在项目删除后重新创建出残缺的项目。
+# 写入后在PROJECT_CHANNEL上发布项目key，使各进程的项目缓存失效
+# 返回值：新的版本号；0表示项目不存在；-1表示版本冲突
+PROJECT_UPDATE_SCRIPT = f"""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[1] ~= '' and tonumber(redis.call('HGET', KEYS[1], 'version') or '0') ~= tonumber(ARGV[1]) then
+    return -1
+end
+local count = tonumber(ARGV[2])
+for i = 3, count * 2 + 1, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+for i = count * 2 + 3, #ARGV do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('PUBLISH', '{PROJECT_CHANNEL}', KEYS[1])
+return version
+"""
+update_project_script = redis_client.register_script(PROJECT_UPDATE_SCRIPT)
+
+# 版本冲突时modify_project重新读取并重试的次数
+PROJECT_UPDATE_RETRIES = int(os.getenv('PROJECT_UPDATE_RETRIES', 5))
+
+class ProjectConflictError(Exception):
+    """项目在读取之后已被其他请求修改（版本号不一致）"""
+
+def encode_project_fields(fields):
+    return {name: json.dumps(value) for name, value in fields.items()}
+
+def decode_project_fields(raw):
+    return {name: json.loads(value) for name, value in raw.items()}
+
+def project_update_args(fields, remove=(), expected_version=None):
+    """PROJECT_UPDATE_SCRIPT的参数：期望的版本号、字段数量、字段/值对、要删除的字段"""
+    args = ['' if expected_version is None else expected_version, len(fields)]
+    for name, value in encode_project_fields(fields).items():
+        args.extend([name, value])
+    args.extend(remove)
+    return args
+
+def check_project_update(result, project_id):
+    """把PROJECT_UPDATE_SCRIPT的返回值转换为版本号，版本冲突时抛出ProjectConflictError"""
+    if result == -1:
+        raise ProjectConflictError(f"Project {project_id} was modified by another request")
+    return result
+
+def get_project(project_id, use_cache=True):
+    """Retrieve project data from Redis (including its version)
+
+    use_cache=False always reads from Redis, e.g. after a version conflict
+    """
     project_key = get_project_key(project_id)
-    project_data = redis_client.get(project_key)
-    
+    project_data = project_cache.get(project_key) if use_cache else None
+    if project_data is None:
+        generation = project_cache.generation
+        try:
+            with time_stage('redis_fetch', 'redis'):
+                project_data = redis_client.hgetall(project_key)
+        except redis.ResponseError:
+            # 旧版本把整个项目保存为一个JSON字符串
+            return migrate_project(project_key)
+        
+        if not project_data:
+            return None
+        project_cache.put(project_key, project_data, generation)
+    
+    project = decode_project_fields(project_data)
+    project.setdefault('version', 0)
+    return project
+
+def migrate_project(project_key):
+    """把旧格式（整段JSON字符串）的项目转换为hash"""
+    try:
+        project_data = redis_client.get(project_key)
+    except redis.ResponseError:
+        # 已被其他请求转换
+        return get_project(project_key.split(':', 1)[1])
     if not project_data:
         return None
     
-    return json.loads(project_data)
+    project = json.loads(project_data)
+    project['version'] = 0
+    pipe = redis_client.pipeline()
+    pipe.delete(project_key)
+    pipe.hset(project_key, mapping=encode_project_fields(project))
+    pipe.execute()
+    return project
 
 def save_project(project_data):
-    """Save project data to Redis"""
+    """Save a whole project to Redis (used when creating a project; use update_project for changes)"""
     project_key = get_project_key(project_data['id'])
-    redis_client.set(project_key, json.dumps(project_data))
+    pipe = redis_client.pipeline()
+    pipe.hset(project_key, mapping=encode_project_fields(project_data))
+    project_cache.publish(pipe, project_key)
+    pipe.execute()
+    project_cache.invalidate(project_key)
+
+def update_project(project_id, fields, remove=(), expected_version=None):
+    """只更新项目的部分字段，其他请求同时修改的字段不会被覆盖
+
+    Args:
+        project_id: 项目ID
+        fields: 要写入的顶层字段，未指定updated_at时自动设置为当前时间
+        remove: 要删除的顶层字段名
+        expected_version: 可选，项目读取时的版本号，版本已变化时不写入
+
+    Returns:
+        写入后的版本号，项目不存在时返回0
+
+    Raises:
+        ProjectConflictError: 项目版本与expected_version不一致
+    """
+    fields = dict(fields)
+    fields.setdefault('updated_at', datetime.now().isoformat())
+    project_key = get_project_key(project_id)
+    args = project_update_args(fields, remove, expected_version)
+    try:
+        result = update_project_script(keys=[project_key], args=args)
+    except redis.ResponseError:
+        if not migrate_project(project_key):
+            return 0
+        result = update_project_script(keys=[project_key], args=args)
+    project_cache.invalidate(project_key)
+    return check_project_update(result, project_id)
+
+def modify_project(project_id, mutate, retries=None):
+    """读取-修改-写入项目：写入时检查版本号，被其他请求抢先修改时重新读取并重试
+
+    Args:
+        project_id: 项目ID
+        mutate: 接收最新的项目数据，返回要写入的字段字典；返回None表示放弃写入
+        retries: 最多尝试次数，默认PROJECT_UPDATE_RETRIES
+
+    Returns:
+        写入后的项目数据；项目不存在或mutate放弃写入时返回None
+
+    Raises:
+        ProjectConflictError: 重试次数用完仍然冲突
+    """
+    for attempt in range(retries or PROJECT_UPDATE_RETRIES):
+        # 冲突后直接读Redis，缓存可能还没收到失效通知
+        project = get_project(project_id, use_cache=attempt == 0)
+        if not project:
+            return None
+        fields = mutate(project)
+        if fields is None:
+            return None
+        fields.setdefault('updated_at', datetime.now().isoformat())
+        try:
+            version = update_project(project_id, fields, expected_version=project['version'])
+        except ProjectConflictError:
+            continue
+        if not version:
+            return None
+        project.update(fields)
+        project['version'] = version
+        return project
+    raise ProjectConflictError(f"Project {project_id} is being modified concurrently, giving up")
+
+# 语音和视频的历史记录保存在项目文档之外的定长列表中（最新的在最后），
+# 项目文档只保留当前的语音和视频，大小不随使用次数增长
+PROJECT_HISTORY_LIMIT = int(os.getenv('PROJECT_HISTORY_LIMIT', 20))
+PROJECT_HISTORY_KINDS = ('speech', 'video')
+
+def get_history_key(project_id, kind):
+    return f"history:{project_id}:{kind}"
+
+def push_history(project_id, kind, entry):
+    """追加一条历史记录，只保留最近的PROJECT_HISTORY_LIMIT条"""
+    history_key = get_history_key(project_id, kind)
+    pipe = redis_client.pipeline()
+    pipe.rpush(history_key, json.dumps(entry))
+    pipe.ltrim(history_key, -PROJECT_HISTORY_LIMIT, -1)
+    pipe.execute()
+
+def get_history(project_id, kind):
+    return [json.loads(entry) for entry in redis_client.lrange(get_history_key(project_id, kind), 0, -1)]
+
+def delete_history(project_id, kinds=PROJECT_HISTORY_KINDS):
+    redis_client.delete(*[get_history_key(project_id, kind) for kind in kinds])
 
 def get_project_image_ids(project_id):
     """获取项目所有图片的ID列表，按顺序排列"""
@@ -124,55 +436,299 @@ def get_project_image_ids(project_id):
     image_ids.sort()
     return image_ids
 
+def get_image_counter_key(project_id):
+    return f"image-ids:{project_id}"
+
+def reserve_image_ids(project_id, count):
+    """原子地预留count个连续的图片ID（删除的ID不会被重新使用）"""
+    counter_key = get_image_counter_key(project_id)
+    if not redis_client.exists(counter_key):
+        # 第一次使用计数器时，从现有图片的最大ID开始
+        redis_client.set(counter_key, max(get_project_image_ids(project_id), default=0), nx=True)
+    last_id = redis_client.incrby(counter_key, count)
+    return list(range(last_id - count + 1, last_id + 1))
+
 def get_next_image_id(project_id):
     """获取下一个可用的图片ID"""
-    # 获取当前所有图片ID
-    image_ids = get_project_image_ids(project_id)
-    
-    # 如果没有图片，从1开始
-    if not image_ids:
-        return 1
-    
-    # 否则取最大值+1
-    return max(image_ids) + 1
+    return reserve_image_ids(project_id, 1)[0]
+
+# 像素数上限，只解析图片头部来检查，不解码整张图片
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 50_000_000))
+# 批量上传请求的大小上限
+MAX_BATCH_UPLOAD_SIZE = int(os.getenv('MAX_BATCH_UPLOAD_SIZE', 128 * 1024 * 1024))
+
+class InvalidImageError(ValueError):
+    """上传的文件不是支持的图片，或尺寸超出限制"""
+
+def inspect_image_upload(stream):
+    """只解析上传文件的图片头部，返回MIME类型，读取位置恢复到文件开头
+
+    Raises:
+        InvalidImageError: 无法识别的图片格式，或像素数超过MAX_IMAGE_PIXELS
+    """
+    try:
+        with Image.open(stream) as image:
+            mime_type = Image.MIME.get(image.format)
+            width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImageError("Unsupported image format") from e
+    finally:
+        stream.seek(0)
+    
+    if mime_type not in ('image/jpeg', 'image/png', 'image/gif'):
+        raise InvalidImageError(f"Unsupported image format: {mime_type}")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidImageError(f"Image too large: {width}x{height}")
+    return mime_type
+
+# 图片去重：相同内容（SHA-256）的图片只存一份blob，blob-refs:{sha256}记录引用它的图片；
+# 开启IMAGE_PHASH_ENABLED时再按感知哈希（pHash）查找相似图片。pHash按PHASH_BANDS段建索引，
+# 汉明距离小于段数的两张图片至少有一段完全相同
+IMAGE_PHASH_ENABLED = os.getenv('IMAGE_PHASH_ENABLED', 'false').lower() == 'true'
+PHASH_BANDS = 8
+IMAGE_PHASH_MAX_DISTANCE = min(int(os.getenv('IMAGE_PHASH_MAX_DISTANCE', 6)), PHASH_BANDS - 1)
+BLOB_PHASH_KEY = "blob-phash"
+
+def get_blob_refs_key(digest):
+    return f"blob-refs:{digest}"
+
+def get_phash_band_keys(image_phash):
+    width = len(image_phash) // PHASH_BANDS
+    return [
+        f"phash-band:{band}:{image_phash[band * width:(band + 1) * width]}"
+        for band in range(PHASH_BANDS)
+    ]
+
+def get_image_ref(image_key):
+    """图片key对应的引用名，即图片路径中的{project_id}-image-{image_id}"""
+    return image_key.split(':', 1)[1]
+
+def store_image_upload(stream, image_key, mime_type):
+    """把上传的文件流写入blob存储，Redis中只保存图片记录
+
+    Returns:
+        图片信息，见store_image_uploads
+    """
+    return store_image_uploads([(stream, image_key, mime_type)])[0]
+
+def store_image_uploads(uploads):
+    """把多个上传的文件流写入blob存储（按内容去重），图片记录在同一个pipeline中写入Redis
+
+    Args:
+        uploads: (文件流, 图片key, MIME类型) 列表
 
-def update_project_images_metadata(project_id):
-    """更新项目中的图片信息"""
+    Returns:
+        每张图片的信息，顺序与uploads相同：
+        sha256（内容哈希）、duplicate_of（内容相同的已有图片）、
+        similar（相似的已有图片及汉明距离，需要开启IMAGE_PHASH_ENABLED）
+    """
+    store = get_blob_store()
+    digests = [store.put(stream) for stream, _, _ in uploads]
+    
+    # 已有的引用和已计算过的pHash
+    pipe = redis_client.pipeline(transaction=False)
+    for digest, _ in digests:
+        pipe.smembers(get_blob_refs_key(digest))
+    pipe.hmget(BLOB_PHASH_KEY, [digest for digest, _ in digests])
+    *existing_refs, known_phashes = pipe.execute()
+    
+    phashes = [None] * len(uploads)
+    candidates = [set() for _ in uploads]
+    if IMAGE_PHASH_ENABLED:
+        for index, (stream, _, _) in enumerate(uploads):
+            phashes[index] = known_phashes[index]
+            if phashes[index] is None:
+                stream.seek(0)
+                try:
+                    phashes[index] = phash(stream)
+                except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError, SyntaxError) as e:
+                    # 文件头正常但PIL无法解码：照常保存，只是不参与相似图片匹配
+                    logger.warning("Failed to compute pHash of %s: %s", uploads[index][1], e)
+        
+        pipe = redis_client.pipeline(transaction=False)
+        hashed = [index for index, image_phash in enumerate(phashes) if image_phash]
+        for index in hashed:
+            pipe.sunion(get_phash_band_keys(phashes[index]))
+        for index, members in zip(hashed, pipe.execute()):
+            candidates[index] = members
+        
+        pipe = redis_client.pipeline(transaction=False)
+        similar_digests = sorted({member.split(':')[0] for members in candidates for member in members})
+        for digest in similar_digests:
+            pipe.smembers(get_blob_refs_key(digest))
+        similar_refs = dict(zip(similar_digests, pipe.execute()))
+    
+    results = []
+    batch_refs = {}
+    pipe = redis_client.pipeline(transaction=False)
+    for (digest, size), (_, image_key, mime_type), refs, image_phash, members in zip(
+            digests, uploads, existing_refs, phashes, candidates):
+        pipe.set(image_key, image_record(digest, mime_type, size))
+        pipe.sadd(get_blob_refs_key(digest), get_image_ref(image_key))
+        # 同一批上传中内容相同的图片也算重复
+        refs = set(refs) | batch_refs.get(digest, set())
+        batch_refs.setdefault(digest, set()).add(get_image_ref(image_key))
+        similar = []
+        if image_phash:
+            pipe.hset(BLOB_PHASH_KEY, digest, image_phash)
+            for band_key in get_phash_band_keys(image_phash):
+                pipe.sadd(band_key, f"{digest}:{image_phash}")
+            for member in members:
+                other_digest, other_phash = member.split(':')
+                distance = hamming_distance(image_phash, other_phash)
+                if other_digest != digest and distance <= IMAGE_PHASH_MAX_DISTANCE:
+                    similar.extend(
+                        {"image": ref, "sha256": other_digest, "distance": distance}
+                        for ref in sorted(similar_refs.get(other_digest, ()))
+                    )
+        results.append({
+            "sha256": digest,
+            "duplicate_of": sorted(refs),
+            "similar": sorted(similar, key=lambda item: item['distance'])
+        })
+    pipe.execute()
+    return results
+
+def get_blob_refs(digests):
+    """每个blob是否仍被图片引用"""
+    pipe = redis_client.pipeline(transaction=False)
+    for digest in digests:
+        pipe.exists(get_blob_refs_key(digest))
+    return [bool(count) for count in pipe.execute()]
+
+def forget_blob(digest):
+    """blob被删除后，从pHash索引中移除"""
+    image_phash = redis_client.hget(BLOB_PHASH_KEY, digest)
+    pipe = redis_client.pipeline()
+    pipe.hdel(BLOB_PHASH_KEY, digest)
+    if image_phash:
+        for band_key in get_phash_band_keys(image_phash):
+            pipe.srem(band_key, f"{digest}:{image_phash}")
+    pipe.execute()
+
+def get_project_media_refs(project_id):
+    """项目数据和历史记录中出现的所有路径片段（文件名、目录名），项目不存在时返回None"""
     project = get_project(project_id)
     if not project:
-        return
+        return None
     
+    refs = set()
+    pending = [project, get_history(project_id, 'speech'), get_history(project_id, 'video')]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, str):
+            refs.update(part for part in value.replace('\\', '/').split('/') if part)
+    return refs
+
+def build_media_gc():
+    store = get_blob_store()
+    return MediaGarbageCollector(
+        redis_client,
+        project_roots=[VIDEO_FOLDER, SPEECH_FOLDER, UPLOAD_FOLDER],
+        scratch_roots=[TEST_FILES_DIR, VIDEO_OUTPUT_PATH],
+        # S3中的blob由存储桶的生命周期规则处理
+        blob_root=store.root if isinstance(store, LocalBlobStore) else None,
+        get_project_refs=get_project_media_refs,
+        get_blob_refs=get_blob_refs,
+        forget_blob=forget_blob,
+        grace_period=MEDIA_GC_GRACE_PERIOD,
+        quota_bytes=MEDIA_GC_QUOTA_BYTES,
+        min_evict_age=MEDIA_GC_MIN_EVICT_AGE
+    )
+
+def start_media_gc():
+    """开启了MEDIA_GC_INTERVAL时在后台线程中定期回收（多个进程同时开启时由Redis锁保证只有一个在运行）"""
+    if MEDIA_GC_INTERVAL > 0:
+        try:
+            collector = build_media_gc()
+        except ValueError as e:
+            logger.error("Media GC disabled: %s", e)
+            return
+        collector.start(MEDIA_GC_INTERVAL)
+
+def remove_image_record(image_key):
+    """删除图片记录及其对blob的引用（blob本身可能被其他图片共享，不在这里删除）"""
+    record = parse_image_record(redis_client.get(image_key))
+    pipe = redis_client.pipeline()
+    pipe.delete(image_key)
+    if record:
+        pipe.srem(get_blob_refs_key(record['sha256']), get_image_ref(image_key))
+    pipe.execute()
+
+def add_project_images(project_id, image_ids):
+    """把新上传的图片加入项目的图片列表，不重新扫描图片key
+
+    项目只有一张图片时自动选中它
+    """
+    def mutate(project):
+        images = list(project.get('images') or [])
+        existing_ids = {img.get('id') for img in images}
+        now = datetime.now().isoformat()
+        new_ids = image_ids
+        if 'images' not in project:
+            # 旧项目没有images字段，按已保存的图片重建
+            new_ids = sorted(set(get_project_image_ids(project_id)) | set(image_ids))
+        for img_id in new_ids:
+            if img_id in existing_ids:
+                continue
+            images.append({
+                "id": img_id,
+                "path": f"/api/images/{project_id}-image-{img_id}",
+                "selected": False,
+                "created_at": now
+            })
+        images.sort(key=lambda img: img['id'])
+        
+        if len(images) == 1:
+            images[0]['selected'] = True
+        
+        return {
+            'images': images,
+            'image_path': images[0]['path'] if images else None
+        }
+    
+    return modify_project(project_id, mutate)
+
+def update_project_images_metadata(project_id, auto_select_single=False):
+    """更新项目中的图片信息
+
+    Args:
+        project_id: 项目ID
+        auto_select_single: 项目只有一张图片时自动选中它（上传第一张图片时使用）
+    """
     # 获取所有图片ID
     image_ids = get_project_image_ids(project_id)
     
-    # 创建图片路径列表
-    images = []
-    for img_id in image_ids:
-        image_path = f"/api/images/{project_id}-image-{img_id}"
-        # 保持现有的selected状态，如果没有则默认为false
-        existing_image = next((img for img in project.get('images', []) if img.get('id') == img_id), None)
-        selected = existing_image.get('selected', False) if existing_image else False
+    def mutate(project):
+        # 创建图片路径列表
+        images = []
+        for img_id in image_ids:
+            image_path = f"/api/images/{project_id}-image-{img_id}"
+            # 保持现有的selected状态，如果没有则默认为false
+            existing_image = next((img for img in project.get('images', []) if img.get('id') == img_id), None)
+            selected = existing_image.get('selected', False) if existing_image else False
+            
+            images.append({
+                "id": img_id,
+                "path": image_path,
+                "selected": selected,  # 添加selected字段
+                "created_at": datetime.now().isoformat()  # 添加创建时间
+            })
         
-        images.append({
-            "id": img_id,
-            "path": image_path,
-            "selected": selected,  # 添加selected字段
-            "created_at": datetime.now().isoformat()  # 添加创建时间
-        })
-    
-    # 更新项目图片信息
-    project['images'] = images
-    
-    # 为了向后兼容，如果有图片，则第一张作为主图片
-    if images:
-        project['image_path'] = images[0]['path']
-    else:
-        project['image_path'] = None
-    
-    project['updated_at'] = datetime.now().isoformat()
-    save_project(project)
+        if auto_select_single and len(images) == 1:
+            images[0]['selected'] = True
+        
+        # 为了向后兼容，如果有图片，则第一张作为主图片
+        return {
+            'images': images,
+            'image_path': images[0]['path'] if images else None
+        }
     
-    return project
+    return modify_project(project_id, mutate)
 
 def delete_project_image(project_id, image_id=None, image_path=None):
     """删除项目图片
@@ -185,8 +741,8 @@ def delete_project_image(project_id, image_id=None, image_path=None):
     if image_id is not None:
         # 直接使用图片ID
         image_key = f"image:{project_id}-image-{image_id}"
-        redis_client.delete(image_key)
-        print(f"Deleted image {image_key} from Redis")
+        remove_image_record(image_key)
+        logger.info("Deleted image %s from Redis", image_key)
         return True
         
     if not image_path:
@@ -201,8 +757,8 @@ def delete_project_image(project_id, image_id=None, image_path=None):
                 try:
                     img_id = int(path_parts[1])
                     image_key = f"image:{project_id}-image-{img_id}"
-                    redis_client.delete(image_key)
-                    print(f"Deleted image {image_key} from Redis")
+                    remove_image_record(image_key)
+                    logger.info("Deleted image %s from Redis", image_key)
                     return True
                 except ValueError:
                     pass
@@ -212,7 +768,7 @@ def delete_project_image(project_id, image_id=None, image_path=None):
         parts = image_path.strip('/').split('/')
         if len(parts) >= 4 and parts[0] == 'api' and parts[1] == 'images':
             if parts[2] != project_id:
-                print(f"Warning: Project ID mismatch in image path: {image_path} vs {project_id}")
+                logger.warning("Project ID mismatch in image path: %s vs %s", image_path, project_id)
                 return False
                 
             filename = parts[3]
@@ -220,11 +776,547 @@ def delete_project_image(project_id, image_id=None, image_path=None):
             
             # 删除图片
             redis_client.delete(image_key)
-            print(f"Deleted image {image_key} from Redis (old format)")
+            logger.info("Deleted image %s from Redis (old format)", image_key)
             return True
             
     return False
 
+def get_selected_image_ids(project):
+    """获取项目中被选中的图片ID列表，按ID排序
+
+    如果没有任何图片被选中，则退回到项目的第一张图片
+    """
+    images = project.get('images') or []
+    selected_ids = sorted(img['id'] for img in images if img.get('selected'))
+    if selected_ids:
+        return selected_ids
+
+    image_ids = sorted(img['id'] for img in images if 'id' in img)
+    return image_ids[:1]
+
+def get_latest_speech_file(project):
+    """获取项目最近一次生成的语音文件路径，不存在则返回None"""
+    speeches = project.get('speech') or []
+    if not speeches:
+        return None
+
+    speech_file = os.path.join(SPEECH_FOLDER, project['id'], os.path.basename(speeches[-1]['path']))
+    return speech_file if os.path.exists(speech_file) else None
+
+def new_speech_entry(path, language):
+    return {
+        'path': path,
+        'created_at': datetime.now().isoformat(),
+        'language': language
+    }
+
+def record_speech(project_id, path, language):
+    """记录新生成的语音：项目的speech只保留当前这一条（旧文件已被TTS客户端删除），完整记录进入历史列表"""
+    entry = new_speech_entry(path, language)
+    # 先写历史再更新项目版本，读到新版本的请求一定也读到新的历史
+    push_history(project_id, 'speech', entry)
+    update_project(project_id, {'speech': [entry]})
+    return entry
+
+def previous_video_entry(video):
+    """当前视频信息去掉嵌套的original_video，用作新视频的original_video和历史记录"""
+    previous = dict(video)
+    previous.pop('original_video', None)
+    return previous
+
+def replaced_video_entry(video):
+    """被新视频替换的项目视频对应的历史记录；还没有生成出视频（处理中、失败）时返回None"""
+    if not video or not video.get('url'):
+        return None
+    return previous_video_entry(video)
+
+def record_replaced_video(project_id, video):
+    """替换项目视频之前把旧视频写入历史记录"""
+    entry = replaced_video_entry(video)
+    if entry:
+        push_history(project_id, 'video', entry)
+
+def extract_video_description(script):
+    """从脚本中提取视频描述（"视频描述:"与"旁白文本:"之间的部分），用作Kling的prompt"""
+    parts = (script or "").split("视频描述:", 1)
+    if len(parts) < 2:
+        return ""
+    parts = parts[1].strip().split("旁白文本:", 1)
+    return parts[0].strip() if len(parts) > 1 else ""
+
+def parse_crossfade(value):
+    """请求中片段之间的交叉淡化时长（秒），不是非负数时抛出ValueError"""
+    try:
+        crossfade = float(value or 0)
+    except (TypeError, ValueError):
+        raise ValueError("crossfade must be a number of seconds")
+    if not math.isfinite(crossfade) or crossfade < 0:
+        raise ValueError("crossfade must be a non-negative number of seconds")
+    return crossfade
+
+def extract_narration(script):
+    """从脚本中提取旁白文本，无法识别格式时返回整个脚本"""
+    text = None
+    # Try to identify script format and extract narration
+    if "旁白文本:" in script:
+        text = script.split("旁白文本:", 1)[1].strip()
+    elif "旁白文本：" in script:  # Handle Chinese colon
+        text = script.split("旁白文本：", 1)[1].strip()
+
+    if not text:
+        # If can't extract narration, use entire script
+        return script
+
+    # Remove any remaining "旁白文本:" prefix
+    if text.startswith("旁白文本:"):
+        text = text.replace("旁白文本:", "", 1).strip()
+    elif text.startswith("旁白文本："):
+        text = text.replace("旁白文本：", "", 1).strip()
+    return text
+
+def get_video_status(project):
+    """生成/video/status的响应内容（Flask和ASGI两条路径共用）"""
+    # 检查是否有视频信息
+    if 'video' not in project or not project['video']:
+        return {
+            "status": "not_generated",
+            "message": "Video has not been generated yet"
+        }
+
+    video_info = project['video']
+
+    # 确保视频URL格式正确
+    if 'url' in video_info and video_info['url'].startswith('/api/'):
+        video_info['url'] = video_info['url'][4:]  # 去掉开头的/api
+
+    # 检查视频文件是否存在
+    if 'file_path' in video_info:
+        video_path = video_info['file_path']
+        if os.path.exists(video_path):
+            return {
+                "status": "completed",
+                "video": video_info
+            }
+        else:
+            return {
+                "status": "file_missing",
+                "message": "Video file is missing, may need to regenerate"
+            }
+
+    # 尚未添加音频的视频使用local_path
+    if video_info.get('status') == 'completed' and video_info.get('local_path'):
+        if os.path.exists(video_info['local_path']):
+            return {
+                "status": "completed",
+                "video": video_info
+            }
+        return {
+            "status": "file_missing",
+            "message": "Video file is missing, may need to regenerate"
+        }
+
+    if video_info.get('status') == 'failed':
+        return {
+            "status": "failed",
+            "error": video_info.get('error', 'Unknown error')
+        }
+
+    # 检查是否正在处理中
+    if 'status' in video_info and video_info['status'] == 'processing':
+        return {
+            "status": "processing",
+            "message": "Video generation is in progress",
+            "started_at": video_info.get('started_at')
+        }
+
+    return {
+        "status": "unknown",
+        "video_info": video_info
+    }
+
+def generate_image_clip(project_id, image_id, description, output_dir, duration=None):
+    """为单张图片生成一个视频片段
+
+    Args:
+        project_id: 项目ID
+        image_id: 图片ID
+        description: 视频描述（作为Kling的prompt）
+        output_dir: 视频保存目录
+        duration: 可选，片段时长（秒），默认使用生成器的配置
+
+    Returns:
+        视频片段信息字典，包含image_id和status
+    """
+    image_key = f"image:{project_id}-image-{image_id}"
+    # 直接按key读取图片数据，不做keyspace扫描
+    with time_stage('redis_fetch', 'redis'):
+        image_value = redis_client.get(image_key)
+    if not image_value:
+        return {"image_id": image_id, "status": "failed", "error": f"Image not found: {image_key}"}
+    # 由生成器准备提交的图片（Kling会缩小到输出分辨率并缓存）
+    image_data = video_generator.prepare_image(image_value)
+
+    clip = video_generator.generate_video(
+        image_path=f"/api/images/{project_id}-image-{image_id}",
+        image_data=image_data,
+        script=description,
+        output_dir=output_dir,
+        duration=duration,
+    )
+    return finalize_clip(clip, image_id)
+
+def finalize_clip(clip, image_id):
+    """整理生成器返回的片段信息：去掉URL的/api前缀并记录image_id"""
+    # 确保生成的视频结果中URL格式正确，移除可能的/api前缀
+    if 'url' in clip and clip['url'] and clip['url'].startswith('/api/'):
+        clip['url'] = clip['url'][4:]  # 去掉开头的/api
+
+    clip['image_id'] = image_id
+    return clip
+
+def create_project_video(project, description, crossfade=0.0):
+    """为项目选中的图片生成视频片段，并拼接成一个完整的视频
+
+    Args:
+        project: 项目数据
+        description: 视频描述（作为Kling的prompt）
+        crossfade: 片段之间的交叉淡化时长（秒）
+
+    Returns:
+        视频信息字典，clips中包含所有片段
+
+    Raises:
+        ValueError: 没有选中的图片
+        RuntimeError: 所有片段都生成失败或拼接失败
+    """
+    global video_generator
+    if video_generator is None:
+        video_generator = get_video_generator()
+
+    plan = plan_project_video(project, crossfade)
+
+    # 并行生成每张图片对应的视频片段
+    image_ids = plan['image_ids']
+    max_workers = min(len(image_ids), KLING_MAX_PARALLEL_TASKS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        clips = list(executor.map(
+            bind_trace(lambda img_id: generate_image_clip(project['id'], img_id, description, plan['output_dir'], plan['clip_duration'])),
+            image_ids
+        ))
+
+    return compose_project_video(project['id'], plan, clips, crossfade)
+
+def plan_project_video(project, crossfade=0.0):
+    """确定项目视频要使用的图片、片段数量和时长
+
+    Args:
+        project: 项目数据
+        crossfade: 片段之间的交叉淡化时长（秒）
+
+    Returns:
+        字典，包含output_dir、image_ids（每个片段一个）、clip_duration和timing_plan
+
+    Raises:
+        ValueError: 没有选中的图片
+    """
+    # 获取项目特定的视频文件夹
+    project_video_folder = os.path.join(VIDEO_FOLDER, project['id'])
+    os.makedirs(project_video_folder, exist_ok=True)
+    logger.debug("Project video folder: %s", project_video_folder)
+
+    # 选择要使用的图片：按用户的selected标记，每张图片提交一个Kling任务
+    image_ids = get_selected_image_ids(project)
+    if not image_ids:
+        raise ValueError("No image has been selected for this project")
+    logger.debug("Using selected images: %s", image_ids)
+
+    # 如果已经生成了旁白，根据旁白时长规划片段时长和数量，避免合成时大幅变速
+    clip_duration = None
+    timing_plan = None
+    speech_file = get_latest_speech_file(project)
+    if speech_file:
+        timing_plan = plan_clip_timing(
+            get_duration(speech_file),
+            len(image_ids),
+            clip_durations=KLING_CLIP_DURATIONS,
+            max_clips=KLING_MAX_CLIPS,
+            crossfade=crossfade
+        )
+        clip_duration = timing_plan['clip_duration']
+        # 片段数量多于图片数量时循环使用选中的图片
+        image_ids = [image_ids[i % len(image_ids)] for i in range(timing_plan['clip_count'])]
+        logger.debug("Clip timing plan: %s", timing_plan)
+
+    return {
+        'output_dir': project_video_folder,
+        'image_ids': image_ids,
+        'clip_duration': clip_duration,
+        'timing_plan': timing_plan
+    }
+
+def compose_project_video(project_id, plan, clips, crossfade=0.0):
+    """把生成的片段拼接成项目视频
+
+    Args:
+        project_id: 项目ID
+        plan: plan_project_video的返回值
+        clips: 片段信息列表
+        crossfade: 片段之间的交叉淡化时长（秒）
+
+    Returns:
+        视频信息字典，clips中包含所有片段
+
+    Raises:
+        RuntimeError: 所有片段都生成失败或拼接失败
+    """
+    completed_clips = [clip for clip in clips if clip.get('status') == 'completed']
+    if not completed_clips:
+        errors = "; ".join(f"image {clip['image_id']}: {clip.get('error', 'Unknown error')}" for clip in clips)
+        raise RuntimeError(errors)
+
+    # 第一个成功的片段作为主视频（兼容只读取单个视频的代码），全部片段保存在clips中
+    video_result = dict(completed_clips[0])
+    video_result['clips'] = clips
+    if plan['timing_plan']:
+        video_result['timing_plan'] = plan['timing_plan']
+
+    # 多个片段时拼接成一个完整的视频，旁白随后叠加在拼接后的时间线上
+    clip_files = [clip['local_path'] for clip in completed_clips if clip.get('local_path')]
+    if len(clip_files) > 1:
+        output_filename = f"combined_{uuid.uuid4()}.mp4"
+        output_path = os.path.join(plan['output_dir'], output_filename)
+        compose_result = compose_clips(clip_files, output_path, crossfade=crossfade, overwrite=True)
+        if not compose_result["success"]:
+            raise RuntimeError(f"Failed to compose video clips: {compose_result['error']}")
+
+        video_result.pop('image_id', None)
+        video_result.update({
+            'status': 'completed',
+            'local_path': output_path,
+            'url': f"/videos/{project_id}/{output_filename}",
+            'duration': compose_result['output']['duration'],
+            'crossfade': crossfade
+        })
+
+    return video_result
+
+def run_video_job(project_id, job_id, description, crossfade=0.0):
+    """后台任务：生成项目视频，完成后更新项目视频信息
+
+    Args:
+        project_id: 项目ID
+        job_id: 任务ID，项目视频已被新的任务替换时放弃更新
+        description: 视频描述（作为Kling的prompt）
+        crossfade: 片段之间的交叉淡化时长（秒）
+    """
+    project = get_project(project_id)
+    if not project:
+        return
+
+    try:
+        video_result = create_project_video(project, description, crossfade)
+    except Exception as e:
+        logger.exception("Error in video job %s: %s", job_id, e)
+        video_result = {'status': 'failed', 'error': str(e)}
+    video_result['job_id'] = job_id
+
+    def mutate(project):
+        if (project.get('video') or {}).get('job_id') != job_id:
+            logger.info("Video job %s superseded, skipping project update", job_id)
+            return None
+        # 只替换本任务的占位信息，之前的视频在提交任务时已写入历史
+        return {'video': video_result}
+
+    modify_project(project_id, mutate)
+
+def is_current_final_render(project_id, render_id):
+    """项目视频的final是否仍是这次渲染（没有被新的渲染替换）"""
+    project = get_project(project_id, use_cache=False)
+    video = (project or {}).get('video') or {}
+    return (video.get('final') or {}).get('render_id') == render_id
+
+def render_final_video(project_id, render_id, video_file, audio_file, output_path):
+    """在后台用final配置渲染成片和可选的低分辨率版本，完成后更新项目视频信息
+
+    Args:
+        project_id: 项目ID
+        render_id: 本次渲染的ID，项目视频已被新的渲染替换时放弃更新
+        video_file: 输入视频文件路径
+        audio_file: 输入音频文件路径
+        output_path: 成片输出路径，实际文件名中带有render_id
+    """
+    try:
+        output_dir = os.path.dirname(output_path)
+        output_name = os.path.splitext(os.path.basename(output_path))[0]
+        # 每次渲染写入自己的文件，较早的渲染晚完成时不会覆盖较新成片的文件
+        final_path = os.path.join(output_dir, f"{output_name}.{render_id}.mp4")
+
+        result = merge_audio_video(
+            video_file, audio_file, final_path, True,
+            max_tempo_deviation=AUDIO_MAX_TEMPO_DEVIATION,
+            extend=VIDEO_EXTEND_MODE,
+            profile='final'
+        )
+
+        if result["success"]:
+            # 生成较低分辨率的版本（已被新的渲染替换时不再编码）
+            renditions = []
+            for height in FINAL_RENDITION_HEIGHTS:
+                if not is_current_final_render(project_id, render_id):
+                    break
+                rendition_filename = f"{output_name}_{height}p.{render_id}.mp4"
+                rendition_path = os.path.join(output_dir, rendition_filename)
+                try:
+                    encode_rendition(final_path, rendition_path, height)
+                    renditions.append({
+                        'height': height,
+                        'file_path': rendition_path,
+                        'url': f"/videos/{project_id}/{rendition_filename}"
+                    })
+                except Exception as e:
+                    logger.error("Failed to encode %sp rendition: %s", height, e)
+
+            final_info = {
+                'status': 'completed',
+                'render_id': render_id,
+                'file_path': final_path,
+                'url': f"/videos/{project_id}/{os.path.basename(final_path)}",
+                'duration': result['output']['duration'],
+                'renditions': renditions,
+                'completed_at': datetime.now().isoformat()
+            }
+        else:
+            if os.path.exists(final_path):
+                os.remove(final_path)
+            final_info = {
+                'status': 'failed',
+                'render_id': render_id,
+                'error': result['error']
+            }
+
+        def mutate(project):
+            video = project.get('video')
+            if not video:
+                return None
+            if (video.get('final') or {}).get('render_id') != render_id:
+                logger.info("Final render %s superseded, skipping project update", render_id)
+                return None
+
+            video['final'] = final_info
+            if final_info['status'] == 'completed':
+                video['file_path'] = final_info['file_path']
+                video['url'] = final_info['url']
+                video['duration'] = final_info['duration']
+                if HLS_ENABLED:
+                    video['hls'] = {'status': 'processing', 'render_id': render_id}
+            return {'video': video}
+
+        project = modify_project(project_id, mutate)
+
+        if not project and final_info['status'] == 'completed':
+            # 没有被项目引用的输出直接删除，不用等媒体回收
+            for path in [final_path] + [r['file_path'] for r in final_info['renditions']]:
+                if os.path.exists(path):
+                    os.remove(path)
+        # 成片完成后在后台打包HLS
+        elif project and HLS_ENABLED and final_info['status'] == 'completed':
+            submit_job('package_hls', project_id, render_id, final_path)
+    except Exception as e:
+        logger.exception("Error rendering final video: %s", e)
+
+def package_video_hls(project_id, render_id, video_path):
+    """在后台把成片打包为多码率HLS，输出到项目视频目录下该渲染自己的hls.{render_id}文件夹
+
+    Args:
+        project_id: 项目ID
+        render_id: 成片的渲染ID，项目视频已被新的渲染替换时放弃更新
+        video_path: 成片文件路径
+    """
+    project_video_folder = os.path.join(VIDEO_FOLDER, project_id)
+    # 每次渲染使用自己的目录，项目切换到新的播放列表之前旧的一直可以访问
+    hls_dirname = f"hls.{render_id}"
+    hls_dir = os.path.join(project_video_folder, hls_dirname)
+    try:
+        result = package_hls(video_path, hls_dir, segment_duration=HLS_SEGMENT_DURATION)
+        hls_info = {
+            'status': 'completed',
+            'render_id': render_id,
+            'url': f"/videos/{project_id}/{hls_dirname}/{os.path.basename(result['playlist'])}",
+            'renditions': [
+                {'height': r['height'], 'bandwidth': r['bandwidth']} for r in result['renditions']
+            ],
+            'completed_at': datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.exception("Error packaging HLS: %s", e)
+        hls_info = {'status': 'failed', 'render_id': render_id, 'error': str(e)}
+
+    def mutate(project):
+        video = project.get('video')
+        if not video:
+            return None
+        if (video.get('hls') or {}).get('render_id') != render_id:
+            logger.info("HLS packaging %s superseded, skipping project update", render_id)
+            return None
+        video['hls'] = hls_info
+        return {'video': video}
+
+    project = modify_project(project_id, mutate)
+
+    if not project or hls_info['status'] != 'completed':
+        if os.path.exists(hls_dir):
+            shutil.rmtree(hls_dir)
+        return
+    # 项目已指向新的播放列表，删除之前的HLS输出（包括旧版本的hls文件夹）；
+    # 更新的渲染要等它的成片完成后才会开始打包，这时还没有它的目录
+    for name in os.listdir(project_video_folder):
+        path = os.path.join(project_video_folder, name)
+        if name != hls_dirname and (name == 'hls' or name.startswith('hls.')) and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # 接续客户端traceparent中的trace，没有则开始新的trace
+    g.request_span = start_span(
+        f"{request.method} {request.endpoint or 'unmatched'}", 'server',
+        {'http.method': request.method, 'http.target': request.path},
+        parent=parse_traceparent(request.headers.get('traceparent'))
+    )
+
+@app.after_request
+def record_request_metrics(response):
+    """请求耗时和响应大小，按视图函数名（与ASGI处理函数同名）和状态码统计"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        observe_http(request.method, request.endpoint or 'unmatched', response.status_code,
+                     time.perf_counter() - started, response.content_length)
+    span = g.get('request_span', (None, None))[0]
+    if span is not None:
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f"HTTP {response.status_code}")
+        response.headers['X-Trace-Id'] = span.trace_id
+    return response
+
+@app.teardown_request
+def end_request_span(error=None):
+    span, token = g.pop('request_span', (None, None))
+    end_span(span, token, error)
+
+@app.errorhandler(ProjectConflictError)
+def handle_project_conflict(error):
+    """项目并发修改的重试用完时返回409，客户端可以重新读取后再试"""
+    logger.warning("%s", error)
+    return jsonify({"error": str(error)}), 409
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式的指标（所有进程的累计值）"""
+    response = make_response(metrics_registry.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
 @app.route('/')
 def index():
     """Serve a simple welcome page with API documentation link"""
@@ -330,7 +1422,8 @@ def create_project():
         "image_path": None,
         "images": [],  # 新增字段，存储所有图片信息
         "script": None,
-        "video": None
+        "video": None,
+        "version": 0  # 每次修改加1，用于乐观并发控制
     }
     
     save_project(project_data)
@@ -399,9 +1492,9 @@ def generate_script(project_id):
         user_prompt = data.get('user_prompt')      # 修改为前端发送的参数名
         
         # 记录接收到的prompt
-        print(f"Received prompts for project {project_id}:")
-        print(f"System prompt: {system_prompt}")
-        print(f"User prompt: {user_prompt}")
+        logger.info("Received prompts for project %s", project_id)
+        logger.debug("System prompt: %s", redact(system_prompt))
+        logger.debug("User prompt: %s", redact(user_prompt))
         
         # 保存prompt模板到项目中
         if system_prompt is not None or user_prompt is not None:
@@ -410,8 +1503,8 @@ def generate_script(project_id):
                 'user_prompt': user_prompt,
                 'updated_at': datetime.now().isoformat()
             }
-            save_project(project)
-            print(f"Saved prompt template to project: {project['prompt_template']}")
+            update_project(project_id, {'prompt_template': project['prompt_template']})
+            logger.debug("Saved prompt template to project: %s", redact(project['prompt_template']))
         
         # 处理所有选中的图片
         processed_images = []
@@ -420,23 +1513,17 @@ def generate_script(project_id):
                 img_id = int(img_id)
                 # 获取图片数据
                 image_key = f"image:{project_id}-image-{img_id}"
-                data_url = redis_client.get(image_key)
+                try:
+                    image = load_image(redis_client, image_key)
+                except ValueError:
+                    return jsonify({"error": f"Invalid image format for image {img_id}"}), 500
                 
-                if not data_url:
+                if not image:
                     return jsonify({"error": f"Image {img_id} not found in database"}), 404
                 
-                # 处理data URL
-                if data_url.startswith('data:'):
-                    parts = data_url.split(',', 1)
-                    if len(parts) < 2:
-                        return jsonify({"error": f"Invalid image format for image {img_id}"}), 500
-                    base64_data = parts[1]
-                else:
-                    base64_data = data_url
-                
                 # 创建临时文件
                 with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                    temp_file.write(base64.b64decode(base64_data))
+                    temp_file.write(image[1])
                     processed_images.append({
                         'id': img_id,
                         'path': temp_file.name
@@ -455,7 +1542,7 @@ def generate_script(project_id):
                     system_prompt = saved_template.get('system_prompt')
                 if user_prompt is None:
                     user_prompt = saved_template.get('user_prompt')
-                print(f"Using saved prompts - System: {system_prompt}, User: {user_prompt}")
+                logger.debug("Using saved prompts - System: %s, User: %s", redact(system_prompt), redact(user_prompt))
             
             # 生成脚本
             script = llm_client.generate_script(
@@ -471,7 +1558,11 @@ def generate_script(project_id):
             project['script'] = script
             project['selected_images'] = [{'id': img['id']} for img in processed_images]
             project['updated_at'] = datetime.now().isoformat()
-            save_project(project)
+            update_project(project_id, {
+                'script': project['script'],
+                'selected_images': project['selected_images'],
+                'updated_at': project['updated_at']
+            })
             
             return jsonify({
                 "success": True,
@@ -484,9 +1575,10 @@ def generate_script(project_id):
                 if os.path.exists(img['path']):
                     os.unlink(img['path'])
                     
+    except ProjectConflictError:
+        raise
     except Exception as e:
-        print(f"Error in generate_script: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in generate_script: %s", e)
         return jsonify({"error": f"Failed to generate script: {str(e)}"}), 500
 
 @app.route('/api/projects/<project_id>/script', methods=['PUT'])
@@ -501,15 +1593,19 @@ def update_script(project_id):
     if not data or 'script' not in data:
         return jsonify({"error": "Script content is required"}), 400
     
-    # Update project with the new script
+    # Update project with the new script; a client sending the version it loaded gets
+    # 409 instead of silently overwriting changes made since
     project['script'] = data['script']
-    project['updated_at'] = datetime.now().isoformat()
-    save_project(project)
+    try:
+        project['version'] = update_project(project_id, {'script': project['script']}, expected_version=data.get('version'))
+    except ProjectConflictError as e:
+        return jsonify({"error": str(e), "version": (get_project(project_id) or {}).get('version')}), 409
     
     return jsonify({
         "success": True,
         "message": "Script updated successfully",
-        "script": project['script']
+        "script": project['script'],
+        "version": project['version']
     })
 
 @app.route('/api/projects/<project_id>/video/generate', methods=['POST'])
@@ -534,78 +1630,56 @@ def generate_video(project_id):
         return jsonify({"error": "No script has been created for this project"}), 400
     
 
-    print(f"Generating video for project: {project_id}")
-    print(f"Project script: {project['script']}")
-    print(f"Project images: {project['images']}")
-    print(f"Project image_path: {project['image_path']}")
+    logger.info("Generating video for project: %s", project_id)
+    logger.debug("Project script: %s", redact(project['script']))
+    logger.debug("Project images: %s", project['images'])
+    logger.debug("Project image_path: %s", project['image_path'])
 
-    script = project['script']
-
-    
     # 提取脚本文本 - 视频描述部分用于生成视频
-    description = ""
-    narration = ""
-
-    if script:
-        parts = script.split("视频描述:", 1)
-        print(f"Parts: {parts}")
-        if len(parts) > 1:
-            allscripts = parts[1].strip()
-        parts2 = allscripts.split("旁白文本:", 1)
-        if len(parts2) > 1:
-            description = parts2[0].strip()
-            narration = parts2[1].strip()
-
-    print(f"Extracted description: {description}")
-    print(f"Extracted narration: {narration}")
+    description = extract_video_description(project['script'])
+    logger.debug("Extracted description: %s", redact(description))
 
+    # 片段之间的交叉淡化时长（秒），默认直接拼接
+    data = request.get_json(silent=True) or {}
     try:
-        # 获取项目特定的视频文件夹
-        project_video_folder = os.path.join(VIDEO_FOLDER, project_id)
-        os.makedirs(project_video_folder, exist_ok=True)
-        
-        print(f"Project video folder: {project_video_folder}")
-        # 从请求中获取参数
-
-        
-        # print(f"Data: {data}")
-        # # 从请求中提取配置参数或使用默认值
-        # static_mask = data.get('static_mask', None)
-        # dynamic_masks = data.get('dynamic_masks', None)
-        
-
-        # 选择要使用的图片
-        # 从redis中获取图片， 模糊匹配
-        image_key = f"image:{project_id}-image-*"
-        imagesss = redis_client.keys(image_key)
-
-        # 从imagesss中选择第一张图片
-        image_path = imagesss[0]
-        print(f"Using image path: {image_path}")
+        crossfade = parse_crossfade(data.get('crossfade', 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not get_selected_image_ids(project):
+        return jsonify({"error": "No image has been selected for this project"}), 400
+
+    previous_video = project.get('video')
+    # 异步模式：放入后台任务，立即返回，客户端通过 /video/status 查询进度
+    if data.get('async') or request.args.get('async', 'false').lower() == 'true':
+        job_id = str(uuid.uuid4())
+        project['video'] = {
+            'status': 'processing',
+            'job_id': job_id,
+            'started_at': datetime.now().isoformat()
+        }
+        # 旧视频在这里被占位信息替换，任务完成时只替换这个占位信息
+        record_replaced_video(project_id, previous_video)
+        update_project(project_id, {'video': project['video']})
+        submit_job('generate_video', project_id, job_id, description, crossfade)
+        return jsonify({
+            "success": True,
+            "video": project['video']
+        }), 202
 
-        image_data = redis_client.get(image_path)
+    try:
+        video_result = create_project_video(project, description, crossfade)
 
-        # 调用视频生成器
-        video_result = video_generator.generate_video(
-            image_path=image_path,
-            image_data=image_data,
-            script=description,  # 使用提取的旁白文本
-            output_dir=project_video_folder,
-        )
-        
-        # 确保生成的视频结果中URL格式正确，移除可能的/api前缀
-        if 'url' in video_result and video_result['url'].startswith('/api/'):
-            video_result['url'] = video_result['url'][4:]  # 去掉开头的/api
-            
         # 更新项目的视频信息
-        project['video'] = video_result
-        project['updated_at'] = datetime.now().isoformat()
-        save_project(project)
+        record_replaced_video(project_id, previous_video)
+        update_project(project_id, {'video': video_result})
         
         return jsonify({
             "success": True,
             "video": video_result
         })
+    except ProjectConflictError:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to generate video: {str(e)}"}), 500
 
@@ -618,51 +1692,23 @@ def check_video_status(project_id):
         if not project:
             return jsonify({"error": "Project not found"}), 404
         
-        # 检查是否有视频信息
-        if 'video' not in project or not project['video']:
-            return jsonify({
-                "status": "not_generated",
-                "message": "Video has not been generated yet"
-            })
-        
-        video_info = project['video']
-        
-        # 确保视频URL格式正确
-        if 'url' in video_info and video_info['url'].startswith('/api/'):
-            video_info['url'] = video_info['url'][4:]  # 去掉开头的/api
-        
-        # 检查视频文件是否存在
-        if 'file_path' in video_info:
-            video_path = video_info['file_path']
-            if os.path.exists(video_path):
-                return jsonify({
-                    "status": "completed",
-                    "video": video_info
-                })
-            else:
-                return jsonify({
-                    "status": "file_missing",
-                    "message": "Video file is missing, may need to regenerate"
-                })
-        
-        # 检查是否正在处理中
-        if 'status' in video_info and video_info['status'] == 'processing':
-            return jsonify({
-                "status": "processing",
-                "message": "Video generation is in progress",
-                "started_at": video_info.get('started_at')
-            })
-        
-        return jsonify({
-            "status": "unknown",
-            "video_info": video_info
-        })
+        return jsonify(get_video_status(project))
     
     except Exception as e:
-        app.logger.error(f"Error checking video status: {str(e)}")
-        app.logger.error(traceback.format_exc())
+        logger.exception("Error checking video status: %s", e)
         return jsonify({"error": f"Failed to check video status: {str(e)}"}), 500
 
+@app.route('/api/projects/<project_id>/video/history', methods=['GET'])
+def get_video_history(project_id):
+    """获取项目之前的视频版本（最多PROJECT_HISTORY_LIMIT条，最新的在最后）"""
+    if not get_project(project_id):
+        return jsonify({"error": "Project not found"}), 404
+    
+    return jsonify({
+        "success": True,
+        "videos": get_history(project_id, 'video')
+    })
+
 @app.route('/api/projects/<project_id>', methods=['GET'])
 def get_project_details(project_id):
     """Get project details"""
@@ -671,7 +1717,10 @@ def get_project_details(project_id):
     if not project:
         return jsonify({"error": "Project not found"}), 404
     
-    # 确保视频URL格式正确
+    return jsonify({"success": True, "project": format_project_urls(project)})
+
+def format_project_urls(project):
+    """确保视频URL格式正确（前端会自己加上/api前缀）"""
     if 'video' in project and project['video']:
         if 'url' in project['video'] and project['video']['url'].startswith('/api/'):
             project['video']['url'] = project['video']['url'][4:]  # 去掉开头的/api
@@ -680,8 +1729,61 @@ def get_project_details(project_id):
         if 'original_video' in project['video'] and project['video']['original_video']:
             if 'url' in project['video']['original_video'] and project['video']['original_video']['url'].startswith('/api/'):
                 project['video']['original_video']['url'] = project['video']['original_video']['url'][4:]
-    
-    return jsonify({"success": True, "project": project})
+    return project
+
+@app.route('/api/projects/<project_id>/bundle', methods=['GET'])
+def get_project_bundle(project_id):
+    """一次返回项目页面需要的全部数据：项目、图片、语音、项目的prompt模板和模板列表
+
+    项目、语音历史和模板key在同一个pipeline中读取，模板内容随后一次MGET。
+    支持If-None-Match条件请求，ETag由项目版本、updated_at、语音历史和模板的updatedAt生成。
+    """
+    project_key = get_project_key(project_id)
+    project_data = project_cache.get(project_key)
+    generation = project_cache.generation
+    
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.lrange(get_history_key(project_id, 'speech'), 0, -1)
+    pipe.keys("template:*")
+    if project_data is None:
+        pipe.hgetall(project_key)
+    results = pipe.execute(raise_on_error=False)
+    speech_history, template_keys = results[0], results[1]
+    
+    if project_data is not None:
+        project = decode_project_fields(project_data)
+    elif isinstance(results[2], redis.ResponseError):
+        # 旧格式的项目由get_project转换
+        project = get_project(project_id)
+    elif results[2]:
+        project_cache.put(project_key, results[2], generation)
+        project = decode_project_fields(results[2])
+    else:
+        project = None
+    if not project:
+        return jsonify({"error": "Project not found"}), 404
+    project.setdefault('version', 0)
+    
+    templates = sort_templates(redis_client.mget(template_keys) if template_keys else [])
+    etag_source = json.dumps([
+        project['version'],
+        project.get('updated_at'),
+        # 语音历史不在项目文档中，和项目版本不是原子更新的
+        speech_history,
+        [(template.get('id'), template.get('updatedAt')) for template in templates]
+    ])
+    
+    response = jsonify({
+        "success": True,
+        "project": format_project_urls(project),
+        "images": project['images'] if 'images' in project else build_project_images(project_id),
+        "speeches": [json.loads(entry) for entry in speech_history] or project.get('speech', []),
+        "template": get_project_prompt_template(project),
+        "templates": templates
+    })
+    response.set_etag(hashlib.sha1(etag_source.encode('utf-8')).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/projects', methods=['GET'])
 def list_projects():
@@ -690,17 +1792,24 @@ def list_projects():
     project_keys = redis_client.keys('project:*')
     projects = []
     
+    # 一次往返读取所有项目；旧格式的项目由get_project转换
+    pipe = redis_client.pipeline(transaction=False)
     for key in project_keys:
-        project_data = redis_client.get(key)
+        pipe.hgetall(key)
+    for key, project_data in zip(project_keys, pipe.execute(raise_on_error=False)):
+        if isinstance(project_data, redis.ResponseError):
+            project_data = get_project(key.split(':', 1)[1])
+        elif project_data:
+            project_data = decode_project_fields(project_data)
         if project_data:
-            projects.append(json.loads(project_data))
+            projects.append(project_data)
     
     return jsonify({"success": True, "projects": projects})
 
 @app.route('/api/videos/<path:filename>', methods=['GET'])
 def serve_video(filename):
     """Serve video files"""
-    return send_from_directory(VIDEO_FOLDER, filename)
+    return send_media_file(VIDEO_FOLDER, filename, 'videos')
 
 @app.route('/api/images/<path:image_path>', methods=['GET'])
 def serve_project_image(image_path):
@@ -719,35 +1828,31 @@ def serve_project_image(image_path):
     except ValueError:
         return jsonify({"error": "Invalid image ID"}), 400
     
-    # 获取图片数据
+    # 获取图片记录
     image_key = f"image:{project_id}-image-{image_id}"
-    data_url = redis_client.get(image_key)
+    image_value = redis_client.get(image_key)
     
-    if not data_url:
+    if not image_value:
         return jsonify({"error": "Image not found"}), 404
     
-    # 检查是否已经是data URL格式
-    if data_url.startswith('data:'):
-        # 提取MIME类型和base64数据
-        parts = data_url.split(',', 1)
-        if len(parts) < 2:
-            return jsonify({"error": "Invalid image format"}), 500
-            
-        mime_type = parts[0].split(';')[0].split(':')[1]
-        base64_data = parts[1]
-    else:
-        # 兼容旧格式
-        mime_type = 'image/jpeg'  # 默认MIME类型
-        base64_data = data_url
+    # blob存储在本地时直接发送文件，ETag使用内容哈希
+    record = parse_image_record(image_value)
+    blob_path = record and get_blob_store().local_path(record['sha256'])
+    if blob_path and os.path.exists(blob_path):
+        response = send_file(blob_path, mimetype=record['mime_type'], conditional=True, etag=record['sha256'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     
     try:
-        # 解码base64数据
-        image_data = base64.b64decode(base64_data)
+        # 旧图片（data URL）或其他blob存储
+        mime_type, image_data = decode_image_value(image_value)
         
         # 返回正确的Content-Type
         response = make_response(image_data)
         response.headers.set('Content-Type', mime_type)
         return response
+    except KeyError:
+        return jsonify({"error": "Image not found"}), 404
     except Exception as e:
         return jsonify({"error": f"Failed to process image: {str(e)}"}), 500
 
@@ -769,20 +1874,11 @@ def upload_project_image(project_id):
     
     if file and allowed_file(file.filename):
         try:
-            # 读取文件数据
-            file_data = file.read()
-            
-            # 确定MIME类型
-            file_ext = file.filename.split('.')[-1].lower() if '.' in file.filename else 'jpg'
-            mime_type = {
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'gif': 'image/gif'
-            }.get(file_ext, 'image/jpeg')
-            
-            # 转换为base64
-            base64_encoded = base64.b64encode(file_data).decode('utf-8')
+            # 根据文件头确定MIME类型并检查尺寸
+            try:
+                mime_type = inspect_image_upload(file.stream)
+            except InvalidImageError as e:
+                return jsonify({"error": str(e)}), 400
             
             # 获取下一个图片ID
             image_id = get_next_image_id(project_id)
@@ -790,34 +1886,83 @@ def upload_project_image(project_id):
             # 创建Redis键
             image_key = f"image:{project_id}-image-{image_id}"
             
-            # 存储完整的data URL
-            data_url = f"data:{mime_type};base64,{base64_encoded}"
-            redis_client.set(image_key, data_url)
+            # 分块存储完整的data URL
+            stored = store_image_upload(file.stream, image_key, mime_type)
             
-            # 更新项目图片元数据
-            project = update_project_images_metadata(project_id)
-            
-            # 如果这是第一张图片，自动选中它
-            if len(project.get('images', [])) == 1:
-                for img in project['images']:
-                    if img['id'] == image_id:
-                        img['selected'] = True
-                        break
-                save_project(project)
+            # 更新项目图片元数据，如果这是第一张图片，自动选中它
+            project = add_project_images(project_id, [image_id])
             
             # 返回结果
             return jsonify({
                 "success": True,
                 "message": "Image uploaded successfully",
                 "image_id": image_id,
+                "sha256": stored['sha256'],
+                # 内容相同或相似的已有图片，可以复用它们的生成结果
+                "duplicate_of": stored['duplicate_of'],
+                "similar": stored['similar'],
                     "image_path": f"/api/images/{project_id}-image-{image_id}",
                     "project": project  # 返回更新后的完整项目信息
             })
+        except ProjectConflictError:
+            raise
         except Exception as e:
             return jsonify({"error": f"Failed to upload image: {str(e)}"}), 500
     
     return jsonify({"error": "Invalid file type"}), 400
 
+@app.route('/api/projects/<project_id>/images/batch', methods=['POST'])
+def upload_project_images_batch(project_id):
+    """一次上传多张图片（表单字段images可以重复）
+
+    先检查所有文件，有任何一个无效则整批拒绝；图片ID一次预留，
+    图片数据在一个pipeline中写入，项目信息只更新一次
+    """
+    project = get_project(project_id)
+    
+    if not project:
+        return jsonify({"error": "Project not found"}), 404
+    
+    request.max_content_length = MAX_BATCH_UPLOAD_SIZE
+    files = [file for file in request.files.getlist('images') if file.filename]
+    if not files:
+        return jsonify({"error": "No image files provided"}), 400
+    
+    mime_types = []
+    for file in files:
+        if not allowed_file(file.filename):
+            return jsonify({"error": f"Invalid file type: {file.filename}"}), 400
+        try:
+            mime_types.append(inspect_image_upload(file.stream))
+        except InvalidImageError as e:
+            return jsonify({"error": f"{file.filename}: {e}"}), 400
+    
+    try:
+        image_ids = reserve_image_ids(project_id, len(files))
+        stored = store_image_uploads([
+            (file.stream, f"image:{project_id}-image-{image_id}", mime_type)
+            for file, image_id, mime_type in zip(files, image_ids, mime_types)
+        ])
+        project = add_project_images(project_id, image_ids)
+    except ProjectConflictError:
+        raise
+    except Exception as e:
+        return jsonify({"error": f"Failed to upload images: {str(e)}"}), 500
+    
+    return jsonify({
+        "success": True,
+        "message": f"{len(files)} images uploaded successfully",
+        "images": [
+            {
+                "image_id": image_id,
+                "image_path": f"/api/images/{project_id}-image-{image_id}",
+                **info
+            }
+            for image_id, info in zip(image_ids, stored)
+        ],
+        "project": project
+    })
+
 @app.route('/api/projects/<project_id>/images/<int:image_id>', methods=['DELETE'])
 def delete_project_image_api(project_id, image_id):
     """删除项目的指定图片"""
@@ -832,7 +1977,7 @@ def delete_project_image_api(project_id, image_id):
         return jsonify({"error": "Image not found"}), 404
     
     # 删除图片
-    redis_client.delete(image_key)
+    remove_image_record(image_key)
     
     # 更新项目图片元数据
     updated_project = update_project_images_metadata(project_id)
@@ -858,7 +2003,13 @@ def get_project_images(project_id):
             "images": project['images']
         })
     
-    # 否则，重新获取图片信息并更新项目
+    return jsonify({
+        "success": True,
+        "images": build_project_images(project_id)
+    })
+
+def build_project_images(project_id):
+    """项目没有images字段时，根据保存的图片重新生成图片信息并更新项目"""
     image_ids = get_project_image_ids(project_id)
     images = []
     
@@ -870,13 +2021,8 @@ def get_project_images(project_id):
         })
     
     # 更新项目并保存
-    project['images'] = images
-    save_project(project)
-    
-    return jsonify({
-        "success": True,
-        "images": images
-    })
+    update_project(project_id, {'images': images})
+    return images
 
 @app.route('/api/projects/<project_id>', methods=['DELETE'])
 def delete_project(project_id):
@@ -896,14 +2042,18 @@ def delete_project(project_id):
         if project.get('image_path'):
             delete_project_image(project_id, image_path=project['image_path'])
         
-        # 删除项目数据
+        # 删除项目数据和历史记录
         project_key = get_project_key(project_id)
-        redis_client.delete(project_key)
+        pipe = redis_client.pipeline()
+        pipe.delete(project_key, get_image_counter_key(project_id))
+        project_cache.publish(pipe, project_key)
+        pipe.execute()
+        project_cache.invalidate(project_key)
+        delete_history(project_id)
         
         # 删除任何本地视频文件
         project_video_folder = os.path.join(VIDEO_FOLDER, project_id)
         if os.path.exists(project_video_folder):
-            import shutil
             shutil.rmtree(project_video_folder)
         
         return jsonify({
@@ -962,16 +2112,7 @@ def get_templates():
     try:
         # Get all template keys from Redis
         template_keys = redis_client.keys("template:*")
-        templates = []
-        
-        for key in template_keys:
-            template_data = redis_client.get(key)
-            if template_data:
-                template = json.loads(template_data)
-                templates.append(template)
-        
-        # Sort templates by creation date (newest first)
-        templates.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
+        templates = sort_templates(redis_client.mget(template_keys) if template_keys else [])
         
         return jsonify({
             "success": True,
@@ -980,6 +2121,12 @@ def get_templates():
     except Exception as e:
         return jsonify({"error": f"Failed to get templates: {str(e)}"}), 500
 
+def sort_templates(template_values):
+    """Decode stored templates (skipping missing ones), newest first"""
+    templates = [json.loads(value) for value in template_values if value]
+    templates.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
+    return templates
+
 @app.route('/api/templates', methods=['POST'])
 def create_template():
     """Create a new prompt template"""
@@ -1103,49 +2250,19 @@ def generate_speech(project_id):
         
         if not text:
             # Extract narration text from project script
-            script = project['script']
-            
-            # Try to identify script format and extract narration
-            if "旁白文本:" in script:
-                parts = script.split("旁白文本:", 1)
-                if len(parts) > 1:
-                    text = parts[1].strip()
-            elif "旁白文本：" in script:  # Handle Chinese colon
-                parts = script.split("旁白文本：", 1)
-                if len(parts) > 1:
-                    text = parts[1].strip()
-            
-            if not text:
-                # If can't extract narration, use entire script
-                text = script
-            else:
-                # Remove any remaining "旁白文本:" prefix
-                if text.startswith("旁白文本:"):
-                    text = text.replace("旁白文本:", "", 1).strip()
-                elif text.startswith("旁白文本："):
-                    text = text.replace("旁白文本：", "", 1).strip()
+            text = extract_narration(project['script'])
         
         try:
-            app.logger.info(f"Generating speech for project {project_id}")
-            app.logger.info(f"Language: {language}")
-            app.logger.info(f"Text length: {len(text)} characters")
+            logger.info("Generating speech for project %s", project_id)
+            logger.debug("Language: %s", language)
+            logger.debug("Text length: %s characters", len(text))
             
             # Generate speech using TTS client
             result = tts_client.generate_speech(text, project_id, language)
             
             if result['status'] == 'success':
                 # Update project with speech file information
-                if 'speech' not in project or not isinstance(project['speech'], list):
-                    project['speech'] = []
-                
-                project['speech'].append({
-                    'path': result['path'],
-                    'created_at': datetime.now().isoformat(),
-                    'language': language
-                })
-                
-                project['updated_at'] = datetime.now().isoformat()
-                save_project(project)
+                record_speech(project_id, result['path'], language)
                 
                 return jsonify({
                     "success": True,
@@ -1156,17 +2273,17 @@ def generate_speech(project_id):
                     }
                 })
             else:
-                app.logger.error(f"TTS client error: {result.get('error', 'Unknown error')}")
+                logger.error("TTS client error: %s", result.get('error', 'Unknown error'))
                 return jsonify({"error": result.get('error', 'Failed to generate speech')}), 500
                 
         except Exception as e:
-            app.logger.error(f"Error in TTS generation: {str(e)}")
-            app.logger.error(traceback.format_exc())
+            logger.exception("Error in TTS generation: %s", e)
             return jsonify({"error": f"Failed to generate speech: {str(e)}"}), 500
             
+    except ProjectConflictError:
+        raise
     except Exception as e:
-        app.logger.error(f"Unexpected error in generate_speech: {str(e)}")
-        app.logger.error(traceback.format_exc())
+        logger.exception("Unexpected error in generate_speech: %s", e)
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
 @app.route('/api/projects/<project_id>/speech', methods=['GET'])
@@ -1177,7 +2294,8 @@ def get_project_speeches(project_id):
     if not project:
         return jsonify({"error": "Project not found"}), 404
     
-    speeches = project.get('speech', [])
+    # 完整记录在历史列表中；旧项目的记录仍在项目文档里
+    speeches = get_history(project_id, 'speech') or project.get('speech', [])
     
     return jsonify({
         "success": True,
@@ -1187,7 +2305,7 @@ def get_project_speeches(project_id):
 @app.route('/api/speeches/<path:filename>', methods=['GET'])
 def serve_speech_file(filename):
     """Serve speech audio files"""
-    return send_from_directory(SPEECH_FOLDER, filename)
+    return send_media_file(SPEECH_FOLDER, filename, 'speeches')
 
 @app.route('/api/projects/<project_id>/speech', methods=['DELETE'])
 def delete_project_speech(project_id):
@@ -1207,14 +2325,15 @@ def delete_project_speech(project_id):
         tts_client.clean_old_speeches(project_id)
         
         # 更新项目
-        project['speech'] = []
-        project['updated_at'] = datetime.now().isoformat()
-        save_project(project)
+        update_project(project_id, {'speech': []})
+        delete_history(project_id, ['speech'])
         
         return jsonify({
             "success": True,
             "message": "All speeches deleted successfully"
         })
+    except ProjectConflictError:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to delete speeches: {str(e)}"}), 500
 
@@ -1276,7 +2395,7 @@ def test_generate_video():
         return jsonify(result)
     
     except Exception as e:
-        app.logger.error(f"Error generating test video: {str(e)}")
+        logger.error("Error generating test video: %s", e)
         return jsonify({"error": str(e), "status": "failed"}), 500
 
 @app.route('/api/test/video/status', methods=['POST'])
@@ -1324,8 +2443,7 @@ def test_video_status():
             })
     
     except Exception as e:
-        app.logger.error(f"Error in test video status: {str(e)}")
-        app.logger.error(traceback.format_exc())
+        logger.exception("Error in test video status: %s", e)
         return jsonify({"error": f"Failed to check video status: {str(e)}"}), 500
 
 @app.route('/api/projects/<project_id>/video/add-audio', methods=['POST'])
@@ -1333,9 +2451,9 @@ def add_audio_to_video(project_id):
     """为项目视频添加音频（语音旁白）"""
     project = get_project(project_id)
 
-    print(f"Project: {project}")
-    print(f"Project video: {project['video']}")
-    print(f"Project speech: {project['speech']}")
+    logger.debug("Project: %s", redact(project))
+    logger.debug("Project video: %s", redact(project['video']))
+    logger.debug("Project speech: %s", redact(project['speech']))
     
     if not project:
         return jsonify({"error": "Project not found"}), 404
@@ -1353,11 +2471,11 @@ def add_audio_to_video(project_id):
         video_file = None
         if 'local_path' in project['video']:
             video_file = project['video']['local_path']
-            print(f"Using video file_path: {video_file}")
+            logger.debug("Using video file_path: %s", video_file)
         elif 'url' in project['video']:
             # 处理URL格式的视频路径
             video_url = project['video']['url']
-            print(f"Video URL: {video_url}")
+            logger.debug("Video URL: %s", video_url)
             
             if video_url.startswith('/api/videos/'):
                 # 从视频URL解析出项目ID和文件名
@@ -1366,16 +2484,16 @@ def add_audio_to_video(project_id):
                     video_project_id = parts[-2]
                     video_filename = parts[-1]
                     video_file = os.path.join(VIDEO_FOLDER, video_project_id, video_filename)
-                    print(f"Constructed video path from URL: {video_file}")
+                    logger.debug("Constructed video path from URL: %s", video_file)
             elif video_url.startswith('/'):
                 # 相对路径，需要转换为完整路径
                 video_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), video_url.lstrip('/'))
-                print(f"Constructed video path from relative path: {video_file}")
+                logger.debug("Constructed video path from relative path: %s", video_file)
             else:
                 return jsonify({"error": "Unsupported video URL format"}), 400
         
-        print(f"Final video file: {video_file}")
-        print(f"Video file exists: {os.path.exists(video_file) if video_file else False}")
+        logger.debug("Final video file: %s", video_file)
+        logger.debug("Video file exists: %s", os.path.exists(video_file) if video_file else False)
         
         if not video_file or not os.path.exists(video_file):
             return jsonify({"error": "Video file not found"}), 404
@@ -1384,7 +2502,7 @@ def add_audio_to_video(project_id):
         latest_speech = project['speech'][-1]
         speech_path = latest_speech['path']
 
-        print(f"Speech path: {speech_path}")
+        logger.debug("Speech path: %s", speech_path)
         
         # 处理语音路径
         audio_file = None
@@ -1400,40 +2518,40 @@ def add_audio_to_video(project_id):
                 audio_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), speech_path.lstrip('/'))
                 
                 # 输出调试信息
-                print(f"Fallback audio path: {audio_file}")
-                print(f"SPEECH_FOLDER: {SPEECH_FOLDER}")
-                print(f"File exists: {os.path.exists(audio_file)}")
+                logger.debug("Fallback audio path: %s", audio_file)
+                logger.debug("SPEECH_FOLDER: %s", SPEECH_FOLDER)
+                logger.debug("File exists: %s", os.path.exists(audio_file))
         else:
             return jsonify({"error": "Unsupported speech file path format"}), 400
         
         # Speech audio handling
         if not audio_file or not os.path.exists(audio_file):
             # Try alternative paths
-            print("Audio file not found at primary location, trying alternatives...")
+            logger.debug("Audio file not found at primary location, trying alternatives...")
             
             # Option 1: Direct path from SPEECH_FOLDER
             alt_audio_file = os.path.join(SPEECH_FOLDER, os.path.basename(speech_path))
-            print(f"Trying alt path 1: {alt_audio_file}")
+            logger.debug("Trying alt path 1: %s", alt_audio_file)
             
             if os.path.exists(alt_audio_file):
                 audio_file = alt_audio_file
-                print(f"Found audio at alt path 1: {audio_file}")
+                logger.debug("Found audio at alt path 1: %s", audio_file)
             else:
                 # Option 2: Try with just the project ID folder
                 alt_audio_file = os.path.join(SPEECH_FOLDER, project_id, os.path.basename(speech_path))
-                print(f"Trying alt path 2: {alt_audio_file}")
+                logger.debug("Trying alt path 2: %s", alt_audio_file)
                 
                 if os.path.exists(alt_audio_file):
                     audio_file = alt_audio_file
-                    print(f"Found audio at alt path 2: {audio_file}")
+                    logger.debug("Found audio at alt path 2: %s", audio_file)
                 else:
                     # Option 3: From project folder with fixed name
                     alt_audio_file = os.path.join(SPEECH_FOLDER, project_id, "speech.mp3")
-                    print(f"Trying alt path 3: {alt_audio_file}")
+                    logger.debug("Trying alt path 3: %s", alt_audio_file)
                     
                     if os.path.exists(alt_audio_file):
                         audio_file = alt_audio_file
-                        print(f"Found audio at alt path 3: {audio_file}")
+                        logger.debug("Found audio at alt path 3: %s", audio_file)
             
             # Final check
             if not os.path.exists(audio_file):
@@ -1442,7 +2560,7 @@ def add_audio_to_video(project_id):
         # Video file handling
         if not video_file or not os.path.exists(video_file):
             # Try alternative paths for video file
-            print("Video file not found at primary location, trying alternatives...")
+            logger.debug("Video file not found at primary location, trying alternatives...")
             
             # If we have a URL, try to find the file directly
             if 'url' in project['video']:
@@ -1454,11 +2572,11 @@ def add_audio_to_video(project_id):
                     if len(parts) >= 4:
                         video_filename = parts[-1]
                         alt_video_file = os.path.join(VIDEO_FOLDER, project_id, video_filename)
-                        print(f"Trying alt video path 1: {alt_video_file}")
+                        logger.debug("Trying alt video path 1: %s", alt_video_file)
                         
                         if os.path.exists(alt_video_file):
                             video_file = alt_video_file
-                            print(f"Found video at alt path 1: {video_file}")
+                            logger.debug("Found video at alt path 1: %s", video_file)
                 
                 # Option 2: Search for any video file in the project folder
                 project_video_dir = os.path.join(VIDEO_FOLDER, project_id)
@@ -1468,11 +2586,11 @@ def add_audio_to_video(project_id):
                         # Use the most recent video file (assuming naming convention with timestamp)
                         video_files.sort(reverse=True)
                         alt_video_file = os.path.join(project_video_dir, video_files[0])
-                        print(f"Trying alt video path 2: {alt_video_file}")
+                        logger.debug("Trying alt video path 2: %s", alt_video_file)
                         
                         if os.path.exists(alt_video_file):
                             video_file = alt_video_file
-                            print(f"Found video at alt path 2: {video_file}")
+                            logger.debug("Found video at alt path 2: %s", video_file)
             
             # Final check
             if not os.path.exists(video_file):
@@ -1482,43 +2600,58 @@ def add_audio_to_video(project_id):
         output_dir = os.path.join(VIDEO_FOLDER, project_id)
         os.makedirs(output_dir, exist_ok=True)
         # 使用固定名称代替时间戳
+        preview_filename = "video_with_audio_preview.mp4"
+        preview_path = os.path.join(output_dir, preview_filename)
         output_filename = "video_with_audio.mp4"
         output_path = os.path.join(output_dir, output_filename)
         
-        # 如果文件已存在，则删除它
-        if os.path.exists(output_path):
-            try:
-                os.remove(output_path)
-                print(f"Removed existing video with audio: {output_path}")
-            except Exception as e:
-                print(f"Could not remove existing file: {e}")
-        
-        # 执行音频视频合并
-        result = merge_audio_video(video_file, audio_file, output_path, True)
+        # 先用preview配置快速合并，用户可以立即查看结果
+        result = merge_audio_video(
+            video_file, audio_file, preview_path, True,
+            max_tempo_deviation=AUDIO_MAX_TEMPO_DEVIATION,
+            extend=VIDEO_EXTEND_MODE,
+            profile='preview'
+        )
         
         if not result["success"]:
             return jsonify({"error": f"Failed to merge audio and video: {result['error']}"}), 500
         
         # 更新项目信息
+        render_id = str(uuid.uuid4())
         new_video_info = {
             'status': 'completed',
-            'file_path': output_path,
-            'url': f"/videos/{project_id}/{output_filename}",
+            'file_path': preview_path,
+            'url': f"/videos/{project_id}/{preview_filename}",
             'with_audio': True,
-            'original_video': project['video'],
+            # 只保留上一个版本（不再逐层嵌套），更早的版本在历史列表中
+            'original_video': previous_video_entry(project['video']),
             'duration': result['output']['duration'],
             'audio_info': {
                 'path': audio_file,
                 'duration': result['input_audio']['duration'],
-                'speed_ratio': result['speed_ratio']
+                'speed_ratio': result['speed_ratio'],
+                'extend': result['plan']['extend'],
+                'extend_duration': result['plan']['extend_duration']
+            },
+            'preview': {
+                'file_path': preview_path,
+                'url': f"/videos/{project_id}/{preview_filename}"
+            },
+            'final': {
+                'status': 'processing',
+                'render_id': render_id,
+                'started_at': datetime.now().isoformat()
             },
             'created_at': datetime.now().isoformat()
         }
         
         # 保存项目视频信息
         project['video'] = new_video_info
-        project['updated_at'] = datetime.now().isoformat()
-        save_project(project)
+        update_project(project_id, {'video': new_video_info})
+        push_history(project_id, 'video', new_video_info['original_video'])
+        
+        # 在后台渲染高质量成片，完成后替换预览
+        submit_job('render_final_video', project_id, render_id, video_file, audio_file, output_path)
         
         return jsonify({
             "success": True,
@@ -1526,9 +2659,10 @@ def add_audio_to_video(project_id):
             "video": new_video_info
         })
         
+    except ProjectConflictError:
+        raise
     except Exception as e:
-        app.logger.error(f"Error adding audio to video: {str(e)}")
-        app.logger.error(traceback.format_exc())
+        logger.exception("Error adding audio to video: %s", e)
         return jsonify({"error": f"Failed to add audio to video: {str(e)}"}), 500
 
 @app.route('/api/projects/<project_id>/prompt-template', methods=['GET'])
@@ -1539,16 +2673,17 @@ def get_prompt_template(project_id):
     if not project:
         return jsonify({"error": "Project not found"}), 404
     
-    template = project.get('prompt_template', {
+    return jsonify({
+        "success": True,
+        "template": get_project_prompt_template(project)
+    })
+
+def get_project_prompt_template(project):
+    return project.get('prompt_template', {
         'system_prompt': '',
         'user_prompt': '',
         'updated_at': None
     })
-    
-    return jsonify({
-        "success": True,
-        "template": template
-    })
 
 @app.route('/api/projects/<project_id>/prompt-template', methods=['PUT'])
 def update_prompt_template(project_id):
@@ -1570,7 +2705,7 @@ def update_prompt_template(project_id):
     
     project['prompt_template'] = template
     project['updated_at'] = datetime.now().isoformat()
-    save_project(project)
+    update_project(project_id, {'prompt_template': template, 'updated_at': project['updated_at']})
     
     return jsonify({
         "success": True,
@@ -1595,17 +2730,16 @@ def select_project_image(project_id, image_id):
     data = request.json or {}
     selected = data.get('selected', True)  # 默认为选中
     
-    # 更新图片选择状态
-    images = project.get('images', [])
-    for img in images:
-        if img['id'] == image_id:
-            img['selected'] = selected
-            break
+    # 更新图片选择状态（基于最新的项目数据，并发修改时自动重试）
+    def mutate(project):
+        images = project.get('images', [])
+        for img in images:
+            if img['id'] == image_id:
+                img['selected'] = selected
+                break
+        return {'images': images}
     
-    # 保存项目
-    project['images'] = images
-    project['updated_at'] = datetime.now().isoformat()
-    save_project(project)
+    project = modify_project(project_id, mutate) or project
     
     return jsonify({
         "success": True,
@@ -1613,6 +2747,15 @@ def select_project_image(project_id, image_id):
         "project": project
     })
 
+# Background job handlers, run by submit_job or by worker.py
+JOB_HANDLERS = {
+    'generate_video': run_video_job,
+    'render_final_video': render_final_video,
+    'package_hls': package_video_hls,
+}
+
 if __name__ == '__main__':
+    # Development server only; production uses gunicorn (see gunicorn.conf.py and wsgi.py)
+    start_media_gc()
     port = int(os.getenv('PORT', 8888))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=os.getenv('DEBUG', 'false').lower() == 'true')
\ No newline at end of file
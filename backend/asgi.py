@@ -0,0 +1,489 @@
+"""
+ASGI entry point with async handlers for the provider-bound endpoints
+
+Script, speech and video generation spend nearly all their time waiting on
+OpenAI, ElevenLabs or Kling. Here those endpoints (and the video status poll)
+are coroutines using httpx and redis.asyncio, so one process can hold hundreds
+of in-flight generations without a thread each. Every other route is passed
+through to the Flask app unchanged.
+
+    SERVER_INTERFACE=asgi gunicorn -c gunicorn.conf.py
+    uvicorn asgi:application --host 0.0.0.0 --port 8888
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import redis.asyncio as aioredis
+from a2wsgi import WSGIMiddleware
+
+import app as backend
+from app import (
+    app, REDIS_CONFIG, CORS_ORIGINS, JOB_BACKEND, KLING_MAX_PARALLEL_TASKS,
+    PROJECT_UPDATE_SCRIPT, PROJECT_UPDATE_RETRIES, PROJECT_HISTORY_LIMIT, get_history_key, ProjectConflictError, init_clients,
+    project_cache, get_project, get_project_key, get_selected_image_ids, get_video_status,
+    decode_project_fields, project_update_args, check_project_update, new_speech_entry, replaced_video_entry,
+    extract_video_description, extract_narration, parse_crossfade, finalize_clip,
+    plan_project_video, compose_project_video
+)
+from blob_store import image_value_to_data_url
+from job_queue import aenqueue_job
+from log_utils import get_logger
+from metrics import observe_http, time_stage
+from tracing import span, parse_traceparent
+from llm_client import get_llm_client
+from tts_client import get_tts_client
+from video_generator import get_video_generator
+
+logger = get_logger(__name__)
+
+# Async Redis client, same settings as the Flask app's client
+aredis = aioredis.Redis(**REDIS_CONFIG)
+aupdate_project_script = aredis.register_script(PROJECT_UPDATE_SCRIPT)
+
+# Everything without an async handler is served by Flask in a thread pool
+flask_application = WSGIMiddleware(app, workers=int(os.getenv('ASGI_WSGI_THREADS', 10)))
+
+# TTS clients by provider; the Flask endpoint rebuilds one per request
+tts_clients = {}
+
+# Video jobs running on the event loop (JOB_BACKEND=thread), kept referenced until done
+background_tasks = set()
+
+class Request:
+    """The parts of an HTTP request the async handlers need"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.args = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+        self.body = body
+
+    def arg(self, name, default=None):
+        values = self.args.get(name)
+        return values[0] if values else default
+
+    def json(self):
+        """Decoded JSON body, None if missing or invalid"""
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+async def aget_project(project_id, use_cache=True):
+    """Retrieve project data from Redis (through the shared project cache)"""
+    project_key = get_project_key(project_id)
+    project_data = project_cache.get(project_key) if use_cache else None
+    if project_data is None:
+        generation = project_cache.generation
+        try:
+            with time_stage('redis_fetch', 'redis'):
+                project_data = await aredis.hgetall(project_key)
+        except aioredis.ResponseError:
+            # Old JSON string format, converted by the sync helper
+            return await asyncio.to_thread(get_project, project_id)
+        if not project_data:
+            return None
+        project_cache.put(project_key, project_data, generation)
+    project = decode_project_fields(project_data)
+    project.setdefault('version', 0)
+    return project
+
+async def aupdate_project(project_id, fields, remove=(), expected_version=None):
+    """Async version of app.update_project (projects are read first, so already hashes)"""
+    fields = dict(fields)
+    fields.setdefault('updated_at', datetime.now().isoformat())
+    args = project_update_args(fields, remove, expected_version)
+    project_key = get_project_key(project_id)
+    result = await aupdate_project_script(keys=[project_key], args=args)
+    project_cache.invalidate(project_key)
+    return check_project_update(result, project_id)
+
+async def amodify_project(project_id, mutate, retries=None):
+    """Async version of app.modify_project: compare-and-set on the version, re-read and retry on conflict"""
+    for attempt in range(retries or PROJECT_UPDATE_RETRIES):
+        project = await aget_project(project_id, use_cache=attempt == 0)
+        if not project:
+            return None
+        fields = mutate(project)
+        if fields is None:
+            return None
+        fields.setdefault('updated_at', datetime.now().isoformat())
+        try:
+            version = await aupdate_project(project_id, fields, expected_version=project['version'])
+        except ProjectConflictError:
+            continue
+        if not version:
+            return None
+        project.update(fields)
+        project['version'] = version
+        return project
+    raise ProjectConflictError(f"Project {project_id} is being modified concurrently, giving up")
+
+async def apush_history(project_id, kind, entry):
+    """Async version of app.push_history"""
+    history_key = get_history_key(project_id, kind)
+    async with aredis.pipeline() as pipe:
+        pipe.rpush(history_key, json.dumps(entry))
+        pipe.ltrim(history_key, -PROJECT_HISTORY_LIMIT, -1)
+        await pipe.execute()
+
+def spawn(coro):
+    """Run a coroutine in the background without losing the task reference"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def get_async_tts_client(provider):
+    if provider not in tts_clients:
+        tts_clients[provider] = get_tts_client(provider)
+    return tts_clients[provider]
+
+def get_async_video_generator():
+    if backend.video_generator is None:
+        backend.video_generator = get_video_generator()
+    return backend.video_generator
+
+async def agenerate_image_clip(semaphore, project_id, image_id, description, output_dir, duration=None):
+    """Async version of app.generate_image_clip, at most KLING_MAX_PARALLEL_TASKS at a time"""
+    async with semaphore:
+        image_key = f"image:{project_id}-image-{image_id}"
+        with time_stage('redis_fetch', 'redis'):
+            image_value = await aredis.get(image_key)
+        if not image_value:
+            return {"image_id": image_id, "status": "failed", "error": f"Image not found: {image_key}"}
+        generator = get_async_video_generator()
+        # Blob store reads and re-encoding are blocking
+        image_data = await asyncio.to_thread(generator.prepare_image, image_value)
+
+        clip = await generator.agenerate_video(
+            image_path=f"/api/images/{project_id}-image-{image_id}",
+            image_data=image_data,
+            script=description,
+            output_dir=output_dir,
+            duration=duration,
+        )
+    return finalize_clip(clip, image_id)
+
+async def acreate_project_video(project, description, crossfade=0.0):
+    """Async version of app.create_project_video
+
+    Kling calls run on the event loop; probing the narration and composing the clips
+    are ffmpeg work and run in a thread.
+    """
+    plan = await asyncio.to_thread(plan_project_video, project, crossfade)
+
+    semaphore = asyncio.Semaphore(KLING_MAX_PARALLEL_TASKS)
+    clips = await asyncio.gather(*(
+        agenerate_image_clip(semaphore, project['id'], image_id, description, plan['output_dir'], plan['clip_duration'])
+        for image_id in plan['image_ids']
+    ))
+
+    return await asyncio.to_thread(compose_project_video, project['id'], plan, list(clips), crossfade)
+
+async def arun_video_job(project_id, job_id, description, crossfade=0.0):
+    """Async version of app.run_video_job"""
+    project = await aget_project(project_id)
+    if not project:
+        return
+
+    try:
+        video_result = await acreate_project_video(project, description, crossfade)
+    except Exception as e:
+        logger.exception("Error in video job %s: %s", job_id, e)
+        video_result = {'status': 'failed', 'error': str(e)}
+    video_result['job_id'] = job_id
+
+    def mutate(project):
+        if (project.get('video') or {}).get('job_id') != job_id:
+            logger.info("Video job %s superseded, skipping project update", job_id)
+            return None
+        # Only replaces this job's placeholder; the previous video went into the history on submit
+        return {'video': video_result}
+
+    await amodify_project(project_id, mutate)
+
+async def generate_script(request, project_id):
+    """Generate a marketing script based on the project's image using LLM"""
+    try:
+        if backend.llm_client is None:
+            backend.llm_client = get_llm_client(backend.redis_client)
+
+        project = await aget_project(project_id)
+        if not project:
+            return {"error": "Project not found"}, 404
+
+        image_ids = request.args.get('image_id')
+        if not image_ids:
+            return {"error": "No image_id provided"}, 400
+
+        data = request.json() or {}
+        system_prompt = data.get('system_prompt')
+        user_prompt = data.get('user_prompt')
+
+        # 保存prompt模板到项目中
+        if system_prompt is not None or user_prompt is not None:
+            project['prompt_template'] = {
+                'system_prompt': system_prompt,
+                'user_prompt': user_prompt,
+                'updated_at': datetime.now().isoformat()
+            }
+            await aupdate_project(project_id, {'prompt_template': project['prompt_template']})
+
+        try:
+            image_ids = [int(img_id) for img_id in image_ids]
+        except ValueError:
+            return {"error": f"Invalid image ID in {image_ids}"}, 400
+
+        images = await aredis.mget([f"image:{project_id}-image-{img_id}" for img_id in image_ids])
+        for img_id, data_url in zip(image_ids, images):
+            if not data_url:
+                return {"error": f"Image {img_id} not found in database"}, 404
+
+        # 获取之前保存的prompt模板（如果没有新的prompt被提供）
+        saved_template = project.get('prompt_template', {})
+        if system_prompt is None:
+            system_prompt = saved_template.get('system_prompt')
+        if user_prompt is None:
+            user_prompt = saved_template.get('user_prompt')
+
+        # 使用第一张图片生成脚本
+        script = await backend.llm_client.agenerate_script(
+            project_id,
+            image_ids[0],
+            project['name'],
+            project.get('description', ''),
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            image_data=await asyncio.to_thread(image_value_to_data_url, images[0])
+        )
+
+        project['script'] = script
+        project['selected_images'] = [{'id': img_id} for img_id in image_ids]
+        project['updated_at'] = datetime.now().isoformat()
+        await aupdate_project(project_id, {
+            'script': script,
+            'selected_images': project['selected_images'],
+            'updated_at': project['updated_at']
+        })
+
+        return {
+            "success": True,
+            "script": script,
+            "project": project
+        }, 200
+    except ProjectConflictError:
+        raise
+    except Exception as e:
+        logger.exception("Error in generate_script: %s", e)
+        return {"error": f"Failed to generate script: {str(e)}"}, 500
+
+async def generate_speech(request, project_id):
+    """Generate speech audio from project script"""
+    try:
+        tts = get_async_tts_client(request.arg('provider', 'elevenlabs').lower())
+
+        project = await aget_project(project_id)
+        if not project:
+            return {"error": "Project not found"}, 404
+
+        if not project.get('script'):
+            return {"error": "No script has been created for this project"}, 400
+
+        language = request.arg('language', 'zh-CN')
+        data = request.json() or {}
+        text = data.get('text') or extract_narration(project['script'])
+
+        result = await tts.agenerate_speech(text, project_id, language)
+        if result['status'] != 'success':
+            logger.error("TTS client error: %s", result.get('error', 'Unknown error'))
+            return {"error": result.get('error', 'Failed to generate speech')}, 500
+
+        entry = new_speech_entry(result['path'], language)
+        # Same order as app.record_speech: history first, then the version bump
+        await apush_history(project_id, 'speech', entry)
+        await aupdate_project(project_id, {'speech': [entry]})
+
+        return {
+            "success": True,
+            "message": "Speech generated successfully",
+            "speech": {
+                "path": result['path'],
+                "language": language
+            }
+        }, 200
+    except ProjectConflictError:
+        raise
+    except Exception as e:
+        logger.exception("Error in generate_speech: %s", e)
+        return {"error": f"Failed to generate speech: {str(e)}"}, 500
+
+async def generate_video(request, project_id):
+    """Generate a sales video based on the project's image and script"""
+    project = await aget_project(project_id)
+    if not project:
+        return {"error": "Project not found"}, 404
+
+    if not project.get('images') and not project.get('image_path'):
+        return {"error": "No image has been uploaded for this project"}, 400
+
+    if not project.get('script'):
+        return {"error": "No script has been created for this project"}, 400
+
+    description = extract_video_description(project['script'])
+    data = request.json() or {}
+    try:
+        crossfade = parse_crossfade(data.get('crossfade', 0))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    if not get_selected_image_ids(project):
+        return {"error": "No image has been selected for this project"}, 400
+
+    # The replaced video goes into the history first, as in app.record_replaced_video
+    previous_entry = replaced_video_entry(project.get('video'))
+
+    # 异步模式：任务在事件循环（或JOB_BACKEND=redis时在worker）中运行，立即返回
+    if data.get('async') or request.arg('async', 'false').lower() == 'true':
+        job_id = str(uuid.uuid4())
+        project['video'] = {
+            'status': 'processing',
+            'job_id': job_id,
+            'started_at': datetime.now().isoformat()
+        }
+        if previous_entry:
+            await apush_history(project_id, 'video', previous_entry)
+        await aupdate_project(project_id, {'video': project['video']})
+        if JOB_BACKEND == 'redis':
+            await aenqueue_job(aredis, 'generate_video', project_id, job_id, description, crossfade)
+        else:
+            spawn(arun_video_job(project_id, job_id, description, crossfade))
+        return {
+            "success": True,
+            "video": project['video']
+        }, 202
+
+    try:
+        video_result = await acreate_project_video(project, description, crossfade)
+
+        if previous_entry:
+            await apush_history(project_id, 'video', previous_entry)
+        await aupdate_project(project_id, {'video': video_result})
+
+        return {
+            "success": True,
+            "video": video_result
+        }, 200
+    except ProjectConflictError:
+        raise
+    except Exception as e:
+        return {"error": f"Failed to generate video: {str(e)}"}, 500
+
+async def check_video_status(request, project_id):
+    """检查项目视频生成的状态"""
+    try:
+        project = await aget_project(project_id)
+        if not project:
+            return {"error": "Project not found"}, 404
+        return get_video_status(project), 200
+    except Exception as e:
+        logger.exception("Error checking video status: %s", e)
+        return {"error": f"Failed to check video status: {str(e)}"}, 500
+
+ROUTES = [
+    ('POST', re.compile(r'^/api/projects/(?P<project_id>[^/]+)/script/generate$'), generate_script),
+    ('POST', re.compile(r'^/api/projects/(?P<project_id>[^/]+)/speech/generate$'), generate_speech),
+    ('POST', re.compile(r'^/api/projects/(?P<project_id>[^/]+)/video/generate$'), generate_video),
+    ('GET', re.compile(r'^/api/projects/(?P<project_id>[^/]+)/video/status$'), check_video_status),
+]
+
+def match_route(method, path):
+    for route_method, pattern, handler in ROUTES:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return handler, match.groupdict()
+    return None, None
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def send_json(send, request, payload, status, trace_id=None):
+    """Send a JSON response, returning the size of its body"""
+    body = json.dumps(payload).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+    ]
+    if trace_id:
+        headers.append((b'x-trace-id', trace_id.encode()))
+    # Same origins as the Flask-CORS configuration; preflight requests go to Flask
+    origin = request.headers.get('origin')
+    if origin in CORS_ORIGINS:
+        headers.append((b'access-control-allow-origin', origin.encode('latin-1')))
+        headers.append((b'vary', b'Origin'))
+        headers.append((b'access-control-expose-headers', b'X-Trace-Id'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+    return len(body)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Build the provider clients once per worker process
+            await asyncio.to_thread(init_clients)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if background_tasks:
+                logger.warning("Shutting down with %s video jobs still running; "
+                               "use JOB_BACKEND=redis for jobs that must survive restarts", len(background_tasks))
+            await aredis.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http':
+        handler, params = match_route(scope['method'], scope['path'])
+        if handler:
+            started = time.perf_counter()
+            request = Request(scope, await read_body(receive))
+            # Same span as the Flask request hooks; jobs and tasks started by the handler inherit it
+            with span(f"{request.method} {handler.__name__}", 'server',
+                      {'http.method': request.method, 'http.target': request.path},
+                      parent=parse_traceparent(request.headers.get('traceparent'))) as request_span:
+                try:
+                    payload, status = await handler(request, **params)
+                except ProjectConflictError as e:
+                    # Same response as the Flask error handler
+                    payload, status = {"error": str(e)}, 409
+                if request_span is not None:
+                    request_span.set_attribute('http.status_code', status)
+                    if status >= 500:
+                        request_span.set_error(f"HTTP {status}")
+                size = await send_json(send, request, payload, status,
+                                       request_span.trace_id if request_span is not None else None)
+            # Labeled like the Flask view of the same route
+            observe_http(request.method, handler.__name__, status, time.perf_counter() - started, size)
+            return
+
+    await flask_application(scope, receive, send)
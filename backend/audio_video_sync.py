@@ -9,16 +9,19 @@
 import os
 import sys
 import argparse
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 # 导入ffmpeg同步函数
-from python_ffmpeg import sync_audio_to_video, get_duration
+from python_ffmpeg import sync_audio_to_video, get_duration, concat_videos
 
 def merge_audio_video(
     video_path: str,
     audio_path: str,
     output_path: str,
-    overwrite: bool = False
+    overwrite: bool = False,
+    max_tempo_deviation: Optional[float] = None,
+    extend: str = 'freeze',
+    profile: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     将音频文件同步到视频文件并合并
@@ -28,6 +31,9 @@ def merge_audio_video(
         audio_path: 输入音频文件路径
         output_path: 输出视频文件路径
         overwrite: 是否覆盖现有的输出文件
+        max_tempo_deviation: 允许的最大变速幅度，默认为None（把音频完整变速到视频时长）
+        extend: 视频比旁白短时的延长方式，'freeze'（定格尾帧）或 'loop'（循环播放）
+        profile: 命名的输出配置（'preview' 或 'final'），默认为None（视频流直接复制）
         
     返回:
         包含处理结果信息的字典
@@ -53,8 +59,15 @@ def merge_audio_video(
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        # 调用同步函数
-        sync_audio_to_video(video_path, audio_path, output_path)
+        # 调用同步函数，复用上面探测到的时长
+        plan = sync_audio_to_video(
+            video_path, audio_path, output_path,
+            max_tempo_deviation=max_tempo_deviation,
+            extend=extend,
+            video_duration=video_duration,
+            audio_duration=audio_duration,
+            profile=profile
+        )
         
         # 获取处理后的输出文件时长
         output_duration = get_duration(output_path)
@@ -73,7 +86,54 @@ def merge_audio_video(
                 "path": output_path,
                 "duration": output_duration
             },
-            "speed_ratio": audio_duration / video_duration
+            "speed_ratio": plan["tempo"],
+            "plan": plan
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+def compose_clips(
+    clip_paths: List[str],
+    output_path: str,
+    crossfade: float = 0.0,
+    overwrite: bool = False
+) -> Dict[str, Any]:
+    """
+    将多个视频片段拼接为一个视频，供随后添加旁白
+    
+    参数:
+        clip_paths: 输入视频片段路径列表（按播放顺序）
+        output_path: 输出视频文件路径
+        crossfade: 相邻片段之间的交叉淡化时长（秒），0 表示直接拼接
+        overwrite: 是否覆盖现有的输出文件
+        
+    返回:
+        包含处理结果信息的字典
+    """
+    if not clip_paths:
+        return {"success": False, "error": "没有可拼接的视频片段"}
+    
+    for path in clip_paths:
+        if not os.path.exists(path):
+            return {"success": False, "error": f"视频文件不存在: {path}"}
+    
+    if os.path.exists(output_path) and not overwrite:
+        return {"success": False, "error": f"输出文件已存在: {output_path}。使用overwrite=True覆盖现有文件。"}
+    
+    try:
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        
+        concat_videos(clip_paths, output_path, crossfade=crossfade)
+        
+        return {
+            "success": True,
+            "clips": [{"path": path, "duration": get_duration(path)} for path in clip_paths],
+            "output": {
+                "path": output_path,
+                "duration": get_duration(output_path)
+            }
         }
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -86,11 +146,19 @@ def main():
     parser.add_argument("output", help="输出视频文件路径")
     parser.add_argument("-f", "--force", action="store_true", help="覆盖现有的输出文件")
     parser.add_argument("-v", "--verbose", action="store_true", help="显示详细信息")
+    parser.add_argument("--max-tempo-deviation", type=float, help="允许的最大变速幅度，例如 0.1")
+    parser.add_argument("--extend", default="freeze", choices=["freeze", "loop"], help="视频比旁白短时的延长方式")
+    parser.add_argument("--profile", choices=["preview", "final"], help="命名的输出配置")
     
     args = parser.parse_args()
     
     # 调用合并函数
-    result = merge_audio_video(args.video, args.audio, args.output, args.force)
+    result = merge_audio_video(
+        args.video, args.audio, args.output, args.force,
+        max_tempo_deviation=args.max_tempo_deviation,
+        extend=args.extend,
+        profile=args.profile
+    )
     
     if result["success"]:
         print(f"处理成功! 输出文件: {result['output']['path']}")
@@ -102,6 +170,8 @@ def main():
             print(f"- 输入音频: {result['input_audio']['path']}")
             print(f"- 音频时长: {result['input_audio']['duration']:.2f}秒")
             print(f"- 音频/视频速度比: {result['speed_ratio']:.2f}")
+            if result['plan']['extend']:
+                print(f"- 视频延长: {result['plan']['extend']} {result['plan']['extend_duration']:.2f}秒")
             print(f"- 输出文件: {result['output']['path']}")
             print(f"- 输出时长: {result['output']['duration']:.2f}秒")
     else:
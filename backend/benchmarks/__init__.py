@@ -0,0 +1,22 @@
+"""
+Offline benchmarks of the media and storage hot paths
+
+    cd backend
+    python -m benchmarks                      # everything, results in benchmarks/results/
+    python -m benchmarks --quick storage      # smaller fixtures and fewer repeats
+    python -m benchmarks --compare benchmarks/results/previous.json
+
+No provider is called. Storage benchmarks run the Flask app in-process (test
+client) against a local redis-server, using a dedicated database (BENCH_REDIS_DB,
+default 15) that is flushed between suites; blobs, uploads and videos go to a
+temporary directory. The server is always localhost:6379, whatever .env says,
+unless another one is given with --redis-url. Images are generated with Pillow and clips and tones with
+ffmpeg's lavfi sources, so the numbers only depend on the code and the machine.
+
+Each run writes one JSON file with the timing statistics of every case plus the
+git commit and tool versions, and --compare reports (and fails on) median
+regressions against an earlier file.
+
+Load tests of the provider clients against local mock providers live in
+load.py and providers.py (python -m benchmarks.load / benchmarks.providers).
+"""
@@ -0,0 +1,101 @@
+"""
+Run the benchmark suite: python -m benchmarks [storage] [media] [options]
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import traceback
+from datetime import datetime
+
+from benchmarks.fixtures import prepare_environment
+from benchmarks.harness import Benchmark, describe_environment, write_results, compare_results
+
+SUITES = ('storage', 'media')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the media and storage hot paths")
+    parser.add_argument("suites", nargs='*', help=f"Suites to run: {', '.join(SUITES)} (default all)")
+    parser.add_argument("-k", "--only", action='append', help="Only run cases whose name contains this (repeatable)")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed calls per case")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls before them")
+    parser.add_argument("--quick", action='store_true', help="Smaller fixtures and fewer media runs")
+    parser.add_argument("--redis-db", type=int, default=int(os.getenv('BENCH_REDIS_DB', 15)),
+                        help="Redis database used (and flushed) by the benchmarks")
+    parser.add_argument("--redis-url", help="redis://[:password@]host[:port] of the server to use (default localhost:6379)")
+    parser.add_argument("--force", action='store_true', help="Flush the benchmark database even if it isn't empty")
+    parser.add_argument("-o", "--output", help="Result file (default benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare the medians with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Median slowdown (fraction) reported as a regression by --compare")
+    args = parser.parse_args()
+    suites = args.suites or SUITES
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    if 'media' in suites:
+        missing = [tool for tool in ('ffmpeg', 'ffprobe') if not shutil.which(tool)]
+        if missing:
+            parser.error(f"the media suite needs {' and '.join(missing)} on PATH; install ffmpeg or run only the storage suite")
+
+    workdir = tempfile.mkdtemp(prefix='image-to-video-bench-')
+    try:
+        prepare_environment(workdir, args.redis_db, args.redis_url)
+    except ValueError as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        parser.error(str(e))
+    # Imported after the environment points at the benchmark database and directories
+    import app
+
+    redis_client = app.redis_client
+    if redis_client.dbsize() and not args.force:
+        shutil.rmtree(workdir, ignore_errors=True)
+        sys.exit(f"Redis database {args.redis_db} is not empty; pass --force to flush it or choose --redis-db")
+
+    bench = Benchmark(repeat=args.repeat, warmup=args.warmup, only=args.only)
+    failed = []
+    try:
+        for suite in suites:
+            # A failing suite is reported without losing the results of the others
+            try:
+                if suite == 'storage':
+                    from benchmarks import storage
+                    redis_client.flushdb()
+                    storage.run(bench, app, quick=args.quick)
+                else:
+                    from benchmarks import media
+                    media.run(bench, workdir, quick=args.quick)
+            except Exception:
+                traceback.print_exc()
+                print(f"Suite {suite} failed, its remaining cases were skipped", file=sys.stderr)
+                failed.append(suite)
+        environment = describe_environment(redis_client)
+    finally:
+        redis_client.flushdb()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    settings = {
+        'suites': list(suites),
+        'only': args.only,
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'quick': args.quick,
+        'failed_suites': failed,
+    }
+    write_results(output, bench.results, environment, settings)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, bench.results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than {args.compare} by more than {args.threshold:.0%}")
+            sys.exit(1)
+    if failed:
+        sys.exit(f"Failed suite(s): {', '.join(failed)}")
+
+if __name__ == '__main__':
+    main()
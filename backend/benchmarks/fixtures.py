@@ -0,0 +1,104 @@
+"""
+Synthetic inputs and an isolated environment for the benchmarks
+"""
+
+import io
+import os
+import subprocess
+from urllib.parse import urlsplit, unquote
+
+from PIL import Image
+
+# Name -> (width, height): a thumbnail-sized upload, a screenshot, a phone photo
+IMAGE_SIZES = {
+    'small': (640, 480),
+    'hd': (1920, 1080),
+    'photo': (4032, 3024),
+}
+# PNG photos are far over the 16 MB upload limit
+IMAGE_FORMATS = {
+    'jpeg': ('small', 'hd', 'photo'),
+    'png': ('small', 'hd'),
+}
+QUICK_IMAGE_SIZES = ('small', 'hd')
+
+def redis_settings(redis_url=None):
+    """
+    REDIS_* variables of the benchmark server: localhost:6379 (whatever .env points
+    at, since the database gets flushed), or the server of an explicit redis://
+    URL. The database always comes from --redis-db.
+    """
+    if not redis_url:
+        return {'REDIS_HOST': 'localhost', 'REDIS_PORT': '6379'}
+    url = urlsplit(redis_url)
+    if url.scheme != 'redis' or not url.hostname:
+        raise ValueError(f"Not a redis://host[:port] URL: {redis_url}")
+    settings = {'REDIS_HOST': url.hostname, 'REDIS_PORT': str(url.port or 6379)}
+    if url.password is not None:
+        settings['REDIS_PASSWORD'] = unquote(url.password)
+    return settings
+
+def prepare_environment(workdir, redis_db, redis_url=None):
+    """
+    Point the backend at the benchmark database and a scratch directory
+
+    Must run before app (or any module reading these settings) is imported; the
+    values override .env because load_dotenv doesn't replace existing variables.
+    """
+    redis_env = redis_settings(redis_url)
+    for name in ('blobs', 'uploads', 'videos', 'speeches', 'output'):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    os.environ.update(redis_env)
+    os.environ.update({
+        'REDIS_DB': str(redis_db),
+        'BLOB_STORE': 'local',
+        'BLOB_STORE_PATH': os.path.join(workdir, 'blobs'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'VIDEO_FOLDER': os.path.join(workdir, 'videos'),
+        'SPEECH_FOLDER': os.path.join(workdir, 'speeches'),
+        'VIDEO_OUTPUT_PATH': os.path.join(workdir, 'output'),
+        'JOB_BACKEND': 'thread',
+        'METRICS_ENABLED': 'false',
+        'TRACING_ENABLED': 'false',
+        'LOG_LEVEL': os.getenv('BENCH_LOG_LEVEL', 'WARNING'),
+    })
+    # The OpenAI client is only constructed (never called) by the image benchmarks
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+def make_image(size, seed=0):
+    """Gradient with mild noise, so encoders see photo-like content rather than flat color"""
+    noise = Image.effect_noise(size, 24 + seed % 8)
+    horizontal = Image.linear_gradient('L').rotate(90).resize(size)
+    radial = Image.radial_gradient('L').resize(size)
+    return Image.merge('RGB', (Image.blend(horizontal, noise, 0.3), radial, noise))
+
+def encode_image(image, image_format, seed=0):
+    """Encoded image; the seed changes one pixel so every upload has new content"""
+    if seed:
+        image = image.copy()
+        image.putpixel((seed % image.width, (seed // image.width) % image.height), (seed % 256, 0, 255))
+    output = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(output, format='JPEG', quality=90)
+    else:
+        image.save(output, format='PNG')
+    return output.getvalue()
+
+def run_ffmpeg(*args):
+    subprocess.run(['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', *args], check=True)
+
+def make_clip(path, duration, size=(1280, 720), rate=30):
+    """H.264 test pattern clip, like the MP4s Kling returns"""
+    run_ffmpeg(
+        '-f', 'lavfi', '-i', f"testsrc2=size={size[0]}x{size[1]}:rate={rate}:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', path
+    )
+    return path
+
+def make_tone(path, duration, frequency=440):
+    """MP3 sine tone standing in for a narration"""
+    run_ffmpeg(
+        '-f', 'lavfi', '-i', f"sine=frequency={frequency}:sample_rate=44100:duration={duration}",
+        '-c:a', 'libmp3lame', '-b:a', '128k', path
+    )
+    return path
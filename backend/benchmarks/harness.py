@@ -0,0 +1,149 @@
+"""
+Timing and result files of the benchmark suite
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+class Benchmark:
+    """
+    Collects the results of one run
+
+        bench = Benchmark(repeat=10, warmup=2)
+        bench.run('get_project_image_ids', {'keys': 10000}, lambda: get_project_image_ids(project_id))
+    """
+
+    def __init__(self, repeat=10, warmup=2, only=None):
+        """
+        Args:
+            repeat: Timed calls per case (suites may lower it for slow cases)
+            warmup: Untimed calls before them
+            only: Substrings of case names to run, None for all
+        """
+        self.repeat = repeat
+        self.warmup = warmup
+        self.only = only
+        self.results = []
+
+    def selected(self, name):
+        return not self.only or any(pattern in name for pattern in self.only)
+
+    def run(self, name, params, func, setup=None, repeat=None, size=None):
+        """
+        Time a case
+
+        Args:
+            name: Case name (what is measured)
+            params: Dict of the fixture parameters
+            func: Timed callable; takes the value returned by setup if there is one
+            setup: Untimed callable run before every call
+            repeat: Override of the timed call count
+            size: Bytes processed per call, for throughput
+
+        Returns:
+            The result dict, None if the case isn't selected
+        """
+        if not self.selected(name):
+            return None
+        repeat = repeat or self.repeat
+        durations = []
+        for index in range(self.warmup + repeat):
+            argument = setup() if setup else None
+            started = time.perf_counter()
+            func(argument) if setup else func()
+            elapsed = time.perf_counter() - started
+            if index >= self.warmup:
+                durations.append(elapsed)
+
+        result = {'name': name, 'params': params, 'unit': 'seconds', 'stats': summarize(durations)}
+        if size:
+            result['bytes'] = size
+            result['stats']['mb_per_second'] = round(size / result['stats']['median'] / 1e6, 3)
+        self.results.append(result)
+        print(format_result(result), flush=True)
+        return result
+
+def summarize(durations):
+    values = sorted(durations)
+    return {
+        'count': len(values),
+        'min': values[0],
+        'median': statistics.median(values),
+        'mean': statistics.fmean(values),
+        'p95': values[min(len(values) - 1, int(0.95 * len(values)))],
+        'max': values[-1],
+        'stdev': statistics.stdev(values) if len(values) > 1 else 0.0,
+    }
+
+def case_id(result):
+    params = ','.join(f"{key}={value}" for key, value in sorted(result['params'].items()))
+    return f"{result['name']}[{params}]"
+
+def format_result(result):
+    stats = result['stats']
+    return (f"{case_id(result)[:72]:<72} median {stats['median'] * 1000:>10.3f} ms"
+            f"  p95 {stats['p95'] * 1000:>10.3f} ms  (n={stats['count']})")
+
+def command_output(args, cwd=None):
+    try:
+        return subprocess.run(args, cwd=cwd, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def describe_environment(redis_client):
+    """Versions and machine details stored with the results"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ffmpeg_version = command_output(['ffmpeg', '-version'])
+    return {
+        'git_commit': command_output(['git', 'rev-parse', 'HEAD'], cwd=root),
+        'git_dirty': bool(command_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root)),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'redis': redis_client.info('server').get('redis_version'),
+        'ffmpeg': ffmpeg_version.splitlines()[0] if ffmpeg_version else None,
+    }
+
+def write_results(path, results, environment, settings):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    document = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': environment,
+        'settings': settings,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    return document
+
+def compare_results(baseline_path, results, threshold):
+    """
+    Print the median change of every case found in both runs
+
+    Returns:
+        Case ids slower than the baseline by more than threshold (a fraction)
+    """
+    with open(baseline_path) as f:
+        baseline = {case_id(result): result for result in json.load(f)['results']}
+
+    regressions = []
+    print(f"\n{'case':<72} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for result in results:
+        key = case_id(result)
+        if key not in baseline:
+            continue
+        before = baseline[key]['stats']['median']
+        after = result['stats']['median']
+        change = after / before - 1 if before else 0.0
+        marker = ''
+        if change > threshold:
+            regressions.append(key)
+            marker = '  REGRESSION'
+        print(f"{key[:72]:<72} {before * 1000:>12.3f} {after * 1000:>12.3f} {change:>+8.1%}{marker}")
+    return regressions
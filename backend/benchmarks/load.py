@@ -0,0 +1,258 @@
+"""
+Load tests of the real provider clients against the mock providers
+
+    python -m benchmarks.load kling --jobs 300 --concurrency 300
+    python -m benchmarks.load kling --mode async --endpoint http://127.0.0.1:8900
+    python -m benchmarks.load tts --tts-provider openai --error-rate openai_speech=0.05
+
+Runs JOBS jobs, CONCURRENCY at a time, through the same client code the backend
+uses: KlingGenerator submit / poll / download (with the image prepared by
+prepare_image and the faststart remux), OpenAIClient.generate_script, or the
+TTS client. --mode thread runs the blocking methods on a thread pool like the
+job executor; --mode async runs the async methods like the ASGI server.
+
+Without --endpoint the mock providers run in this process (see providers.py
+for their options); with it, they are expected to run separately, e.g. with
+python -m benchmarks.providers, which keeps the mock server's work out of the
+measured process. Provider endpoints and credentials are always overridden, so
+a load test never reaches the real APIs.
+
+The result file holds throughput, job latency statistics, failures by error
+and the request counts seen by the mock server.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import urllib.request
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import prepare_environment, make_image, encode_image
+from benchmarks.harness import summarize, describe_environment, write_results
+from benchmarks.providers import add_provider_arguments, create_providers
+
+TARGETS = ('kling', 'llm', 'tts')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+IMAGE_SIZE = (1920, 1080)
+PROMPT = "产品放在木质桌面上，镜头缓慢推近，柔和的自然光从左侧照亮产品。"
+NARRATION = "认识一下这款为日常生活设计的新产品。它做工精细，使用方便，现在就把它带回家吧！"
+
+def configure_providers(url, poll_interval):
+    """Point every provider client at the mock server"""
+    os.environ.update({
+        'KLING_API_ENDPOINT': url,
+        'KLING_ACCESS_KEY': 'mock-access-key',
+        'KLING_SECRET_KEY': 'mock-secret-key',
+        'KLING_POLL_INTERVAL': str(poll_interval),
+        'OPENAI_BASE_URL': f"{url}/v1",
+        'OPENAI_API_KEY': 'mock-openai-key',
+        'ELEVEN_LABS_API_ENDPOINT': f"{url}/v1/text-to-speech",
+        'ELEVEN_LABS_API_KEY': 'mock-elevenlabs-key',
+        'USE_MOCK_LLM': 'false',
+        'USE_MOCK_VIDEO_GEN': 'false',
+    })
+
+def store_images(app, count):
+    """Store count distinct synthetic images in the blob store, returning their (project id, image id)"""
+    base = make_image(IMAGE_SIZE)
+    images = []
+    for index in range(count):
+        project_id = f"load-{index}"
+        data = encode_image(base, 'jpeg', index + 1)
+        image_key = f"image:{project_id}-image-1"
+        app.store_image_upload(io.BytesIO(data), image_key, 'image/jpeg')
+        images.append((project_id, 1))
+    return images
+
+class JobRunner:
+    """The job of a target in thread and async form; both return (ok, error message)"""
+
+    def __init__(self, app, target, images, output_dir, tts_provider=None):
+        self.app = app
+        self.target = target
+        self.images = images
+        self.output_dir = output_dir
+        if target == 'kling':
+            self.client = app.get_video_generator()
+        elif target == 'llm':
+            self.client = app.get_llm_client(app.redis_client)
+        else:
+            self.client = app.get_tts_client(tts_provider)
+
+    def image(self, index):
+        return self.images[index % len(self.images)]
+
+    def image_value(self, index):
+        project_id, image_id = self.image(index)
+        return self.app.redis_client.get(f"image:{project_id}-image-{image_id}")
+
+    def kling_result(self, result):
+        if result.get('local_path'):
+            os.remove(result['local_path'])
+        if result.get('status') == 'completed':
+            return True, None
+        return False, result.get('error')
+
+    def speech_result(self, result):
+        if result.get('status') == 'success':
+            return True, None
+        return False, result.get('error')
+
+    def run(self, index):
+        try:
+            if self.target == 'kling':
+                image_data = self.client.prepare_image(self.image_value(index))
+                return self.kling_result(self.client.generate_video(
+                    None, PROMPT, output_dir=self.output_dir, image_data=image_data, duration='5'
+                ))
+            if self.target == 'llm':
+                project_id, image_id = self.image(index)
+                self.client.generate_script(project_id, image_id, "Load test product")
+                return True, None
+            return self.speech_result(self.client.generate_speech(NARRATION, f"load-{index}"))
+        except Exception as e:
+            return False, f"{type(e).__name__}: {e}"
+
+    async def arun(self, index):
+        try:
+            if self.target == 'kling':
+                image_data = await asyncio.to_thread(self.client.prepare_image, self.image_value(index))
+                return self.kling_result(await self.client.agenerate_video(
+                    None, PROMPT, output_dir=self.output_dir, image_data=image_data, duration='5'
+                ))
+            if self.target == 'llm':
+                project_id, image_id = self.image(index)
+                await self.client.agenerate_script(project_id, image_id, "Load test product")
+                return True, None
+            return self.speech_result(await self.client.agenerate_speech(NARRATION, f"load-{index}"))
+        except Exception as e:
+            return False, f"{type(e).__name__}: {e}"
+
+def timed(run, index):
+    started = time.perf_counter()
+    ok, error = run(index)
+    return time.perf_counter() - started, ok, error
+
+async def atimed(run, index, semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        ok, error = await run(index)
+        return time.perf_counter() - started, ok, error
+
+def run_threads(runner, jobs, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda index: timed(runner.run, index), range(jobs)))
+
+async def run_async(runner, jobs, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(atimed(runner.arun, index, semaphore) for index in range(jobs)))
+
+def fetch_stats(url):
+    with urllib.request.urlopen(f"{url}/_stats", timeout=10) as response:
+        return json.load(response)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the provider clients against mock providers")
+    parser.add_argument("target", choices=TARGETS, help="Client to load")
+    parser.add_argument("--jobs", type=int, default=200, help="Jobs to run")
+    parser.add_argument("--concurrency", type=int, default=100, help="Jobs running at once")
+    parser.add_argument("--mode", choices=('thread', 'async'), default='thread')
+    parser.add_argument("--images", type=int, default=10, help="Distinct images the jobs cycle through")
+    parser.add_argument("--tts-provider", default='elevenlabs', choices=('elevenlabs', 'openai'))
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="KLING_POLL_INTERVAL of the clients")
+    parser.add_argument("--endpoint", help="URL of separately started mock providers")
+    parser.add_argument("--redis-db", type=int, default=int(os.getenv('BENCH_REDIS_DB', 15)),
+                        help="Redis database used (and flushed) for images and the Kling image cache")
+    parser.add_argument("--redis-url", help="redis://[:password@]host[:port] of the server to use (default localhost:6379)")
+    parser.add_argument("--force", action='store_true', help="Flush the database even if it isn't empty")
+    parser.add_argument("-o", "--output", help="Result file (default benchmarks/results/load-<target>-<time>.json)")
+    add_provider_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='image-to-video-load-')
+    try:
+        prepare_environment(workdir, args.redis_db, args.redis_url)
+    except ValueError as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        parser.error(str(e))
+
+    providers = None
+    url = args.endpoint
+    if not url:
+        providers = create_providers(args)
+        url = providers.start()
+
+    configure_providers(url.rstrip('/'), args.poll_interval)
+    # Imported after the environment points at the mock providers and the benchmark database
+    import app
+
+    redis_client = app.redis_client
+    if redis_client.dbsize() and not args.force:
+        shutil.rmtree(workdir, ignore_errors=True)
+        sys.exit(f"Redis database {args.redis_db} is not empty; pass --force to flush it or choose --redis-db")
+
+    try:
+        redis_client.flushdb()
+        runner = JobRunner(app, args.target, store_images(app, args.images),
+                           os.path.join(workdir, 'videos'), args.tts_provider)
+        print(f"Running {args.jobs} {args.target} jobs, {args.concurrency} at a time ({args.mode}) against {url}", flush=True)
+        started = time.perf_counter()
+        if args.mode == 'thread':
+            outcomes = run_threads(runner, args.jobs, args.concurrency)
+        else:
+            outcomes = asyncio.run(run_async(runner, args.jobs, args.concurrency))
+        elapsed = time.perf_counter() - started
+        server_stats = providers.stats() if providers else fetch_stats(url)
+        environment = describe_environment(redis_client)
+    finally:
+        redis_client.flushdb()
+        shutil.rmtree(workdir, ignore_errors=True)
+        if providers:
+            providers.stop()
+
+    durations = [duration for duration, ok, _ in outcomes if ok]
+    errors = Counter(error for _, ok, error in outcomes if not ok)
+    result = {
+        'name': f"load_{args.target}",
+        'params': {'jobs': args.jobs, 'concurrency': args.concurrency, 'mode': args.mode},
+        'unit': 'seconds',
+        'elapsed': elapsed,
+        'jobs_per_second': args.jobs / elapsed,
+        'succeeded': len(durations),
+        'failed': args.jobs - len(durations),
+        'stats': summarize(durations) if durations else None,
+        'errors': dict(errors.most_common(20)),
+        'provider_stats': server_stats,
+    }
+    settings = {
+        'target': args.target,
+        'images': args.images,
+        'tts_provider': args.tts_provider,
+        'poll_interval': args.poll_interval,
+        'endpoint': args.endpoint,
+        'providers': providers.config.describe() if providers else None,
+    }
+
+    print(f"{result['succeeded']}/{args.jobs} succeeded in {elapsed:.1f} s ({result['jobs_per_second']:.2f} jobs/s)")
+    if durations:
+        stats = result['stats']
+        print(f"job latency median {stats['median']:.2f} s, p95 {stats['p95']:.2f} s, max {stats['max']:.2f} s")
+    for error, count in errors.most_common(5):
+        print(f"  {count} x {error}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{args.target}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    write_results(output, [result], environment, settings)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
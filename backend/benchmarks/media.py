@@ -0,0 +1,51 @@
+"""
+Narration merge benchmarks (ffprobe + ffmpeg through merge_audio_video)
+"""
+
+import os
+
+from audio_video_sync import merge_audio_video
+from benchmarks.fixtures import make_clip, make_tone
+
+CLIP_DURATION = 5
+# (case, narration seconds, merge_audio_video arguments)
+MERGE_CASES = (
+    # Narration within the tempo range: atempo, video stream copied
+    ('tempo', 5.3, {'max_tempo_deviation': 0.1}),
+    # Narration longer than the video: freeze the last frame, which re-encodes the video
+    ('freeze', 8, {'max_tempo_deviation': 0.1, 'extend': 'freeze'}),
+    ('loop', 8, {'max_tempo_deviation': 0.1, 'extend': 'loop'}),
+    # The preview rendition of a tempo-range merge
+    ('preview', 5.3, {'max_tempo_deviation': 0.1, 'profile': 'preview'}),
+)
+QUICK_CASES = ('tempo', 'freeze')
+MEDIA_REPEAT = 5
+QUICK_MEDIA_REPEAT = 2
+
+def run(bench, workdir, quick=False):
+    media_dir = os.path.join(workdir, 'media')
+    os.makedirs(media_dir, exist_ok=True)
+    clip_path = make_clip(os.path.join(media_dir, 'clip.mp4'), CLIP_DURATION)
+    tones = {}
+    output_path = os.path.join(media_dir, 'merged.mp4')
+    repeat = min(bench.repeat, QUICK_MEDIA_REPEAT if quick else MEDIA_REPEAT)
+
+    for case, narration_duration, options in MERGE_CASES:
+        if quick and case not in QUICK_CASES:
+            continue
+        if narration_duration not in tones:
+            tones[narration_duration] = make_tone(
+                os.path.join(media_dir, f"tone_{narration_duration}.mp3"), narration_duration
+            )
+        audio_path = tones[narration_duration]
+
+        def merge():
+            result = merge_audio_video(clip_path, audio_path, output_path, overwrite=True, **options)
+            if not result['success']:
+                raise RuntimeError(f"merge_audio_video failed: {result['error']}")
+
+        bench.run(
+            'merge_audio_video',
+            {'case': case, 'video_seconds': CLIP_DURATION, 'audio_seconds': narration_duration},
+            merge, repeat=repeat, size=os.path.getsize(clip_path)
+        )
@@ -0,0 +1,477 @@
+"""
+Local stand-ins for the Kling, OpenAI and ElevenLabs HTTP APIs
+
+    python -m benchmarks.providers --port 8900 --queue-time lognormal:30,0.5 --error-rate kling_submit=0.02
+
+and point the backend at it:
+
+    KLING_API_ENDPOINT=http://127.0.0.1:8900
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+    ELEVEN_LABS_API_ENDPOINT=http://127.0.0.1:8900/v1/text-to-speech
+
+Unlike MockVideoGenerator and MockLLMClient, the real clients run unchanged: JWT
+and API key headers, the image2video submit / poll / download protocol (tasks go
+submitted -> processing -> succeed or failed after a sampled queue time, then the
+clip is downloaded from this server), chat completions and speech synthesis.
+
+Every route sleeps for a latency sampled from its distribution and fails with
+HTTP 500 at its error rate. Distributions are written as
+    fixed:SECONDS  uniform:MIN,MAX  lognormal:MEDIAN,SIGMA  exponential:MEAN
+Kling tasks fail at --task-failure-rate, and --max-tasks answers submissions over
+that many running tasks with 429 (code 1303), like an exhausted resource pack.
+GET /_stats returns request counts per route and status, and task counts.
+
+The clip and the narration audio are generated with ffmpeg unless --video and
+--audio name files to serve.
+"""
+
+import os
+import re
+import json
+import math
+import time
+import uuid
+import heapq
+import random
+import shutil
+import signal
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROUTES = ('kling_submit', 'kling_poll', 'kling_download', 'openai_chat', 'openai_speech', 'elevenlabs_tts')
+
+# Time to respond (to the first byte for downloads); the Kling queue time is separate
+DEFAULT_LATENCY = {
+    'kling_submit': 'lognormal:0.3,0.4',
+    'kling_poll': 'lognormal:0.08,0.3',
+    'kling_download': 'lognormal:0.2,0.5',
+    'openai_chat': 'lognormal:3,0.4',
+    'openai_speech': 'lognormal:1.5,0.4',
+    'elevenlabs_tts': 'lognormal:1.2,0.4',
+}
+DEFAULT_QUEUE_TIME = 'lognormal:5,0.5'
+CHUNK_SIZE = 64 * 1024
+
+SCRIPT = """视频描述:
+产品放在木质桌面上，镜头缓慢推近，柔和的自然光从左侧照亮产品。
+
+旁白文本:
+【引言】
+认识一下这款为日常生活设计的新产品。
+
+【主体】
+它做工精细，使用方便，无论在家还是外出都能轻松应对。
+
+【结语】
+现在就把它带回家吧！
+"""
+
+class Distribution:
+    """Latency distribution parsed from 'kind:params' (a bare number is fixed)"""
+
+    def __init__(self, spec):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(':')
+        if not params:
+            kind, params = 'fixed', kind
+        try:
+            values = [float(value) for value in params.split(',')]
+        except ValueError:
+            raise ValueError(f"Invalid distribution: {spec}")
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2, 'exponential': 1}
+        if expected.get(kind) != len(values):
+            raise ValueError(f"Invalid distribution: {spec}")
+        self.kind = kind
+        self.values = values
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            return self.values[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.values)
+        if self.kind == 'lognormal':
+            median, sigma = self.values
+            return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return rng.expovariate(1 / self.values[0]) if self.values[0] > 0 else 0.0
+
+    def __str__(self):
+        return self.spec
+
+class ProviderConfig:
+    def __init__(self, latency=None, error_rate=None, queue_time=DEFAULT_QUEUE_TIME,
+                 task_failure_rate=0.0, max_tasks=0, download_rate=0, seed=None):
+        """
+        Args:
+            latency: Route -> distribution spec, merged over DEFAULT_LATENCY
+            error_rate: Route -> fraction of requests answered with HTTP 500
+            queue_time: Distribution of the time from Kling submission to the task result
+            task_failure_rate: Fraction of Kling tasks ending as failed
+            max_tasks: Running Kling tasks above which submissions get 429, 0 for no limit
+            download_rate: Bytes per second per download, 0 for no limit
+            seed: Random seed, for repeatable runs
+        """
+        self.latency = {route: Distribution(spec) for route, spec in {**DEFAULT_LATENCY, **(latency or {})}.items()}
+        self.error_rate = {route: 0.0 for route in ROUTES}
+        self.error_rate.update(error_rate or {})
+        self.queue_time = Distribution(queue_time)
+        self.task_failure_rate = task_failure_rate
+        self.max_tasks = max_tasks
+        self.download_rate = download_rate
+        self.seed = seed
+
+    def describe(self):
+        return {
+            'latency': {route: str(distribution) for route, distribution in self.latency.items()},
+            'error_rate': self.error_rate,
+            'queue_time': str(self.queue_time),
+            'task_failure_rate': self.task_failure_rate,
+            'max_tasks': self.max_tasks,
+            'download_rate': self.download_rate,
+            'seed': self.seed,
+        }
+
+class KlingTask:
+    __slots__ = ('task_id', 'created_at', 'ready_at', 'failed', 'duration')
+
+    def __init__(self, task_id, created_at, ready_at, failed, duration):
+        self.task_id = task_id
+        self.created_at = created_at
+        self.ready_at = ready_at
+        self.failed = failed
+        self.duration = duration
+
+    def status(self, now):
+        if now >= self.ready_at:
+            return 'failed' if self.failed else 'succeed'
+        # The first tenth of the queue time the task is waiting for a slot
+        return 'submitted' if now < self.created_at + (self.ready_at - self.created_at) / 10 else 'processing'
+
+class MockProviders:
+    """The mock API server; start() serves it from a background thread"""
+
+    def __init__(self, config, video, audio):
+        """
+        Args:
+            config: ProviderConfig
+            video: Clip bytes returned for every Kling task
+            audio: MP3 bytes returned by both speech APIs
+        """
+        self.config = config
+        self.video = video
+        self.audio = audio
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        # Result times of the tasks still running
+        self.running = []
+        self.requests = Counter()
+        self.peak_running_tasks = 0
+        self.server = None
+        self.thread = None
+
+    def sample(self, distribution):
+        with self.lock:
+            return distribution.sample(self.rng)
+
+    def chance(self, rate):
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def record(self, route, status):
+        with self.lock:
+            self.requests[(route, status)] += 1
+
+    def submit_task(self, duration):
+        """Create a Kling task, None when the running task limit is reached"""
+        now = time.time()
+        queue_time = self.sample(self.config.queue_time)
+        failed = self.chance(self.config.task_failure_rate)
+        with self.lock:
+            while self.running and self.running[0] <= now:
+                heapq.heappop(self.running)
+            if self.config.max_tasks and len(self.running) >= self.config.max_tasks:
+                return None
+            task = KlingTask(uuid.uuid4().hex, now, now + queue_time, failed, duration)
+            self.tasks[task.task_id] = task
+            heapq.heappush(self.running, task.ready_at)
+            self.peak_running_tasks = max(self.peak_running_tasks, len(self.running))
+            return task
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            requests = {}
+            for (route, status), count in sorted(self.requests.items()):
+                requests.setdefault(route, {})[str(status)] = count
+            finished = [task for task in self.tasks.values() if task.ready_at <= now]
+            return {
+                'requests': requests,
+                'tasks': {
+                    'submitted': len(self.tasks),
+                    'running': len(self.tasks) - len(finished),
+                    'succeeded': sum(1 for task in finished if not task.failed),
+                    'failed': sum(1 for task in finished if task.failed),
+                    'peak_running': self.peak_running_tasks,
+                },
+            }
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread, returning the base URL"""
+        self.server = MockServer((host, port), MockHandler)
+        self.server.providers = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="mock-providers")
+        self.thread.start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hundreds of clients connect at once
+    request_queue_size = 1024
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    ROUTE_PATTERNS = (
+        ('POST', re.compile(r'^/v1/videos/image2video$'), 'kling_submit'),
+        ('GET', re.compile(r'^/v1/videos/image2video/(?P<task_id>[0-9a-f]+)$'), 'kling_poll'),
+        ('GET', re.compile(r'^/kling/videos/(?P<task_id>[0-9a-f]+)\.mp4$'), 'kling_download'),
+        ('POST', re.compile(r'^/v1/chat/completions$'), 'openai_chat'),
+        ('POST', re.compile(r'^/v1/audio/speech$'), 'openai_speech'),
+        ('POST', re.compile(r'^/v1/text-to-speech/(?P<voice_id>[^/]+)$'), 'elevenlabs_tts'),
+    )
+
+    @property
+    def providers(self):
+        return self.server.providers
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = self.path.split('?', 1)[0]
+        if method == 'GET' and path == '/_stats':
+            return self.send_json(200, self.providers.stats())
+
+        for route_method, pattern, route in self.ROUTE_PATTERNS:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return self.send_json(404, {'error': f"No mock for {method} {path}"})
+
+        time.sleep(self.providers.sample(self.providers.config.latency[route]))
+        if self.providers.chance(self.providers.config.error_rate[route]):
+            self.providers.record(route, 500)
+            return self.send_json(500, self.error_body(route, 'Injected server error'))
+        status = getattr(self, route)(body, **match.groupdict())
+        self.providers.record(route, status)
+
+    def error_body(self, route, message, code=5000):
+        if route.startswith('kling'):
+            return {'code': code, 'message': message, 'request_id': uuid.uuid4().hex}
+        if route.startswith('openai'):
+            return {'error': {'message': message, 'type': 'server_error', 'code': None}}
+        return {'detail': {'status': 'error', 'message': message}}
+
+    def kling_authorized(self):
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        return token.count('.') == 2
+
+    def kling_submit(self, body):
+        if not self.kling_authorized():
+            return self.send_json(401, self.error_body('kling', 'Authorization failed', 1000))
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self.send_json(400, self.error_body('kling', 'Invalid JSON body', 1200))
+        if not data.get('image') or not data.get('model_name'):
+            return self.send_json(400, self.error_body('kling', 'image and model_name are required', 1201))
+
+        task = self.providers.submit_task(data.get('duration', '5'))
+        if task is None:
+            return self.send_json(429, self.error_body('kling', 'parallel task over resource pack limit', 1303))
+        created_ms = int(task.created_at * 1000)
+        return self.send_json(200, {
+            'code': 0,
+            'message': 'SUCCEED',
+            'request_id': uuid.uuid4().hex,
+            'data': {'task_id': task.task_id, 'task_status': 'submitted',
+                     'created_at': created_ms, 'updated_at': created_ms},
+        })
+
+    def kling_poll(self, body, task_id):
+        if not self.kling_authorized():
+            return self.send_json(401, self.error_body('kling', 'Authorization failed', 1000))
+        task = self.providers.tasks.get(task_id)
+        if task is None:
+            return self.send_json(404, self.error_body('kling', 'Task not found', 1203))
+
+        status = task.status(time.time())
+        data = {
+            'task_id': task.task_id,
+            'task_status': status,
+            'created_at': int(task.created_at * 1000),
+            'updated_at': int(min(time.time(), task.ready_at) * 1000),
+        }
+        if status == 'failed':
+            data['task_status_msg'] = 'Injected task failure'
+        elif status == 'succeed':
+            data['task_result'] = {'videos': [{
+                'id': task.task_id,
+                'url': f"http://{self.headers.get('Host')}/kling/videos/{task.task_id}.mp4",
+                'duration': str(task.duration),
+            }]}
+        return self.send_json(200, {'code': 0, 'message': 'SUCCEED', 'request_id': uuid.uuid4().hex, 'data': data})
+
+    def kling_download(self, body, task_id):
+        if task_id not in self.providers.tasks:
+            return self.send_json(404, {'error': 'Not found'})
+        return self.send_bytes(200, self.providers.video, 'video/mp4', self.providers.config.download_rate)
+
+    def openai_chat(self, body):
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send_json(401, self.error_body('openai', 'Missing API key'))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return self.send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+        return self.send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': SCRIPT},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': len(body) // 4, 'completion_tokens': len(SCRIPT), 'total_tokens': len(body) // 4 + len(SCRIPT)},
+        })
+
+    def openai_speech(self, body):
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send_json(401, self.error_body('openai', 'Missing API key'))
+        return self.send_bytes(200, self.providers.audio, 'audio/mpeg')
+
+    def elevenlabs_tts(self, body, voice_id):
+        if not self.headers.get('xi-api-key'):
+            return self.send_json(401, self.error_body('elevenlabs', 'Missing xi-api-key'))
+        return self.send_bytes(200, self.providers.audio, 'audio/mpeg')
+
+    def send_json(self, status, document):
+        return self.send_bytes(status, json.dumps(document, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+    def send_bytes(self, status, data, content_type, rate=0):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not rate:
+            self.wfile.write(data)
+            return status
+        for offset in range(0, len(data), CHUNK_SIZE):
+            self.wfile.write(data[offset:offset + CHUNK_SIZE])
+            time.sleep(CHUNK_SIZE / rate)
+        return status
+
+    def log_message(self, format, *args):
+        pass
+
+def parse_assignments(values, convert, argument):
+    """['route=value', ...] -> {route: convert(value)}"""
+    result = {}
+    for item in values or ():
+        route, _, value = item.partition('=')
+        if route not in ROUTES or not value:
+            raise argparse.ArgumentTypeError(f"{argument} expects ROUTE=VALUE with ROUTE one of {', '.join(ROUTES)}")
+        result[route] = convert(value)
+    return result
+
+def add_provider_arguments(parser):
+    """Options of the mock providers (shared with the load harness)"""
+    group = parser.add_argument_group("mock providers")
+    group.add_argument("--latency", action='append', metavar='ROUTE=DIST',
+                       help=f"Latency distribution of a route (repeatable); routes: {', '.join(ROUTES)}")
+    group.add_argument("--error-rate", action='append', metavar='ROUTE=RATE',
+                       help="Fraction of a route's requests answered with HTTP 500 (repeatable)")
+    group.add_argument("--queue-time", default=DEFAULT_QUEUE_TIME, help="Distribution of the Kling task time")
+    group.add_argument("--task-failure-rate", type=float, default=0.0, help="Fraction of Kling tasks that fail")
+    group.add_argument("--max-tasks", type=int, default=0, help="Running Kling tasks before 429 (0 = no limit)")
+    group.add_argument("--download-rate", type=float, default=0, help="Download bytes per second per clip (0 = no limit)")
+    group.add_argument("--seed", type=int, help="Random seed")
+    group.add_argument("--video", help="Clip served for every Kling task (default: generated)")
+    group.add_argument("--audio", help="MP3 returned by the speech APIs (default: generated)")
+
+def config_from_args(args):
+    return ProviderConfig(
+        latency=parse_assignments(args.latency, lambda value: str(Distribution(value)), '--latency'),
+        error_rate=parse_assignments(args.error_rate, float, '--error-rate'),
+        queue_time=args.queue_time,
+        task_failure_rate=args.task_failure_rate,
+        max_tasks=args.max_tasks,
+        download_rate=args.download_rate,
+        seed=args.seed,
+    )
+
+def load_media(args):
+    """(clip bytes, audio bytes), generating the missing ones with ffmpeg"""
+    from benchmarks.fixtures import make_clip, make_tone
+
+    workdir = tempfile.mkdtemp(prefix='mock-providers-')
+    try:
+        video_path = args.video or make_clip(os.path.join(workdir, 'clip.mp4'), 5)
+        audio_path = args.audio or make_tone(os.path.join(workdir, 'speech.mp3'), 6)
+        with open(video_path, 'rb') as f:
+            video = f.read()
+        with open(audio_path, 'rb') as f:
+            audio = f.read()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return video, audio
+
+def create_providers(args):
+    return MockProviders(config_from_args(args), *load_media(args))
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Kling, OpenAI and ElevenLabs APIs for load testing")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8900)
+    add_provider_arguments(parser)
+    args = parser.parse_args()
+
+    providers = create_providers(args)
+    url = providers.start(args.host, args.port)
+    print(f"Mock providers listening on {url}")
+    print(f"  KLING_API_ENDPOINT={url}")
+    print(f"  OPENAI_BASE_URL={url}/v1")
+    print(f"  ELEVEN_LABS_API_ENDPOINT={url}/v1/text-to-speech", flush=True)
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+    # Print the stats on kill as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, interrupt)
+    try:
+        providers.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        providers.stop()
+        print(json.dumps(providers.stats(), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Image storage, image serving and project listing benchmarks
+
+Run in-process through the Flask test client, so the numbers include routing,
+request parsing and response building but no network or WSGI server.
+"""
+
+import io
+import json
+import itertools
+
+from werkzeug.test import EnvironBuilder
+
+from blob_store import image_record, to_data_url
+from llm_client import OpenAIClient
+from benchmarks.fixtures import IMAGE_SIZES, IMAGE_FORMATS, QUICK_IMAGE_SIZES, make_image, encode_image
+
+# Keys in the database besides the benchmarked project; KEYS scans all of them
+KEYSPACE_SIZES = (1000, 10000, 100000)
+QUICK_KEYSPACE_SIZES = (1000, 10000)
+PROJECT_COUNTS = (10, 100, 1000)
+QUICK_PROJECT_COUNTS = (10, 100)
+PROJECT_IMAGE_COUNT = 20
+
+FILENAMES = {'jpeg': 'upload.jpg', 'png': 'upload.png'}
+MIME_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+def check_response(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+def create_project(client, name):
+    response = check_response(client.post('/api/projects', json={'name': name}), 201)
+    return response.get_json()['project']['id']
+
+def upload_environ(project_id, data, image_format):
+    """WSGI environ of an upload, built outside the timed call"""
+    builder = EnvironBuilder(
+        path=f'/api/projects/{project_id}/images',
+        method='POST',
+        data={'image': (io.BytesIO(data), FILENAMES[image_format])}
+    )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+def upload_image(client, project_id, data, image_format):
+    response = check_response(client.open(upload_environ(project_id, data, image_format)))
+    return response.get_json()['image_id']
+
+def image_cases(quick):
+    for image_format, size_names in IMAGE_FORMATS.items():
+        for size_name in size_names:
+            if not quick or size_name in QUICK_IMAGE_SIZES:
+                yield image_format, size_name
+
+def run(bench, app, quick=False):
+    client = app.app.test_client()
+    redis_client = app.redis_client
+    images = {name: make_image(size) for name, size in IMAGE_SIZES.items()}
+    seeds = itertools.count(1)
+
+    # upload_project_image: header check, blob write, perceptual hash, Redis records, project update
+    for image_format, size_name in image_cases(quick):
+        project_id = create_project(client, f"upload {image_format} {size_name}")
+        sample = encode_image(images[size_name], image_format)
+        bench.run(
+            'upload_project_image',
+            {'format': image_format, 'size': size_name},
+            lambda environ: check_response(client.open(environ)),
+            setup=lambda: upload_environ(
+                project_id, encode_image(images[size_name], image_format, next(seeds)), image_format
+            ),
+            size=len(sample)
+        )
+
+    # serve_project_image and get_base64_image_from_redis, for blob store records and legacy data URLs
+    llm_client = OpenAIClient(redis_client)
+    for image_format, size_name in image_cases(quick):
+        project_id = create_project(client, f"serve {image_format} {size_name}")
+        data = encode_image(images[size_name], image_format, next(seeds))
+        blob_image_id = upload_image(client, project_id, data, image_format)
+        legacy_image_id = blob_image_id + 1
+        redis_client.set(
+            f"image:{project_id}-image-{legacy_image_id}", to_data_url(MIME_TYPES[image_format], data)
+        )
+
+        for storage, image_id in (('blob', blob_image_id), ('legacy', legacy_image_id)):
+            params = {'format': image_format, 'size': size_name, 'storage': storage}
+            path = f'/api/images/{project_id}-image-{image_id}'
+            bench.run(
+                'serve_project_image', params,
+                lambda: check_response(client.get(path)).get_data(),
+                size=len(data)
+            )
+            bench.run(
+                'get_base64_image_from_redis', params,
+                lambda: llm_client.get_base64_image_from_redis(project_id, image_id),
+                size=len(data)
+            )
+
+    # get_project_image_ids scans the whole keyspace with KEYS
+    redis_client.flushdb()
+    project_id = create_project(client, 'image ids')
+    record = image_record('0' * 64, 'image/jpeg', 1024)
+    redis_client.mset({f"image:{project_id}-image-{image_id}": record for image_id in range(1, PROJECT_IMAGE_COUNT + 1)})
+    filled = redis_client.dbsize()
+    for keyspace_size in (QUICK_KEYSPACE_SIZES if quick else KEYSPACE_SIZES):
+        filled = fill_keyspace(redis_client, filled, keyspace_size, record)
+        bench.run(
+            'get_project_image_ids',
+            {'keys': keyspace_size, 'images': PROJECT_IMAGE_COUNT},
+            lambda: app.get_project_image_ids(project_id)
+        )
+
+    # list_projects reads every project hash in one pipeline
+    redis_client.flushdb()
+    created = 0
+    for project_count in (QUICK_PROJECT_COUNTS if quick else PROJECT_COUNTS):
+        while created < project_count:
+            save_sample_project(app, created)
+            created += 1
+        bench.run(
+            'list_projects',
+            {'projects': project_count},
+            lambda: check_response(client.get('/api/projects')).get_data()
+        )
+
+def fill_keyspace(redis_client, filled, target, value, batch_size=1000):
+    """Add image keys of other projects until the database holds target keys"""
+    while filled < target:
+        count = min(batch_size, target - filled)
+        redis_client.mset({f"image:filler-{filled + index}-image-1": value for index in range(count)})
+        filled += count
+    return filled
+
+def save_sample_project(app, index):
+    """A project with images, a script and a finished video, like one that went through the pipeline"""
+    project_id = f"bench-{index:06d}"
+    images = [
+        {
+            'id': image_id,
+            'path': f"/api/images/{project_id}-image-{image_id}",
+            'selected': image_id <= 4,
+            'created_at': '2024-01-01T00:00:00',
+        }
+        for image_id in range(1, 7)
+    ]
+    app.save_project({
+        'id': project_id,
+        'name': f"Benchmark project {index}",
+        'description': 'Benchmark project',
+        'created_at': '2024-01-01T00:00:00',
+        'updated_at': '2024-01-01T00:00:00',
+        'image_path': images[0]['path'],
+        'images': images,
+        'script': json.dumps({'video_description': 'A slow pan across the scene. ' * 20, 'narration': 'Narration. ' * 100}),
+        'video': {'status': 'completed', 'video_path': f"/api/videos/{project_id}.mp4"},
+        'version': 1,
+    })
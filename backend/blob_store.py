@@ -0,0 +1,242 @@
+"""
+Content-addressed storage for image bodies
+
+Image bodies are stored under the SHA-256 of their content, so identical uploads
+are stored once. Redis only keeps a small JSON record per image
+(`image:{project_id}-image-{image_id}`) pointing at the blob:
+
+    {"sha256": "...", "mime_type": "image/jpeg", "size": 12345}
+
+Images uploaded before the blob store still hold a data URL (or bare base64) in
+Redis; load_image reads both.
+
+Backends (BLOB_STORE):
+    local: sharded files under BLOB_STORE_PATH (default)
+    s3:    an S3-compatible bucket (S3_BUCKET, S3_ENDPOINT_URL for MinIO); needs boto3
+"""
+
+import os
+import io
+import json
+import base64
+import hashlib
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+class BlobNotFoundError(KeyError):
+    """No blob is stored under the digest"""
+
+class BlobStore:
+    """Blob storage keyed by content hash"""
+
+    def put(self, stream):
+        """
+        Store the content of a binary stream, reading it in chunks
+
+        Returns:
+            (sha256 hex digest, size in bytes)
+        """
+        raise NotImplementedError
+
+    def open(self, digest):
+        """Open a stored blob for reading (binary file object)"""
+        raise NotImplementedError
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        raise NotImplementedError
+
+    def local_path(self, digest):
+        """Path of the blob on the local filesystem, None if it isn't stored locally"""
+        return None
+
+    def read(self, digest):
+        with self.open(digest) as blob:
+            return blob.read()
+
+    def stage(self, stream, target):
+        """Copy a stream into a writable file object, returning (digest, size)"""
+        digest = hashlib.sha256()
+        size = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            target.write(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root/ab/cd/<digest>"""
+
+    def __init__(self, root):
+        self.root = root
+        self.staging_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def local_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, stream):
+        with tempfile.NamedTemporaryFile(dir=self.staging_dir, delete=False) as staged:
+            try:
+                digest, size = self.stage(stream, staged)
+            except Exception:
+                os.unlink(staged.name)
+                raise
+
+        path = self.local_path(digest)
+        if os.path.exists(path):
+            # Same content already stored; touch it so garbage collection sees it as fresh
+            os.unlink(staged.name)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staged.name, path)
+        return digest, size
+
+    def open(self, digest):
+        try:
+            return open(self.local_path(digest), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFoundError(digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.local_path(digest))
+
+    def delete(self, digest):
+        try:
+            os.unlink(self.local_path(digest))
+        except FileNotFoundError:
+            pass
+
+class S3BlobStore(BlobStore):
+    """Blobs as objects <prefix>ab/<digest> in an S3-compatible bucket"""
+
+    def __init__(self, bucket, prefix='blobs/', endpoint_url=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("BLOB_STORE=s3 requires boto3 (pip install boto3)")
+        self.client_error = ClientError
+        self.s3 = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def object_key(self, digest):
+        return f"{self.prefix}{digest[:2]}/{digest}"
+
+    def put(self, stream):
+        # The key depends on the hash, so stage the content before uploading
+        with tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE) as staged:
+            digest, size = self.stage(stream, staged)
+            if not self.exists(digest):
+                staged.seek(0)
+                self.s3.upload_fileobj(staged, self.bucket, self.object_key(digest))
+        return digest, size
+
+    def open(self, digest):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.object_key(digest))
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise BlobNotFoundError(digest)
+            raise
+        return io.BytesIO(response['Body'].read())
+
+    def exists(self, digest):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.object_key(digest))
+            return True
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, digest):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.object_key(digest))
+
+_blob_store = None
+
+def get_blob_store():
+    """Blob store configured by the environment (created once per process)"""
+    global _blob_store
+    if _blob_store is None:
+        backend = os.getenv('BLOB_STORE', 'local').lower()
+        if backend == 's3':
+            _blob_store = S3BlobStore(
+                os.environ['S3_BUCKET'],
+                prefix=os.getenv('S3_PREFIX', 'blobs/'),
+                endpoint_url=os.getenv('S3_ENDPOINT_URL') or None
+            )
+        else:
+            _blob_store = LocalBlobStore(os.getenv(
+                'BLOB_STORE_PATH',
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blobs')
+            ))
+    return _blob_store
+
+def image_record(digest, mime_type, size):
+    """Redis value of an image stored in the blob store"""
+    return json.dumps({"sha256": digest, "mime_type": mime_type, "size": size})
+
+def parse_image_record(value):
+    """The record dict of a blob store image, None for a legacy data URL / base64 value"""
+    if not value or not value.startswith('{'):
+        return None
+    return json.loads(value)
+
+def decode_image_value(value, default_mime_type='image/jpeg'):
+    """
+    Image content of a Redis image value
+
+    Returns:
+        (MIME type, image bytes)
+
+    Raises:
+        BlobNotFoundError: The referenced blob is missing
+        ValueError: Invalid legacy data URL
+    """
+    record = parse_image_record(value)
+    if record:
+        return record['mime_type'], get_blob_store().read(record['sha256'])
+
+    if value.startswith('data:'):
+        parts = value.split(',', 1)
+        if len(parts) < 2:
+            raise ValueError(f"Invalid data URL format: {value[:20]}...")
+        return parts[0].split(';')[0].split(':')[1], base64.b64decode(parts[1])
+    return default_mime_type, base64.b64decode(value)
+
+def load_image(redis_client, image_key, default_mime_type='image/jpeg'):
+    """
+    Read an image by its Redis key
+
+    Returns:
+        (MIME type, image bytes), None if there is no such image
+    """
+    value = redis_client.get(image_key)
+    if not value:
+        return None
+    return decode_image_value(value, default_mime_type)
+
+def to_data_url(mime_type, data):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def image_value_to_data_url(value):
+    """Data URL of a Redis image value (what the LLM and Kling clients take)"""
+    if parse_image_record(value) or not value.startswith('data:'):
+        return to_data_url(*decode_image_value(value))
+    return value
+
+def load_image_data_url(redis_client, image_key):
+    """Read an image by its Redis key as a data URL, None if there is no such image"""
+    value = redis_client.get(image_key)
+    if not value:
+        return None
+    return image_value_to_data_url(value)
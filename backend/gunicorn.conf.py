@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration for the backend API
+
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded in the master, so `kill -HUP` only re-forks workers with the
+code already loaded. To deploy new code without dropping requests, start a new
+master and retire the old one:
+
+    kill -USR2 $(cat gunicorn.pid)           # new master (gunicorn.pid), old one in gunicorn.pid.oldbin
+    kill -WINCH $(cat gunicorn.pid.oldbin)   # old workers finish their requests and exit
+    kill -QUIT $(cat gunicorn.pid.oldbin)    # old master exits
+
+(or restart gunicorn). Long-running jobs run in worker.py (JOB_BACKEND=redis)
+and are not affected; restart worker.py separately to load new job code.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8888)}"
+
+# Requests mostly wait on Redis and the providers, so use threaded workers:
+# one process per core (plus one) and a few threads each
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+wsgi_app = 'wsgi:application'
+
+# SERVER_INTERFACE=asgi serves the generation endpoints from asgi.py on an event loop
+if os.getenv('SERVER_INTERFACE', 'wsgi').lower() == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'asgi:application'
+
+# Import the app (and its provider clients, see wsgi.py) once in the master
+preload_app = True
+
+# Script/speech generation and preview merges can take tens of seconds
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 180))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+pidfile = os.getenv('GUNICORN_PIDFILE', 'gunicorn.pid')
+accesslog = '-'
+errorlog = '-'
+
+def when_ready(server):
+    # Jobs on the in-process pool die with their worker (max_requests recycling, reloads)
+    from app import JOB_BACKEND
+    if JOB_BACKEND != 'redis':
+        server.log.warning(
+            "JOB_BACKEND=%s runs video generation, final renders and HLS packaging inside the "
+            "request workers, where recycling and reloads kill them; use JOB_BACKEND=redis with worker.py",
+            JOB_BACKEND
+        )
+
+def post_fork(server, worker):
+    # Threads don't survive the fork, so the media GC is started in each worker
+    # (a Redis lock keeps passes from overlapping)
+    from app import start_media_gc
+    start_media_gc()
@@ -0,0 +1,57 @@
+"""
+Perceptual image hash (pHash) for finding near-duplicate uploads
+
+    phash(file)              -> 16 hex digit (64 bit) hash
+    hamming_distance(a, b)   -> number of differing bits
+
+Visually similar images (re-encoded, resized, slightly edited copies) get hashes a
+few bits apart. Only Pillow is needed: the 32x32 DCT is small enough for pure Python.
+"""
+
+import math
+
+from PIL import Image
+
+HASH_SIZE = 8
+SAMPLE_SIZE = HASH_SIZE * 4
+
+# cos((2n + 1) * k * pi / 2N) for the HASH_SIZE lowest frequencies
+_DCT = [
+    [math.cos((2 * n + 1) * k * math.pi / (2 * SAMPLE_SIZE)) for n in range(SAMPLE_SIZE)]
+    for k in range(HASH_SIZE)
+]
+
+def phash(image_file):
+    """
+    Perceptual hash of an image
+
+    Args:
+        image_file: Path or binary file object
+
+    Returns:
+        The hash as 16 hex digits
+    """
+    with Image.open(image_file) as image:
+        # JPEGs are decoded at a reduced scale, no need for the full-size bitmap
+        image.draft('L', (SAMPLE_SIZE, SAMPLE_SIZE))
+        sample = image.convert('L').resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.LANCZOS)
+        pixels = list(sample.getdata())
+
+    rows = [pixels[i * SAMPLE_SIZE:(i + 1) * SAMPLE_SIZE] for i in range(SAMPLE_SIZE)]
+    # Separable 2D DCT-II, keeping only the low-frequency HASH_SIZE x HASH_SIZE block
+    row_coeffs = [[sum(c * p for c, p in zip(basis, row)) for basis in _DCT] for row in rows]
+    coeffs = [
+        sum(basis[r] * row_coeffs[r][k] for r in range(SAMPLE_SIZE))
+        for basis in _DCT
+        for k in range(HASH_SIZE)
+    ]
+
+    # Compare against the median, leaving out the DC term (overall brightness)
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    bits = 0
+    for value in coeffs:
+        bits = (bits << 1) | (value > median)
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
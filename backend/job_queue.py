@@ -0,0 +1,136 @@
+"""
+Minimal Redis-backed job queue
+
+Long-running work (Kling video generation, final renders, HLS packaging) is pushed
+onto a Redis list by the web workers and executed by worker.py, so a reload or a
+slow provider never ties up the request workers.
+"""
+
+import json
+import time
+import uuid
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from log_utils import get_logger
+from tracing import span, current_traceparent, parse_traceparent
+
+logger = get_logger(__name__)
+
+JOB_QUEUE_KEY = "jobs:queue"
+
+def enqueue_job(redis_client, name, *args):
+    """
+    Push a job onto the queue
+
+    Args:
+        redis_client: Redis client
+        name: Job name (a key of the worker's handler table)
+        *args: JSON-serializable job arguments
+
+    Returns:
+        The job ID
+    """
+    job = build_job(name, *args)
+    redis_client.lpush(JOB_QUEUE_KEY, json.dumps(job))
+    return job["id"]
+
+async def aenqueue_job(redis_client, name, *args):
+    """
+    Push a job onto the queue with an asyncio Redis client (see enqueue_job)
+    """
+    job = build_job(name, *args)
+    await redis_client.lpush(JOB_QUEUE_KEY, json.dumps(job))
+    return job["id"]
+
+def build_job(name, *args):
+    """Build the job payload pushed onto the queue (carrying the current trace)"""
+    job = {
+        "id": str(uuid.uuid4()),
+        "name": name,
+        "args": list(args),
+        "enqueued_at": time.time()
+    }
+    traceparent = current_traceparent()
+    if traceparent:
+        job["traceparent"] = traceparent
+    return job
+
+def run_job(handlers, job):
+    """
+    Execute a single job, logging (not raising) failures
+
+    Args:
+        handlers: Dict mapping job names to callables
+        job: Decoded job payload
+    """
+    handler = handlers.get(job.get("name"))
+    if handler is None:
+        logger.error("Unknown job %s, dropping %s", job.get('name'), job.get('id'))
+        return
+
+    started = time.time()
+    logger.info("Running job %s (%s), queued %.1fs", job['id'], job['name'], started - job.get('enqueued_at', started))
+    attributes = {'job.id': job['id'], 'job.queued_seconds': round(started - job.get('enqueued_at', started), 3)}
+    try:
+        # Continues the trace of the request that queued the job
+        with span(f"job {job['name']}", 'consumer', attributes, parent=parse_traceparent(job.get("traceparent"))):
+            handler(*job.get("args", []))
+        logger.info("Job %s finished in %.1fs", job['id'], time.time() - started)
+    except Exception as e:
+        logger.exception("Job %s failed: %s", job['id'], e)
+
+def run_worker(redis_client, handlers, concurrency=2, poll_timeout=5):
+    """
+    Consume jobs until SIGTERM/SIGINT, running at most `concurrency` at a time
+
+    A job is only popped once a slot is free, so queued jobs stay visible to other
+    workers instead of piling up in this process. On shutdown the worker stops
+    popping and waits for running jobs to finish.
+
+    Args:
+        redis_client: Redis client
+        handlers: Dict mapping job names to callables
+        concurrency: Maximum number of jobs running in parallel
+        poll_timeout: Seconds to block on the queue before re-checking for shutdown
+    """
+    stopping = threading.Event()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def stop(signum, frame):
+        logger.info("Received signal %s, finishing running jobs...", signum)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def run_and_release(job):
+        try:
+            run_job(handlers, job)
+        finally:
+            slots.release()
+
+    logger.info("Job worker started with concurrency %s", concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while not stopping.is_set():
+            if not slots.acquire(timeout=poll_timeout):
+                continue
+            try:
+                item = redis_client.brpop(JOB_QUEUE_KEY, timeout=poll_timeout)
+            except Exception as e:
+                logger.error("Error reading job queue: %s", e)
+                item = None
+                time.sleep(poll_timeout)
+            if not item:
+                slots.release()
+                continue
+
+            try:
+                job = json.loads(item[1])
+            except ValueError:
+                logger.error("Dropping malformed job: %s", item[1][:200])
+                slots.release()
+                continue
+            executor.submit(run_and_release, job)
+    logger.info("Job worker stopped")
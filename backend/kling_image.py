@@ -0,0 +1,125 @@
+"""
+Pre-sized images for Kling submissions
+
+Kling takes the image as base64 inside the JSON body, but never renders above its
+output resolution (720p in std mode, 1080p in pro mode). Sending a 12 MB photo
+meant a ~16 MB POST, so before submitting the image is fitted into the output
+box (either orientation) and re-encoded as JPEG. JPEGs that already fit are sent
+unchanged rather than re-encoded.
+
+The resized JPEG is stored in the blob store like any image body, and Redis only
+maps (image hash, target) to its digest:
+
+    kling-jpeg:{sha256}:{width}x{height}q{quality} -> digest of the resized JPEG
+
+so retries and re-renders of a project don't decode and re-encode the same photo.
+Nothing references the resized blobs, so the media GC removes them after its grace
+period; a mapping whose blob is gone is treated as a miss.
+"""
+
+import io
+import base64
+import hashlib
+
+from PIL import Image, ImageOps
+
+from blob_store import BlobNotFoundError, get_blob_store, parse_image_record, decode_image_value
+from metrics import time_stage
+
+# Largest output frame per Kling mode (long side, short side)
+KLING_OUTPUT_SIZES = {
+    'std': (1280, 720),
+    'pro': (1920, 1080),
+}
+
+def get_kling_image_target(mode, size=None):
+    """
+    Box a submitted image is fitted into
+
+    Args:
+        mode: Kling mode ('std' or 'pro')
+        size: Optional override as 'WIDTHxHEIGHT'
+
+    Returns:
+        (long side, short side)
+    """
+    if size:
+        width, height = (int(value) for value in size.lower().split('x'))
+        return max(width, height), min(width, height)
+    return KLING_OUTPUT_SIZES.get(mode, KLING_OUTPUT_SIZES['pro'])
+
+def get_kling_image_key(digest, target, quality):
+    # Keys of the earlier Redis-held base64 cache (kling-image:...) just expire
+    return f"kling-jpeg:{digest}:{target[0]}x{target[1]}q{quality}"
+
+def fit_size(width, height, target):
+    """Size of an image scaled down (never up) to fit the target box in its own orientation"""
+    long_side, short_side = (width, height) if width >= height else (height, width)
+    scale = min(1.0, target[0] / long_side, target[1] / short_side)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def resize_for_kling(mime_type, data, target, quality=90):
+    """
+    Fit an image into the target box and encode it as JPEG
+
+    Returns:
+        JPEG bytes (the original bytes for a JPEG that already fits)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        orientation = image.getexif().get(0x0112, 1)
+        size = fit_size(*image.size, target)
+        if mime_type == 'image/jpeg' and size == image.size and orientation == 1:
+            return data
+
+        # Let the JPEG decoder do most of the downscaling
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        size = fit_size(*image.size, target)
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+        return output.getvalue()
+
+def load_kling_image(redis_client, image_value, target, quality=90, cache_ttl=86400, store=None):
+    """
+    Base64 JPEG of a Redis image value, sized for Kling
+
+    Args:
+        redis_client: Redis client holding the cache keys
+        image_value: Redis image value (blob record or legacy data URL / base64)
+        target: (long side, short side) box
+        quality: JPEG quality
+        cache_ttl: Seconds the key of a prepared image is kept
+        store: Blob store holding the prepared images (default get_blob_store())
+
+    Returns:
+        Base64 string without a data URL prefix
+    """
+    store = store or get_blob_store()
+    record = parse_image_record(image_value)
+    # Legacy values are keyed by their stored text, so a cache hit needs no decoding
+    digest = record['sha256'] if record else hashlib.sha256(image_value.encode('utf-8')).hexdigest()
+    cache_key = get_kling_image_key(digest, target, quality)
+
+    cached_digest = redis_client.getex(cache_key, ex=cache_ttl)
+    if cached_digest:
+        try:
+            return base64.b64encode(store.read(cached_digest)).decode('ascii')
+        except BlobNotFoundError:
+            pass
+
+    mime_type, data = decode_image_value(image_value)
+    with time_stage('image_normalize', 'kling'):
+        resized = resize_for_kling(mime_type, data, target, quality)
+    resized_digest, _ = store.put(io.BytesIO(resized))
+    redis_client.set(cache_key, resized_digest, ex=cache_ttl)
+    return base64.b64encode(resized).decode('ascii')
@@ -1,15 +1,22 @@
 import os
+import asyncio
 import requests
 import base64
 from PIL import Image
 import io
 from dotenv import load_dotenv
 import json
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+
+from blob_store import load_image
+from log_utils import get_logger, redact
+from metrics import time_stage
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
 class LLMClient:
     """Base class for LLM API clients"""
     
@@ -17,7 +24,7 @@ class LLMClient:
         """Initialize the LLM client"""
         self.api_key = os.getenv('LLM_API_KEY', '')
         if not self.api_key:
-            print("Warning: LLM_API_KEY environment variable not set")
+            logger.warning("LLM_API_KEY environment variable not set")
     
     def generate_script(self, project_id, image_id, project_name, project_description="", system_prompt="", user_prompt=""):
         """
@@ -35,6 +42,23 @@ class LLMClient:
         """
         raise NotImplementedError("Subclasses must implement generate_script method")
 
+    async def agenerate_script(self, project_id, image_id, project_name, project_description="", system_prompt="", user_prompt="", image_data=None):
+        """
+        Async version of generate_script, used by the ASGI server
+
+        Providers without a native async client run the blocking call in a thread.
+
+        Args:
+            image_data: Optional image data URL, saves reading it from Redis again
+
+        Returns:
+            Generated marketing script text
+        """
+        return await asyncio.to_thread(
+            self.generate_script, project_id, image_id, project_name, project_description,
+            system_prompt=system_prompt, user_prompt=user_prompt
+        )
+
 class OpenAIClient(LLMClient):
     """OpenAI API client for GPT-4 Vision"""
     
@@ -43,7 +67,10 @@ class OpenAIClient(LLMClient):
         super().__init__()
         self.api_key = os.getenv('OPENAI_API_KEY', self.api_key)
         self.model = os.getenv('OPENAI_MODEL', 'gpt-4-vision-preview')
-        self.client = OpenAI(api_key=self.api_key)
+        # 可指向兼容OpenAI的代理或本地模拟服务
+        self.base_url = (os.getenv('OPENAI_BASE_URL') or 'https://api.openai.com/v1').rstrip('/')
+        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        self.async_client = None
         self.redis_client = redis_client
         
     def get_base64_image_from_redis(self, project_id, image_id):
@@ -52,11 +79,17 @@ class OpenAIClient(LLMClient):
         """
         
         image_key = f"image:{project_id}-image-{image_id}"
-        data_url = self.redis_client.get(image_key)
+        image = load_image(self.redis_client, image_key)
         
-        if not data_url:
+        if not image:
             raise ValueError(f"Image not found in Redis: {image_key}")
         
+        return self.encode_image_bytes(image[1])
+    
+    def encode_image(self, data_url):
+        """
+        Convert an image data URL (or raw base64) to base64 encoded JPEG
+        """
         # 处理data URL格式
         if data_url.startswith('data:'):
             # 提取base64数据
@@ -72,25 +105,96 @@ class OpenAIClient(LLMClient):
         try:
             # 解码base64数据
             image_bytes = base64.b64decode(base64_data)
-            
-            # 使用PIL打开并转换为jpeg
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # 转换为RGB模式（处理可能的RGBA或其他模式）
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # 将图像保存为jpeg格式的字节流
-            output_buffer = io.BytesIO()
-            image.save(output_buffer, format='JPEG')
-            
-            # 获取字节并编码为base64
-            jpeg_bytes = output_buffer.getvalue()
-            return base64.b64encode(jpeg_bytes).decode('utf-8')
         except Exception as e:
-            print(f"Error converting image: {str(e)}")
-            # 如果转换失败，返回原始base64数据
+            logger.error("Error converting image: %s", e)
             return base64_data
+        return self.encode_image_bytes(image_bytes, fallback=base64_data)
+    
+    def encode_image_bytes(self, image_bytes, fallback=None):
+        """
+        Convert image bytes to base64 encoded JPEG
+
+        If the image can't be converted, returns fallback (default: the bytes as base64)
+        """
+        with time_stage('image_normalize', 'openai') as stage:
+            try:
+                # 使用PIL打开并转换为jpeg
+                image = Image.open(io.BytesIO(image_bytes))
+                
+                # 转换为RGB模式（处理可能的RGBA或其他模式）
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                
+                # 将图像保存为jpeg格式的字节流
+                output_buffer = io.BytesIO()
+                image.save(output_buffer, format='JPEG')
+                
+                # 获取字节并编码为base64
+                jpeg_bytes = output_buffer.getvalue()
+                return base64.b64encode(jpeg_bytes).decode('utf-8')
+            except Exception as e:
+                stage.outcome = 'error'
+                logger.error("Error converting image: %s", e)
+                # 如果转换失败，返回原始base64数据
+                return fallback if fallback is not None else base64.b64encode(image_bytes).decode('utf-8')
+    
+    def build_prompts(self, project_name, project_description="", system_prompt="", user_prompt=""):
+        """
+        Fill in the default system/user prompts and the product placeholders
+        
+        Returns:
+            (system_prompt, user_prompt)
+        """
+        # 构建系统提示词（如果提供）
+        if not system_prompt:
+            system_prompt = """
+            你是一位专业的市场营销文案撰写人员，擅长创建引人注目的产品销售脚本。
+            你的任务是根据提供的产品图片创建一个简短、引人入胜的销售脚本。脚本应：
+
+            1. 突出关键特点和优势
+            2. 使用有说服力和专业的语言
+            3. 长度在150-200字之间
+            4. 具有明确的结构：引人注目的开头、吸引人的中间部分和有力的行动号召
+            5. 关注情感吸引力和价值主张
+
+            脚本将用作短视频的配音。请将脚本分为两部分：
+            1. 视频描述：简短介绍视频内容
+            2. 旁白文本：详细的语音旁白内容
+            """
+
+        # 构建用户消息（如果提供）
+        if not user_prompt:
+            user_prompt = f"为名为'{project_name}'的产品创建一个营销脚本"
+            if project_description:
+                user_prompt += f"。产品描述：{project_description}"
+            user_prompt += "。请根据图片中可见的特点和优势来编写脚本。"
+        elif "{product_name}" in user_prompt:
+            # 如果用户提示中包含产品名占位符，替换它
+            user_prompt = user_prompt.replace("{product_name}", project_name)
+
+            # 如果存在产品描述且用户提示中有描述占位符，替换它
+            if project_description and "{product_description}" in user_prompt:
+                user_prompt = user_prompt.replace("{product_description}", project_description)
+        
+        return system_prompt, user_prompt
+    
+    def build_messages(self, system_prompt, user_prompt, base64_image):
+        """Build the chat messages with the product image attached"""
+        return [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user", 
+                "content": [
+                    {"type": "text", "text": user_prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}"
+                        }
+                    }
+                ]
+            }
+        ]
     
     def generate_script(self, project_id, image_id, project_name, project_description="", system_prompt="", user_prompt=""):
         """
@@ -107,87 +211,42 @@ class OpenAIClient(LLMClient):
             Generated marketing script text
         """
         try:
-            print(f"Generating script for project: {project_name}")
-            print(f"Image path: {image_id}")
-            print(f"System prompt: {system_prompt}")
-            print(f"User prompt: {user_prompt}")
+            logger.info("Generating script for project: %s", project_name)
+            logger.debug("Image path: %s", image_id)
 
             # 编码图片
             base64_image = self.get_base64_image_from_redis(project_id, image_id)
             
-            # 构建系统提示词（如果提供）
-            if not system_prompt:
-                system_prompt = """
-                你是一位专业的市场营销文案撰写人员，擅长创建引人注目的产品销售脚本。
-                你的任务是根据提供的产品图片创建一个简短、引人入胜的销售脚本。脚本应：
-                
-                1. 突出关键特点和优势
-                2. 使用有说服力和专业的语言
-                3. 长度在150-200字之间
-                4. 具有明确的结构：引人注目的开头、吸引人的中间部分和有力的行动号召
-                5. 关注情感吸引力和价值主张
-                
-                脚本将用作短视频的配音。请将脚本分为两部分：
-                1. 视频描述：简短介绍视频内容
-                2. 旁白文本：详细的语音旁白内容
-                """
-            
-            # 构建用户消息（如果提供）
-            if not user_prompt:
-                user_prompt = f"为名为'{project_name}'的产品创建一个营销脚本"
-                if project_description:
-                    user_prompt += f"。产品描述：{project_description}"
-                user_prompt += "。请根据图片中可见的特点和优势来编写脚本。"
-            elif "{product_name}" in user_prompt:
-                # 如果用户提示中包含产品名占位符，替换它
-                user_prompt = user_prompt.replace("{product_name}", project_name)
-                
-                # 如果存在产品描述且用户提示中有描述占位符，替换它
-                if project_description and "{product_description}" in user_prompt:
-                    user_prompt = user_prompt.replace("{product_description}", project_description)
+            system_prompt, user_prompt = self.build_prompts(project_name, project_description, system_prompt, user_prompt)
             
             # 打印使用的模型和提示词（调试用）
-            print(f"Using model: {self.model}")
-            print(f"System prompt: {system_prompt}")
-            print(f"User prompt: {user_prompt}")
+            logger.debug("Using model: %s", self.model)
+            logger.debug("System prompt: %s", redact(system_prompt))
+            logger.debug("User prompt: %s", redact(user_prompt))
             
             # 使用新的OpenAI API调用方式
             try:
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user", 
-                        "content": [
-                            {"type": "text", "text": user_prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ]
+                messages = self.build_messages(system_prompt, user_prompt, base64_image)
                 
                 # 打印请求内容（调试用）
-                print(f"Sending request to OpenAI API with model: {self.model}")
+                logger.debug("Sending request to OpenAI API with model: %s", self.model)
                 
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=500,
-                    temperature=0.7
-                )
+                with time_stage('llm_call', 'openai'):
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=500,
+                        temperature=0.7
+                    )
                 
                 # 打印响应（调试用）
-                print(f"OpenAI API response: {response}")
+                logger.debug("OpenAI API response: %s", redact(response))
                 
                 # 提取生成的脚本
                 return response.choices[0].message.content
                 
             except Exception as e:
-                print(f"Error with new API format: {str(e)}")
-                print("Falling back to manual API request...")
+                logger.warning("Error with new API format: %s; falling back to manual API request", e)
                 
                 # 如果新API格式失败，回退到手动API请求
                 headers = {
@@ -223,18 +282,18 @@ class OpenAIClient(LLMClient):
                 }
                 
                 # 发送API请求
-                response = requests.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                response.raise_for_status()
+                with time_stage('llm_call', 'openai'):
+                    response = requests.post(
+                        f"{self.base_url}/chat/completions",
+                        headers=headers,
+                        json=payload
+                    )
+                    response.raise_for_status()
                 
                 # 打印原始响应以进行调试
-                print(f"OpenAI API response: {response.json()}")
-                
                 # 处理响应
                 result = response.json()
+                logger.debug("OpenAI API response: %s", redact(result))
                 
                 # 处理API响应格式
                 try:
@@ -244,17 +303,46 @@ class OpenAIClient(LLMClient):
                         elif 'text' in result['choices'][0]:
                             return result['choices'][0]['text']
                     
-                    print(f"Unexpected API response structure: {result}")
+                    logger.error("Unexpected API response structure: %s", redact(result))
                     return f"Error parsing API response: {result}"
                 except Exception as parse_err:
-                    print(f"Error parsing API response: {str(parse_err)}")
-                    print(f"Original response: {result}")
+                    logger.error("Error parsing API response: %s, original response: %s", parse_err, redact(result))
                     raise
             
         except Exception as e:
-            print(f"Error generating script with OpenAI: {str(e)}")
+            logger.error("Error generating script with OpenAI: %s", e)
             raise
 
+    async def agenerate_script(self, project_id, image_id, project_name, project_description="", system_prompt="", user_prompt="", image_data=None):
+        """
+        Generate marketing script with the async OpenAI client
+        
+        Args:
+            image_data: Optional image data URL, read from Redis when not given
+            
+        Returns:
+            Generated marketing script text
+        """
+        if self.async_client is None:
+            self.async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        
+        if image_data is None:
+            base64_image = await asyncio.to_thread(self.get_base64_image_from_redis, project_id, image_id)
+        else:
+            base64_image = await asyncio.to_thread(self.encode_image, image_data)
+        
+        system_prompt, user_prompt = self.build_prompts(project_name, project_description, system_prompt, user_prompt)
+        logger.info("Generating script for project: %s (async, model %s)", project_name, self.model)
+        
+        with time_stage('llm_call', 'openai'):
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=self.build_messages(system_prompt, user_prompt, base64_image),
+                max_tokens=500,
+                temperature=0.7
+            )
+        return response.choices[0].message.content
+
 class MockLLMClient(LLMClient):
     """Mock LLM client for testing without API access"""
     
@@ -272,7 +360,7 @@ class MockLLMClient(LLMClient):
         Returns:
             A predefined mock script
         """
-        print(f"Generating mock script for project: {project_name}")
+        logger.info("Generating mock script for project: %s", project_name)
         
         # 创建一个示例脚本
         mock_script = f"""视频描述:
@@ -304,7 +392,7 @@ def get_llm_client(redis_client):
     # 检查是否使用模拟客户端
     use_mock = os.getenv('USE_MOCK_LLM', 'false').lower() == 'true'
     if use_mock:
-        print("Using mock LLM client")
+        logger.info("Using mock LLM client")
         return MockLLMClient()
     
     provider = os.getenv('LLM_PROVIDER', 'openai').lower()
@@ -313,5 +401,5 @@ def get_llm_client(redis_client):
         return OpenAIClient(redis_client)
     else:
         # Default to OpenAI if provider not recognized
-        print(f"Warning: Unrecognized LLM provider '{provider}', using OpenAI")
+        logger.warning("Unrecognized LLM provider '%s', using OpenAI", provider)
         return OpenAIClient(redis_client) 
\ No newline at end of file
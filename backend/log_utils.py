@@ -0,0 +1,173 @@
+"""
+Logging for the backend
+
+    logger = get_logger(__name__)
+    logger.info("Video generation task submitted, ID: %s", task_id)
+    logger.debug("Request data: %s", redact(data))
+
+Messages take %-style arguments, so nothing is formatted for records below the
+configured level. Provider payloads carry base64 images and audio, API keys and
+tokens; wrap them in redact() instead of formatting them directly. The wrapper
+does its work only when the record is emitted: secret-looking fields are masked,
+base64 bodies and data URLs are replaced by their length, and long strings are
+truncated. Every emitted message is capped at LOG_MAX_LENGTH as a last resort.
+
+Settings:
+    LOG_LEVEL:            DEBUG, INFO (default), WARNING or ERROR
+    LOG_FORMAT:           text (default) or json (one object per line)
+    LOG_MAX_LENGTH:       Maximum characters of a message (default 4000)
+    LOG_MAX_FIELD_LENGTH: Maximum characters of a string inside a redacted payload (default 300)
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+# Read from the environment when logging is configured (after .env is loaded)
+LOG_MAX_LENGTH = 4000
+LOG_MAX_FIELD_LENGTH = 300
+
+# Field names whose values are never logged
+SECRET_FIELD = re.compile(r'(api_?key|secret|token|password|authorization|signature|credential)', re.IGNORECASE)
+# Field names holding binary content as base64
+BINARY_FIELD = re.compile(r'^(image|image_data|static_mask|mask|audio|audio_base64|b64_json|data_url)$', re.IGNORECASE)
+BASE64_RUN = re.compile(r'^[A-Za-z0-9+/=_-]{64,}$')
+MAX_DEPTH = 6
+
+# Attributes every LogRecord has; anything else came from extra= and goes into JSON output
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def mask_secret(value):
+    """Keep just enough of a secret to tell keys apart"""
+    if not value:
+        return value
+    value = str(value)
+    return f"{value[:4]}***" if len(value) > 12 else "***"
+
+def truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+def redact_value(value, max_field_length=None, depth=0):
+    """
+    Copy of a payload that is safe to log
+
+    Args:
+        value: dict / list / string / anything with model_dump() (OpenAI responses)
+        max_field_length: Maximum characters per string (default LOG_MAX_FIELD_LENGTH)
+    """
+    if max_field_length is None:
+        max_field_length = LOG_MAX_FIELD_LENGTH
+    if depth > MAX_DEPTH:
+        return '...'
+    if hasattr(value, 'model_dump'):
+        value = value.model_dump()
+
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if isinstance(key, str) and SECRET_FIELD.search(key):
+                result[key] = mask_secret(item)
+            elif isinstance(key, str) and BINARY_FIELD.match(key) and isinstance(item, (str, bytes)) \
+                    and len(item) > max_field_length:
+                result[key] = f"<{len(item)} chars>"
+            else:
+                result[key] = redact_value(item, max_field_length, depth + 1)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [redact_value(item, max_field_length, depth + 1) for item in value]
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        if value.startswith('data:') and ';base64,' in value[:100]:
+            return f"<{value.split(',', 1)[0]}, {len(value)} chars>"
+        if len(value) > max_field_length and BASE64_RUN.match(value[:256]):
+            return f"<base64, {len(value)} chars>"
+        return truncate(value, max_field_length)
+    return value
+
+class Redacted:
+    """Lazily redacted payload for log arguments"""
+
+    __slots__ = ('value', 'max_field_length')
+
+    def __init__(self, value, max_field_length=None):
+        self.value = value
+        self.max_field_length = max_field_length
+
+    def __str__(self):
+        value = redact_value(self.value, self.max_field_length)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        return str(value)
+
+    __repr__ = __str__
+
+def redact(value, max_field_length=None):
+    return Redacted(value, max_field_length)
+
+class BackendFormatter(logging.Formatter):
+    """Text or JSON lines, with the message capped at LOG_MAX_LENGTH"""
+
+    def __init__(self, json_output=False, max_length=None):
+        super().__init__('%(asctime)s %(levelname)s [%(name)s] %(message)s')
+        self.json_output = json_output
+        self.max_length = max_length or LOG_MAX_LENGTH
+
+    def format(self, record):
+        message = truncate(record.getMessage(), self.max_length)
+        if not self.json_output:
+            record.message = message
+            record.asctime = self.formatTime(record)
+            text = self.formatMessage(record)
+            if record.exc_info:
+                text = f"{text}\n{self.formatException(record.exc_info)}"
+            return text
+
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': message,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = redact_value(value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def configure_logging(level=None, json_output=None):
+    """Install the backend handler on the root logger (once per process)"""
+    global _configured, LOG_MAX_LENGTH, LOG_MAX_FIELD_LENGTH
+    with _configure_lock:
+        if _configured:
+            return
+        load_dotenv()
+        LOG_MAX_LENGTH = int(os.getenv('LOG_MAX_LENGTH', LOG_MAX_LENGTH))
+        LOG_MAX_FIELD_LENGTH = int(os.getenv('LOG_MAX_FIELD_LENGTH', LOG_MAX_FIELD_LENGTH))
+        if json_output is None:
+            json_output = os.getenv('LOG_FORMAT', 'text').lower() == 'json'
+
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(BackendFormatter(json_output=json_output))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+        # Request-level chatter of the HTTP clients would drown the application logs
+        for name in ('httpx', 'httpcore', 'urllib3', 'openai'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        _configured = True
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(name)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Garbage collection of media files nobody references any more
+
+The media folders only grow: every video attempt writes new clip files, old
+speeches and renders are replaced in the project but stay on disk, test runs leave
+scratch folders behind, and blobs stay after their last image is deleted.
+A pass walks the folders in batches and deletes files that are
+
+- under a project folder (`<root>/<project_id>/...`) whose project no longer
+  exists, or whose name (or parent folder name) appears nowhere in the project
+  record and its history;
+- in a scratch folder (test output);
+- blobs without any image referencing them;
+
+once they are older than the grace period. If a disk quota is set and the folders
+are still over it, unreferenced files that are still in their grace period are
+evicted least recently used first. Referenced media is never evicted, and neither
+are files younger than the minimum eviction age: a running job's clips and outputs
+only become referenced when the job finishes.
+
+Run a single pass by hand (add --dry-run to only report):
+
+    python media_gc.py
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+GC_LOCK_KEY = "media-gc:lock"
+GC_LOCK_TTL = 3600
+GC_REPORT_KEY = "media-gc:report"
+
+# Only the process holding the lock (same token) may extend or release it
+LOCK_REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+LOCK_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class GCLockLost(Exception):
+    """Another process holds the pass lock (ours expired)"""
+
+def overlapping_roots(first, second):
+    """Whether one folder is (inside) the other"""
+    first, second = os.path.realpath(first), os.path.realpath(second)
+    return os.path.commonpath([first, second]) in (first, second)
+
+class MediaGarbageCollector:
+    def __init__(self, redis_client, project_roots, scratch_roots=(), blob_root=None,
+                 get_project_refs=None, get_blob_refs=None, forget_blob=None,
+                 grace_period=86400, quota_bytes=0, min_evict_age=3600, batch_size=500, batch_pause=0.05):
+        """
+        Args:
+            redis_client: Redis client (pass lock and report)
+            project_roots: Folders holding one sub-folder per project
+            scratch_roots: Folders whose content is never referenced
+            blob_root: Root of the local blob store
+            get_project_refs: project_id -> set of path components referenced by
+                the project, None if the project doesn't exist
+            get_blob_refs: list of digests -> list of booleans (blob still referenced)
+            forget_blob: Called with the digest of each deleted blob
+            grace_period: Seconds an unreferenced file is kept after its last modification
+            quota_bytes: Disk quota for all folders, 0 for none
+            min_evict_age: Seconds after its last modification before an unreferenced
+                file may be evicted for the quota (longer than any job runs)
+            batch_size: Files examined per batch
+            batch_pause: Seconds to sleep between batches
+
+        Raises:
+            ValueError: A scratch folder overlaps a project folder or the blob store,
+                whose files would all be deleted as scratch files
+        """
+        self.redis = redis_client
+        self.project_roots = [root for root in project_roots if root]
+        self.scratch_roots = [root for root in scratch_roots if root]
+        self.blob_root = blob_root
+        for scratch_root in self.scratch_roots:
+            for root in self.project_roots + ([blob_root] if blob_root else []):
+                if overlapping_roots(scratch_root, root):
+                    raise ValueError(f"Scratch folder {scratch_root} overlaps media folder {root}")
+        self.get_project_refs = get_project_refs
+        self.get_blob_refs = get_blob_refs
+        self.forget_blob = forget_blob
+        self.grace_period = grace_period
+        self.quota_bytes = quota_bytes
+        self.min_evict_age = min_evict_age
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.refresh_lock_script = redis_client.register_script(LOCK_REFRESH_SCRIPT)
+        self.release_lock_script = redis_client.register_script(LOCK_RELEASE_SCRIPT)
+        self.lock_token = None
+
+    def iter_files(self):
+        """Yield (kind, root, path, stat) for every file, walking each root once"""
+        roots = [('project', root) for root in self.project_roots]
+        roots += [('scratch', root) for root in self.scratch_roots]
+        if self.blob_root:
+            roots.append(('blob', self.blob_root))
+        for kind, root in roots:
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        yield kind, root, path, os.stat(path)
+                    except FileNotFoundError:
+                        continue
+
+    def iter_batches(self):
+        batch = []
+        for entry in self.iter_files():
+            batch.append(entry)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def classify(self, batch, project_refs):
+        """Whether each file of a batch is still referenced"""
+        referenced = [False] * len(batch)
+        blob_indexes = []
+        for index, (kind, root, path, _) in enumerate(batch):
+            parts = os.path.relpath(path, root).split(os.sep)
+            if kind == 'project' and len(parts) >= 2:
+                project_id = parts[0]
+                if project_id not in project_refs:
+                    project_refs[project_id] = self.get_project_refs(project_id)
+                refs = project_refs[project_id]
+                referenced[index] = refs is not None and any(part in refs for part in parts[1:])
+            elif kind == 'blob' and len(parts) == 3:
+                # ab/cd/<digest>; anything else (e.g. tmp/) is an interrupted upload
+                blob_indexes.append(index)
+
+        if blob_indexes and self.get_blob_refs:
+            digests = [os.path.basename(batch[index][2]) for index in blob_indexes]
+            for index, is_referenced in zip(blob_indexes, self.get_blob_refs(digests)):
+                referenced[index] = is_referenced
+        return referenced
+
+    def remove(self, kind, path, stat, report, dry_run):
+        """Delete a file classified as garbage, unless it changed since it was scanned"""
+        if kind == 'blob':
+            # Nothing is deleted once another process may be running a pass
+            self.refresh_lock()
+        try:
+            # Rewritten since the scan (an upload of the same content touches the blob)
+            if os.stat(path).st_mtime != stat.st_mtime:
+                return False
+        except FileNotFoundError:
+            return False
+        if kind == 'blob' and self.get_blob_refs:
+            # A new upload may have referenced the blob since the batch was classified
+            if self.get_blob_refs([os.path.basename(path)])[0]:
+                return False
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+            if kind == 'blob' and self.forget_blob:
+                self.forget_blob(os.path.basename(path))
+        report['deleted_files'] += 1
+        return True
+
+    def run_once(self, dry_run=False):
+        """
+        Run one collection pass
+
+        Returns:
+            The report dict, None if another process is running a pass (or took
+            over the lock during this one, which then stops)
+        """
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        if not self.redis.set(GC_LOCK_KEY, token, nx=True, ex=GC_LOCK_TTL):
+            return None
+        self.lock_token = token
+        try:
+            return self.collect(dry_run)
+        except GCLockLost:
+            logger.warning("Media GC lock expired and was taken by another process, stopping this pass")
+            return None
+        finally:
+            self.lock_token = None
+            self.release_lock_script(keys=[GC_LOCK_KEY], args=[token])
+
+    def refresh_lock(self):
+        """Extend the lock held by run_once so a long pass keeps it; raise GCLockLost if it's gone"""
+        if self.lock_token and not self.refresh_lock_script(keys=[GC_LOCK_KEY], args=[self.lock_token, GC_LOCK_TTL]):
+            raise GCLockLost()
+
+    def collect(self, dry_run=False):
+        started = time.time()
+        report = {
+            'started_at': started,
+            'dry_run': dry_run,
+            'scanned_files': 0,
+            'deleted_files': 0,
+            'reclaimed_bytes': 0,
+            'evicted_files': 0,
+            'usage_bytes': 0,
+            'over_quota_bytes': 0,
+        }
+        project_refs = {}
+        evictable = []
+        for batch in self.iter_batches():
+            for (kind, _, path, stat), referenced in zip(batch, self.classify(batch, project_refs)):
+                report['scanned_files'] += 1
+                report['usage_bytes'] += stat.st_size
+                if referenced:
+                    continue
+                if started - stat.st_mtime > self.grace_period:
+                    if self.remove(kind, path, stat, report, dry_run):
+                        report['reclaimed_bytes'] += stat.st_size
+                        report['usage_bytes'] -= stat.st_size
+                elif started - stat.st_mtime > self.min_evict_age:
+                    evictable.append((max(stat.st_atime, stat.st_mtime), path, kind, stat))
+            self.refresh_lock()
+            time.sleep(self.batch_pause)
+
+        if self.quota_bytes and report['usage_bytes'] > self.quota_bytes:
+            # Least recently used first
+            for _, path, kind, stat in sorted(evictable, key=lambda entry: entry[:2]):
+                if report['usage_bytes'] <= self.quota_bytes:
+                    break
+                if self.remove(kind, path, stat, report, dry_run):
+                    report['evicted_files'] += 1
+                    report['reclaimed_bytes'] += stat.st_size
+                    report['usage_bytes'] -= stat.st_size
+            report['over_quota_bytes'] = max(report['usage_bytes'] - self.quota_bytes, 0)
+
+        if not dry_run:
+            self.remove_empty_dirs(started)
+        report['duration'] = round(time.time() - started, 3)
+        self.redis.set(GC_REPORT_KEY, json.dumps(report))
+        logger.info(
+            "Media GC: scanned %s files, deleted %s (%s evicted for quota), reclaimed %s bytes, usage %s bytes",
+            report['scanned_files'], report['deleted_files'], report['evicted_files'],
+            report['reclaimed_bytes'], report['usage_bytes']
+        )
+        if report['over_quota_bytes']:
+            logger.warning("Media GC: still %s bytes over quota, all of it referenced or too recent to evict",
+                           report['over_quota_bytes'])
+        return report
+
+    def remove_empty_dirs(self, now):
+        """Remove empty sub-folders old enough not to be a job's freshly created output folder"""
+        for root in self.project_roots + self.scratch_roots + ([self.blob_root] if self.blob_root else []):
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, _ in os.walk(root, topdown=False):
+                if dirpath == root:
+                    continue
+                try:
+                    if now - os.stat(dirpath).st_mtime > self.grace_period:
+                        os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def start(self, interval):
+        """Run a pass every interval seconds in a daemon thread"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.exception("Media GC failed: %s", e)
+
+        thread = threading.Thread(target=loop, daemon=True, name="media-gc")
+        thread.start()
+        return thread
+
+if __name__ == '__main__':
+    import sys
+    from app import build_media_gc
+
+    result = build_media_gc().run_once(dry_run='--dry-run' in sys.argv)
+    if result is None:
+        logger.info("Another media GC pass is running")
+    else:
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,277 @@
+"""
+Prometheus metrics for the pipeline stages and HTTP requests
+
+    with time_stage('kling_submit', 'kling') as stage:
+        response = requests.post(...)
+        stage.outcome = 'ok' if response.status_code == 200 else 'error'
+
+    @timed_stage('ffprobe', 'ffmpeg')
+    def get_duration(path): ...
+
+Observations are only added up in memory, so instrumenting a hot path costs a
+lock and a few additions. The API workers and worker.py are separate processes
+(possibly on separate hosts), so each process flushes its deltas into Redis
+hashes (`metrics:{name}`) every METRICS_FLUSH_INTERVAL seconds and GET /metrics
+renders the totals of all of them in the Prometheus text format.
+
+A stage that raises is recorded with outcome "error"; otherwise the outcome is
+"ok" unless the block sets another one. Stages are also trace spans (see tracing.py).
+"""
+
+import os
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+import redis
+
+from log_utils import get_logger
+from tracing import start_span, end_span
+
+logger = get_logger(__name__)
+
+METRICS_KEY_PREFIX = "metrics:"
+
+# Pipeline stages: Redis reads take milliseconds, Kling queue waits minutes
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+class Metric:
+    def __init__(self, name, help_text, label_names, buckets=None):
+        """
+        Args:
+            name: Metric name
+            help_text: HELP line
+            label_names: Names of the labels, in order
+            buckets: Upper bounds of a histogram's buckets, None for a counter
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+
+    @property
+    def kind(self):
+        return 'counter' if self.buckets is None else 'histogram'
+
+    def label_string(self, labels):
+        return ','.join(
+            f'{name}="{escape_label(str(value))}"' for name, value in zip(self.label_names, labels)
+        )
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+STAGE_DURATION = Metric(
+    'pipeline_stage_duration_seconds',
+    'Time spent in each pipeline stage',
+    ('stage', 'provider', 'outcome'), STAGE_BUCKETS
+)
+STAGE_TOTAL = Metric(
+    'pipeline_stage_total',
+    'Pipeline stage executions',
+    ('stage', 'provider', 'outcome')
+)
+STAGE_BYTES = Metric(
+    'pipeline_stage_bytes_total',
+    'Bytes moved by pipeline stages (uploads to and downloads from providers)',
+    ('stage', 'provider')
+)
+HTTP_DURATION = Metric(
+    'http_request_duration_seconds',
+    'HTTP request latency',
+    ('method', 'endpoint', 'status'), HTTP_BUCKETS
+)
+HTTP_RESPONSE_SIZE = Metric(
+    'http_response_size_bytes',
+    'HTTP response body size',
+    ('method', 'endpoint', 'status'), SIZE_BUCKETS
+)
+
+METRICS = (STAGE_DURATION, STAGE_TOTAL, STAGE_BYTES, HTTP_DURATION, HTTP_RESPONSE_SIZE)
+
+class MetricsRegistry:
+    """In-memory deltas of this process, flushed to Redis"""
+
+    def __init__(self, metrics=METRICS, flush_interval=5, enabled=True):
+        self.metrics = {metric.name: metric for metric in metrics}
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.redis = None
+        self.lock = threading.Lock()
+        # (metric name, labels) -> counter value, or histogram [bucket counts..., +Inf count, sum]
+        self.pending = {}
+        self.pid = None
+
+    def configure(self, redis_client, flush_interval=None, enabled=None):
+        self.redis = redis_client
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if enabled is not None:
+            self.enabled = enabled
+
+    def inc(self, metric, labels, amount=1):
+        if not self.enabled:
+            return
+        self._start_flusher()
+        key = (metric.name, tuple(labels))
+        with self.lock:
+            self.pending[key] = self.pending.get(key, 0) + amount
+
+    def observe(self, metric, labels, value):
+        if not self.enabled:
+            return
+        self._start_flusher()
+        key = (metric.name, tuple(labels))
+        with self.lock:
+            values = self.pending.get(key)
+            if values is None:
+                values = self.pending[key] = [0] * (len(metric.buckets) + 2)
+            for index, bound in enumerate(metric.buckets):
+                if value <= bound:
+                    values[index] += 1
+                    break
+            else:
+                values[-2] += 1
+            values[-1] += value
+
+    def flush(self):
+        """Add the pending deltas to the Redis totals"""
+        if self.redis is None:
+            return
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for (name, labels), value in pending.items():
+            metric = self.metrics[name]
+            key = f"{METRICS_KEY_PREFIX}{name}"
+            label_string = metric.label_string(labels)
+            if metric.buckets is None:
+                pipe.hincrbyfloat(key, f"{label_string}|value", value)
+                continue
+            # Buckets are stored non-cumulative, only the non-zero ones
+            for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                if count:
+                    pipe.hincrby(key, f"{label_string}|{bound}", count)
+            pipe.hincrby(key, f"{label_string}|count", sum(value[:-1]))
+            pipe.hincrbyfloat(key, f"{label_string}|sum", value[-1])
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Failed to flush metrics: %s", e)
+
+    def render(self):
+        """All totals in the Prometheus text exposition format"""
+        self.flush()
+        pipe = self.redis.pipeline(transaction=False)
+        for metric in self.metrics.values():
+            pipe.hgetall(f"{METRICS_KEY_PREFIX}{metric.name}")
+        lines = []
+        for metric, fields in zip(self.metrics.values(), pipe.execute()):
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            series = {}
+            for field, value in fields.items():
+                label_string, _, suffix = field.rpartition('|')
+                series.setdefault(label_string, {})[suffix] = value
+            for label_string in sorted(series):
+                values = series[label_string]
+                if metric.buckets is None:
+                    lines.append(f"{metric.name}{{{label_string}}} {format_value(values.get('value', 0))}")
+                    continue
+                prefix = f"{label_string}," if label_string else ''
+                cumulative = 0
+                for bound in metric.buckets:
+                    cumulative += int(values.get(str(bound), 0))
+                    lines.append(f'{metric.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{metric.name}_bucket{{{prefix}le="+Inf"}} {values.get("count", 0)}')
+                lines.append(f"{metric.name}_sum{{{label_string}}} {format_value(values.get('sum', 0))}")
+                lines.append(f"{metric.name}_count{{{label_string}}} {values.get('count', 0)}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Drop all totals (all processes)"""
+        with self.lock:
+            self.pending = {}
+        if self.redis is not None:
+            self.redis.delete(*[f"{METRICS_KEY_PREFIX}{name}" for name in self.metrics])
+
+    def _start_flusher(self):
+        if self.pid == os.getpid() or self.redis is None:
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # First observation in this process (gunicorn forks after the app is imported)
+            self.pid = os.getpid()
+            self.pending = {}
+        threading.Thread(target=self._flush_loop, daemon=True, name="metrics-flush").start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+def format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+registry = MetricsRegistry()
+
+class StageTimer:
+    """Timing of one stage execution; set outcome to override "ok" """
+
+    __slots__ = ('stage', 'provider', 'outcome', 'started')
+
+    def __init__(self, stage, provider):
+        self.stage = stage
+        self.provider = provider
+        self.outcome = 'ok'
+        self.started = time.perf_counter()
+
+    def finish(self):
+        labels = (self.stage, self.provider, self.outcome)
+        registry.observe(STAGE_DURATION, labels, time.perf_counter() - self.started)
+        registry.inc(STAGE_TOTAL, labels)
+
+@contextmanager
+def time_stage(stage, provider=''):
+    span, token = start_span(stage, attributes={'pipeline.stage': stage, 'pipeline.provider': provider})
+    timer = StageTimer(stage, provider)
+    error = None
+    try:
+        yield timer
+    except BaseException as e:
+        timer.outcome = 'error'
+        error = e
+        raise
+    finally:
+        timer.finish()
+        if span is not None:
+            span.set_attribute('pipeline.outcome', timer.outcome)
+            if timer.outcome != 'ok' and error is None:
+                span.set_error(timer.outcome)
+        end_span(span, token, error)
+
+def timed_stage(stage, provider=''):
+    """Decorator form of time_stage for plain functions"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with time_stage(stage, provider):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_bytes(stage, provider, size):
+    registry.inc(STAGE_BYTES, (stage, provider), size)
+
+def observe_http(method, endpoint, status, seconds, size):
+    labels = (method, endpoint, str(status))
+    registry.observe(HTTP_DURATION, labels, seconds)
+    if size is not None:
+        registry.observe(HTTP_RESPONSE_SIZE, labels, size)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Move image bodies still stored in Redis (data URLs) into the blob store
+
+    python migrate_images.py
+
+Only the image:{project_id}-image-{image_id} value is rewritten to a blob
+reference; images already in the blob store are skipped, so it can be re-run.
+"""
+
+import io
+
+from app import redis_client, get_blob_refs_key, get_image_ref
+from blob_store import get_blob_store, image_record, parse_image_record, decode_image_value
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+def migrate_images():
+    store = get_blob_store()
+    migrated = 0
+    freed = 0
+    for image_key in redis_client.scan_iter(match='image:*', count=100):
+        value = redis_client.get(image_key)
+        if not value or parse_image_record(value):
+            continue
+        mime_type, data = decode_image_value(value)
+        digest, size = store.put(io.BytesIO(data))
+        # Only replace the value if the image hasn't changed meanwhile
+        with redis_client.pipeline() as pipe:
+            pipe.watch(image_key)
+            if pipe.get(image_key) != value:
+                continue
+            pipe.multi()
+            pipe.set(image_key, image_record(digest, mime_type, size))
+            pipe.sadd(get_blob_refs_key(digest), get_image_ref(image_key))
+            pipe.execute()
+        migrated += 1
+        freed += len(value)
+        logger.info("Migrated %s -> %s", image_key, digest)
+    logger.info("Migrated %s images, about %.1f MB moved out of Redis", migrated, freed / 1024 / 1024)
+
+if __name__ == '__main__':
+    migrate_images()
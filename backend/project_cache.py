@@ -0,0 +1,119 @@
+"""
+Per-process read-through cache of project documents
+
+A single page load reads the same project several times (details, images, speech,
+templates), so each worker keeps the raw Redis hashes of recently read projects.
+Every write publishes the project key on PROJECT_CHANNEL; a listener thread in
+each process drops the published keys. Until the listener is subscribed (or
+after it loses its connection) the cache is bypassed, and entries also expire
+after a short TTL as a safety net.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import redis
+
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+PROJECT_CHANNEL = "projects:changed"
+
+class ProjectCache:
+    def __init__(self, redis_client, max_size=256, ttl=60):
+        """
+        Args:
+            redis_client: Redis client used for the invalidation subscription
+            max_size: Maximum number of cached projects, 0 disables the cache
+            ttl: Seconds an entry may be served without being refreshed
+        """
+        self.redis = redis_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped on every invalidation; a read started before it must not be cached
+        self.generation = 0
+        self.ready = False
+        self.pid = None
+
+    def get(self, key):
+        """Return the cached raw hash for a project key, or None"""
+        if not self.active():
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, raw = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return raw
+
+    def put(self, key, raw, generation):
+        """Cache a raw hash read while the cache was at the given generation"""
+        if not self.active():
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, raw)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def publish(self, client, key):
+        """Queue an invalidation of a project key on a client or pipeline"""
+        client.publish(PROJECT_CHANNEL, key)
+
+    def active(self):
+        """Whether lookups may use the cache; starts the listener in a new process"""
+        if self.max_size <= 0:
+            return False
+        if self.pid != os.getpid():
+            # First use in this process (gunicorn forks after the app is imported)
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    self.ready = False
+                    self.entries.clear()
+                    threading.Thread(target=self._listen, daemon=True, name="project-cache").start()
+        return self.ready
+
+    def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                pubsub.subscribe(PROJECT_CHANNEL)
+                while True:
+                    message = pubsub.get_message(timeout=30)
+                    if message is None:
+                        continue
+                    if message['type'] == 'subscribe':
+                        # Anything cached before the subscription may have missed invalidations
+                        self.clear()
+                        self.ready = True
+                    elif message['type'] == 'message':
+                        self.invalidate(message['data'])
+            except redis.RedisError as e:
+                self.ready = False
+                self.clear()
+                logger.warning("Project cache listener disconnected, retrying: %s", e)
+                time.sleep(1)
+            finally:
+                pubsub.close()
@@ -1,8 +1,64 @@
 import os
+import json
+import math
 import subprocess
+import tempfile
 import ffmpeg
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Dict, Any
 
+from metrics import timed_stage
+
+# 命名的输出配置，全部使用软件编码器（libx264/aac），不依赖特定的硬件编码器
+#   preview: 快速编码的低码率预览，用于应用内审阅
+#   final:   面向网页分发的高质量成片，moov 前置以便边下边播
+OUTPUT_PROFILES: Dict[str, Dict[str, Any]] = {
+    'preview': {
+        'max_height': 480,
+        'options': {
+            'vcodec': 'libx264',
+            'preset': 'ultrafast',
+            'tune': 'fastdecode',
+            'crf': 32,
+            'pix_fmt': 'yuv420p',
+            'acodec': 'aac',
+            'b:a': '96k',
+            'movflags': '+faststart'
+        }
+    },
+    'final': {
+        'max_height': None,
+        'options': {
+            'vcodec': 'libx264',
+            'preset': 'slow',
+            'crf': 20,
+            'profile:v': 'high',
+            'pix_fmt': 'yuv420p',
+            'acodec': 'aac',
+            'b:a': '192k',
+            'movflags': '+faststart'
+        }
+    }
+}
+
+def get_output_profile(name: str) -> Dict[str, Any]:
+    """
+    获取命名的输出配置。
+    
+    参数:
+        name: 配置名称，见 OUTPUT_PROFILES
+        
+    返回:
+        包含 max_height 和 options（ffmpeg 输出选项）的字典
+        
+    异常:
+        ValueError: 配置不存在
+    """
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile: {name}")
+    profile = OUTPUT_PROFILES[name]
+    return {'max_height': profile['max_height'], 'options': dict(profile['options'])}
+
+@timed_stage('ffprobe', 'ffmpeg')
 def get_duration(path: str) -> float:
     """
     使用 ffprobe 获取文件总时长（秒）。
@@ -31,6 +87,234 @@ def get_duration(path: str) -> float:
         raise RuntimeError(f"ffprobe error for {path}:\n{proc.stderr.strip()}")
     return float(proc.stdout.strip())
 
+def is_faststart(path: str) -> bool:
+    """
+    检查 MP4 文件的 moov 原子是否位于 mdat 之前（即是否可以边下载边播放）。
+    
+    只读取顶层 box 的头部，不读取媒体数据。
+    
+    参数:
+        path: MP4 文件路径
+        
+    返回:
+        moov 位于 mdat 之前时返回 True
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size = int.from_bytes(header[:4], 'big')
+            box_type = header[4:8]
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if size == 1:
+                # 64位长度，紧跟在box类型之后
+                extended = f.read(8)
+                if len(extended) < 8:
+                    return False
+                size = int.from_bytes(extended, 'big')
+                if size < 16:
+                    # 损坏的长度会让下一次seek原地不动或后退，导致死循环
+                    return False
+                f.seek(size - 16, os.SEEK_CUR)
+            elif size == 0:
+                # box一直延续到文件末尾，后面不会再有moov
+                return False
+            elif size < 8:
+                # 损坏的长度（小于box头部本身）
+                return False
+            else:
+                f.seek(size - 8, os.SEEK_CUR)
+
+def faststart_options(output_path: str) -> Dict[str, Any]:
+    """
+    返回将 moov 原子前置的输出选项（仅对 MP4/MOV 容器有效）。
+    """
+    if os.path.splitext(output_path)[1].lower() in ('.mp4', '.m4v', '.mov'):
+        return {'movflags': '+faststart'}
+    return {}
+
+@timed_stage('ffmpeg_remux', 'ffmpeg')
+def remux_faststart(path: str) -> bool:
+    """
+    仅重新封装（不重新编码）MP4 文件，把 moov 原子移到文件开头，原地替换。
+    
+    参数:
+        path: MP4 文件路径
+        
+    返回:
+        是否进行了重新封装（文件已经是 faststart 时返回 False）
+        
+    异常:
+        ffmpeg运行时可能引发的各种异常
+    """
+    if is_faststart(path):
+        return False
+    root, ext = os.path.splitext(path)
+    temp_path = f"{root}.faststart{ext}"
+    try:
+        (
+            ffmpeg
+            .input(path)
+            .output(temp_path, c='copy', map=0, movflags='+faststart')
+            .run(overwrite_output=True, quiet=True)
+        )
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return True
+
+@timed_stage('ffprobe', 'ffmpeg')
+def probe_video_stream(path: str) -> Dict[str, Any]:
+    """
+    使用 ffprobe 获取文件第一路视频流的编码参数。
+    
+    参数:
+        path: 视频文件路径
+        
+    返回:
+        包含 codec_name、profile、width、height、pix_fmt、r_frame_rate、time_base 的字典
+        
+    异常:
+        FileNotFoundError: 文件不存在
+        RuntimeError: ffprobe执行失败或文件中没有视频流
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"File not found: {path}")
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,width,height,pix_fmt,r_frame_rate,time_base',
+        '-of', 'json',
+        path
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffprobe error for {path}:\n{proc.stderr.strip()}")
+    streams = json.loads(proc.stdout).get('streams', [])
+    if not streams:
+        raise RuntimeError(f"No video stream found in {path}")
+    return streams[0]
+
+def parse_frame_rate(rate: str) -> float:
+    """
+    将 ffprobe 输出的帧率（如 '30000/1001'）转换为浮点数。
+    """
+    if '/' in rate:
+        num, den = rate.split('/', 1)
+        return float(num) / float(den) if float(den) else 0.0
+    return float(rate)
+
+@timed_stage('ffmpeg_merge', 'ffmpeg')
+def concat_videos(
+    clip_paths: List[str],
+    output_path: str,
+    crossfade: float = 0.0,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    fps: Optional[float] = None,
+    video_codec: str = 'libx264',
+    crf: int = 20,
+    preset: str = 'veryfast'
+) -> None:
+    """
+    将多个视频片段按顺序拼接为一个视频（只保留视频流，旁白随后由 sync_audio_to_video 添加）。
+    
+    如果不需要转场，且所有片段的编码、分辨率、像素格式和帧率都一致，
+    使用 concat demuxer 直接复制码流，不重新编码；
+    否则先把每个片段缩放/填充到统一的分辨率和帧率，再用 concat 或 xfade 滤镜重新编码。
+    
+    参数:
+        clip_paths: 输入视频片段路径列表（按播放顺序）
+        output_path: 输出视频文件路径
+        crossfade: 相邻片段之间的交叉淡化时长（秒），0 表示直接拼接
+        width: 输出宽度，默认为第一个片段的宽度
+        height: 输出高度，默认为第一个片段的高度
+        fps: 输出帧率，默认为第一个片段的帧率
+        video_codec: 需要重新编码时使用的视频编码器
+        crf: 重新编码时的质量参数
+        preset: 重新编码时的编码速度预设
+        
+    返回:
+        None
+        
+    异常:
+        ValueError: 没有提供片段
+        ffmpeg运行时可能引发的各种异常
+    """
+    if not clip_paths:
+        raise ValueError("No clips to concatenate")
+
+    streams = [probe_video_stream(path) for path in clip_paths]
+    first = streams[0]
+    width = width or int(first['width'])
+    height = height or int(first['height'])
+    fps = fps or parse_frame_rate(first['r_frame_rate'])
+
+    # 1. 参数完全一致且不需要转场：concat demuxer 无损拼接
+    keys = ('codec_name', 'profile', 'width', 'height', 'pix_fmt', 'r_frame_rate', 'time_base')
+    params_match = all(
+        all(stream.get(key) == first.get(key) for key in keys) for stream in streams
+    ) and int(first['width']) == width and int(first['height']) == height \
+        and abs(parse_frame_rate(first['r_frame_rate']) - fps) < 0.01
+
+    if params_match and crossfade <= 0:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as list_file:
+            for path in clip_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                list_file.write(f"file '{escaped}'\n")
+            list_path = list_file.name
+        try:
+            (
+                ffmpeg
+                .input(list_path, format='concat', safe=0)
+                .output(output_path, c='copy', an=None, **faststart_options(output_path))
+                .run(overwrite_output=True)
+            )
+        finally:
+            os.unlink(list_path)
+        return
+
+    # 2. 统一分辨率、帧率和像素格式
+    normalized = []
+    for path in clip_paths:
+        stream = (
+            ffmpeg.input(path).video
+            .filter('scale', width, height, force_original_aspect_ratio='decrease')
+            .filter('pad', width, height, '(ow-iw)/2', '(oh-ih)/2')
+            .filter('setsar', 1)
+            .filter('fps', fps=fps)
+            .filter('format', 'yuv420p')
+        )
+        normalized.append(stream)
+
+    # 3. 拼接（可选交叉淡化）
+    if crossfade > 0 and len(normalized) > 1:
+        durations = [get_duration(path) for path in clip_paths]
+        combined = normalized[0]
+        timeline = durations[0]
+        for stream, duration in zip(normalized[1:], durations[1:]):
+            fade = min(crossfade, timeline, duration)
+            combined = ffmpeg.filter(
+                [combined, stream], 'xfade',
+                transition='fade', duration=fade, offset=timeline - fade
+            )
+            timeline += duration - fade
+    else:
+        combined = ffmpeg.concat(*normalized, v=1, a=0)
+
+    (
+        ffmpeg
+        .output(combined, output_path, vcodec=video_codec, crf=crf, preset=preset, pix_fmt='yuv420p',
+                **faststart_options(output_path))
+        .run(overwrite_output=True)
+    )
+
 def make_atempo_chain(ratio: float) -> List[Tuple[str, float]]:
     """
     构建一系列 ('atempo', factor) 滤镜，使得最终比例为 ratio，
@@ -52,51 +336,174 @@ def make_atempo_chain(ratio: float) -> List[Tuple[str, float]]:
     parts.append(('atempo', ratio))
     return parts
 
+def plan_clip_timing(
+    audio_duration: float,
+    image_count: int,
+    clip_durations: Tuple[float, ...] = (5, 10),
+    max_clips: Optional[int] = None,
+    crossfade: float = 0.0
+) -> Dict[str, Any]:
+    """
+    根据旁白时长选择每个视频片段的时长和片段数量，使旁白只需要最小的变速。
+    
+    每张图片至少生成一个片段；片段数量超过图片数量时按顺序循环使用图片。
+    在速度比最接近 1 的方案中优先选择总时长更短（生成成本更低）的方案。
+    
+    参数:
+        audio_duration: 旁白时长（秒）
+        image_count: 可用的图片数量
+        clip_durations: 视频生成服务支持的片段时长（秒）
+        max_clips: 最大片段数量，默认为图片数量
+        crossfade: 片段之间的交叉淡化时长（秒）
+        
+    返回:
+        包含 clip_duration、clip_count、video_duration、tempo 的字典
+    """
+    if image_count < 1:
+        raise ValueError("image_count must be at least 1")
+    max_clips = max(max_clips or image_count, image_count)
+
+    best = None
+    for clip_count in range(image_count, max_clips + 1):
+        for clip_duration in clip_durations:
+            video_duration = clip_count * clip_duration - (clip_count - 1) * crossfade
+            if video_duration <= 0:
+                continue
+            tempo = audio_duration / video_duration
+            score = (abs(math.log(tempo)), video_duration)
+            if best is None or score < best[0]:
+                best = (score, {
+                    'clip_duration': clip_duration,
+                    'clip_count': clip_count,
+                    'video_duration': video_duration,
+                    'tempo': tempo
+                })
+    return best[1]
+
+def plan_audio_fit(
+    video_duration: float,
+    audio_duration: float,
+    max_tempo_deviation: float = 0.1,
+    extend: str = 'freeze'
+) -> Dict[str, Any]:
+    """
+    规划旁白与视频的对齐方式：音频变速限制在 1±max_tempo_deviation 之内，
+    剩余的时长差通过延长视频（定格最后一帧或循环播放）或在音频末尾补静音来弥补。
+    
+    参数:
+        video_duration: 视频时长（秒）
+        audio_duration: 音频时长（秒）
+        max_tempo_deviation: 允许的最大变速幅度，例如 0.1 表示 0.9~1.1 倍速
+        extend: 视频比旁白短时的延长方式，'freeze'（定格尾帧）或 'loop'（循环播放）
+        
+    返回:
+        包含 tempo、extend、extend_duration、output_duration 的字典
+    """
+    if extend not in ('freeze', 'loop'):
+        raise ValueError(f"Unsupported extend mode: {extend}")
+    ratio = audio_duration / video_duration
+    tempo = min(max(ratio, 1.0 - max_tempo_deviation), 1.0 + max_tempo_deviation)
+    fitted_audio = audio_duration / tempo
+    extend_duration = fitted_audio - video_duration
+    if extend_duration > 0.01:
+        return {
+            'tempo': tempo,
+            'extend': extend,
+            'extend_duration': extend_duration,
+            'output_duration': fitted_audio
+        }
+    return {
+        'tempo': tempo,
+        'extend': None,
+        'extend_duration': 0.0,
+        'output_duration': video_duration
+    }
+
+@timed_stage('ffmpeg_merge', 'ffmpeg')
 def sync_audio_to_video(
     video_path: str,
     audio_path: str,
     output_path: str,
     video_codec: str = 'copy',
     audio_codec: str = 'aac',
-    audio_bitrate: Optional[str] = None
-) -> None:
+    audio_bitrate: Optional[str] = None,
+    max_tempo_deviation: Optional[float] = None,
+    extend: str = 'freeze',
+    video_duration: Optional[float] = None,
+    audio_duration: Optional[float] = None,
+    profile: Optional[str] = None
+) -> Dict[str, Any]:
     """
     将 audio_path 对齐到 video_path 的时长，并将处理后的音频与视频合并到 output_path。
     
+    默认把音频完整变速到视频时长；指定 max_tempo_deviation 时使用规划模式（见 plan_audio_fit），
+    音频最多轻微变速，视频不够长时定格尾帧或循环播放。
+    
     参数:
         video_path: 输入视频文件路径
         audio_path: 输入音频文件路径
         output_path: 输出视频文件路径
-        video_codec: 视频编码器，默认为'copy'（无损复制）
+        video_codec: 视频编码器，默认为'copy'（无损复制）；定格尾帧需要重新编码，此时改用'libx264'
         audio_codec: 音频编码器，默认为'aac'
         audio_bitrate: 音频比特率，例如'192k'，默认为None（使用编码器默认值）
+        max_tempo_deviation: 规划模式下允许的最大变速幅度，默认为None（完整变速）
+        extend: 规划模式下视频的延长方式，'freeze' 或 'loop'
+        video_duration: 已探测的视频时长，默认为None（使用 ffprobe 获取）
+        audio_duration: 已探测的音频时长，默认为None（使用 ffprobe 获取）
+        profile: 命名的输出配置（'preview' 或 'final'），指定时覆盖 video_codec 和 audio_codec
         
     返回:
-        None
+        实际使用的对齐方案（tempo、extend、extend_duration、output_duration）
         
     异常:
         ffmpeg运行时可能引发的各种异常
     """
     # 1. 获取时长
-    dv = get_duration(video_path)
-    da = get_duration(audio_path)
+    dv = video_duration or get_duration(video_path)
+    da = audio_duration or get_duration(audio_path)
     # 2. 计算速度比
-    ratio = da / dv
-    # 3. 拆分 atempo 滤镜
-    filters = make_atempo_chain(ratio)
+    if max_tempo_deviation is None:
+        plan = {'tempo': da / dv, 'extend': None, 'extend_duration': 0.0, 'output_duration': dv}
+    else:
+        plan = plan_audio_fit(dv, da, max_tempo_deviation, extend)
+    # 3. 拆分 atempo 滤镜（速度比为 1 时不需要滤镜）
+    filters = [] if abs(plan['tempo'] - 1.0) < 1e-3 else make_atempo_chain(plan['tempo'])
     # 4. 构建 ffmpeg-python 流图
-    video_in = ffmpeg.input(video_path)
+    if plan['extend'] == 'loop':
+        video_in = ffmpeg.input(video_path, stream_loop=-1)
+    else:
+        video_in = ffmpeg.input(video_path)
+    video_stream = video_in.video
+    if plan['extend'] == 'freeze':
+        video_stream = video_stream.filter(
+            'tpad', stop_mode='clone', stop_duration=plan['extend_duration']
+        )
+        if video_codec == 'copy':
+            video_codec = 'libx264'
     audio_in = ffmpeg.input(audio_path).audio
     # 5. 链式应用 atempo 滤镜
     for name, factor in filters:
         audio_in = audio_in.filter(name, factor)
     
     # 6. 准备输出选项
-    output_options = {
-        'vcodec': video_codec,
-        'acodec': audio_codec,
-        'shortest': None  # 以最短流结束
-    }
+    if profile:
+        output_profile = get_output_profile(profile)
+        output_options = output_profile['options']
+        if output_profile['max_height']:
+            video_stream = video_stream.filter('scale', -2, f"min(ih,{output_profile['max_height']})")
+    else:
+        output_options = {
+            'vcodec': video_codec,
+            'acodec': audio_codec,
+            **faststart_options(output_path)
+        }
+    if max_tempo_deviation is None:
+        output_options['shortest'] = None  # 以最短流结束
+    else:
+        # 规划模式下按规划的时长输出：视频已延长到旁白的长度，或旁白补静音到视频的长度
+        if not plan['extend']:
+            audio_in = audio_in.filter('apad')
+        output_options['t'] = plan['output_duration']
     
     # 添加可选的音频比特率
     if audio_bitrate:
@@ -105,10 +512,144 @@ def sync_audio_to_video(
     # 7. 合并并输出
     (
         ffmpeg
-        .output(video_in.video, audio_in, output_path, **output_options)
+        .output(video_stream, audio_in, output_path, **output_options)
+        .run(overwrite_output=True)
+    )
+    return plan
+
+@timed_stage('ffmpeg_encode', 'ffmpeg')
+def encode_rendition(
+    input_path: str,
+    output_path: str,
+    height: int,
+    profile: str = 'final'
+) -> None:
+    """
+    按指定高度重新编码一个较低分辨率的版本，音频直接复制。
+    
+    参数:
+        input_path: 输入视频文件路径
+        output_path: 输出视频文件路径
+        height: 输出高度（宽度按比例缩放），不会放大原视频
+        profile: 使用的输出配置名称
+        
+    返回:
+        None
+        
+    异常:
+        ffmpeg运行时可能引发的各种异常
+    """
+    options = get_output_profile(profile)['options']
+    options.pop('b:a', None)
+    options['acodec'] = 'copy'
+    source = ffmpeg.input(input_path)
+    video_stream = source.video.filter('scale', -2, f"min(ih,{height})")
+    (
+        ffmpeg
+        .output(video_stream, source.audio, output_path, **options)
         .run(overwrite_output=True)
     )
 
+# HLS 码率阶梯：(高度, 视频码率, 音频码率)
+HLS_RENDITIONS: List[Tuple[int, str, str]] = [
+    (720, '2500k', '128k'),
+    (480, '1000k', '96k'),
+]
+
+def parse_bitrate(bitrate: str) -> int:
+    """
+    将 '2500k'、'1M' 形式的码率转换为 bit/s。
+    """
+    units = {'k': 1000, 'm': 1000000}
+    suffix = bitrate[-1].lower()
+    if suffix in units:
+        return int(float(bitrate[:-1]) * units[suffix])
+    return int(bitrate)
+
+@timed_stage('ffmpeg_encode', 'ffmpeg')
+def package_hls(
+    input_path: str,
+    output_dir: str,
+    renditions: Optional[List[Tuple[int, str, str]]] = None,
+    segment_duration: int = 4
+) -> Dict[str, Any]:
+    """
+    将视频打包为多码率 HLS：每个码率一个子目录（index.m3u8 + .ts 分片），
+    并在 output_dir 下生成主播放列表 master.m3u8。
+    
+    高于原视频的码率档位会被跳过（至少保留一个档位，按原视频高度编码）；
+    所有档位按固定间隔强制插入关键帧，保证分片边界对齐，便于播放器切换码率。
+    
+    参数:
+        input_path: 输入视频文件路径（需要包含音频流）
+        output_dir: 输出目录
+        renditions: 码率阶梯，默认为 HLS_RENDITIONS
+        segment_duration: 分片时长（秒）
+        
+    返回:
+        包含 playlist（主播放列表路径）和 renditions 的字典
+        
+    异常:
+        ffmpeg运行时可能引发的各种异常
+    """
+    renditions = renditions or HLS_RENDITIONS
+    source = probe_video_stream(input_path)
+    source_width, source_height = int(source['width']), int(source['height'])
+
+    ladder = [r for r in renditions if r[0] <= source_height]
+    if not ladder:
+        _, video_bitrate, audio_bitrate = min(renditions, key=lambda r: r[0])
+        ladder = [(source_height, video_bitrate, audio_bitrate)]
+
+    os.makedirs(output_dir, exist_ok=True)
+    packaged = []
+    for height, video_bitrate, audio_bitrate in ladder:
+        name = f"{height}p"
+        rendition_dir = os.path.join(output_dir, name)
+        os.makedirs(rendition_dir, exist_ok=True)
+        # 与 scale=-2 一致：按比例计算宽度并取偶数
+        width = int(round(source_width * height / source_height / 2)) * 2
+
+        stream = ffmpeg.input(input_path)
+        video_stream = stream.video.filter('scale', -2, height)
+        (
+            ffmpeg
+            .output(
+                video_stream, stream.audio, os.path.join(rendition_dir, 'index.m3u8'),
+                vcodec='libx264', preset='veryfast', pix_fmt='yuv420p',
+                **{'b:v': video_bitrate, 'maxrate': video_bitrate,
+                   'bufsize': f"{parse_bitrate(video_bitrate) * 2}",
+                   'force_key_frames': f"expr:gte(t,n_forced*{segment_duration})",
+                   'sc_threshold': 0,
+                   'acodec': 'aac', 'b:a': audio_bitrate, 'ac': 2},
+                f='hls',
+                hls_time=segment_duration,
+                hls_playlist_type='vod',
+                hls_segment_filename=os.path.join(rendition_dir, 'seg_%03d.ts')
+            )
+            .run(overwrite_output=True)
+        )
+        packaged.append({
+            'name': name,
+            'width': width,
+            'height': height,
+            'bandwidth': parse_bitrate(video_bitrate) + parse_bitrate(audio_bitrate),
+            'playlist': f"{name}/index.m3u8"
+        })
+
+    # 主播放列表，码率从高到低
+    master_path = os.path.join(output_dir, 'master.m3u8')
+    with open(master_path, 'w') as f:
+        f.write('#EXTM3U\n#EXT-X-VERSION:3\n')
+        for rendition in packaged:
+            f.write(
+                f"#EXT-X-STREAM-INF:BANDWIDTH={rendition['bandwidth']},"
+                f"RESOLUTION={rendition['width']}x{rendition['height']}\n"
+                f"{rendition['playlist']}\n"
+            )
+
+    return {'playlist': master_path, 'renditions': packaged}
+
 def main():
     """测试函数"""
     import argparse
@@ -120,6 +661,7 @@ def main():
     parser.add_argument("--vcodec", default="copy", help="视频编码器")
     parser.add_argument("--acodec", default="aac", help="音频编码器")
     parser.add_argument("--abitrate", help="音频比特率，例如'192k'")
+    parser.add_argument("--profile", choices=sorted(OUTPUT_PROFILES), help="命名的输出配置")
     
     args = parser.parse_args()
     
@@ -134,7 +676,8 @@ def main():
         args.output,
         video_codec=args.vcodec,
         audio_codec=args.acodec,
-        audio_bitrate=args.abitrate
+        audio_bitrate=args.abitrate,
+        profile=args.profile
     )
     
     print(f"处理完成! 输出文件: {args.output}")
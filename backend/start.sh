@@ -15,6 +15,11 @@ mkdir -p uploads videos
 # Check if we have the required packages
 python3 -m pip install -r requirements-backend.txt
 
-# Start Flask app
-echo "Starting Flask API server..."
-nohup python3 app.py > log.txt 2>&1 &
+# Start the background job worker (used when JOB_BACKEND=redis)
+echo "Starting job worker..."
+nohup python3 worker.py > worker.log 2>&1 &
+
+# Start the API server with gunicorn (deploy new code with USR2 + WINCH + QUIT, see gunicorn.conf.py)
+echo "Starting API server..."
+# SERVER_INTERFACE=asgi switches to the async generation endpoints (asgi.py)
+nohup gunicorn -c gunicorn.conf.py > log.txt 2>&1 &
@@ -16,7 +16,7 @@ mkdir -p $UPLOAD_FOLDER
 mkdir -p $OUTPUT_FOLDER
 
 # 安装必要的依赖
-pip install flask ffmpeg-python --break-system-packages
+pip install flask ffmpeg-python gunicorn --break-system-packages
 
 # 检查ffmpeg是否安装
 if ! command -v ffmpeg &> /dev/null; then
@@ -29,10 +29,10 @@ fi
 
 echo "启动视频音频处理服务..."
 # 在后台运行服务
-nohup python video_audio_api.py > video_audio_service.log 2>&1 &
+nohup gunicorn -w 2 -b 0.0.0.0:$PORT --timeout 600 --pid video_audio_service.pid video_audio_api:app > video_audio_service.log 2>&1 &
 
-# 保存PID用于停止服务
-echo $! > video_audio_service.pid
+# 等待 gunicorn 写入PID文件
+sleep 1
 
 echo "服务已启动，PID: $(cat video_audio_service.pid)"
 echo "日志文件: video_audio_service.log" 
\ No newline at end of file
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Tracing of the generation pipeline with OpenTelemetry-compatible spans
+
+One "make me a video" flow crosses several requests, background jobs and minutes
+of provider calls. Each HTTP request starts a trace (or continues the one in its
+W3C `traceparent` header) and returns its id in `X-Trace-Id`; pipeline stages
+(see metrics.time_stage), Redis commands and ffmpeg runs become child spans, and
+jobs carry the traceparent of the request that queued them.
+
+    with span("compose_clips", attributes={"clips": 4}):
+        ...
+
+Finished spans are appended to TRACE_FILE as JSON lines shaped like OTLP/JSON
+spans (traceId, spanId, parentSpanId, name, kind, startTimeUnixNano,
+endTimeUnixNano, attributes, status), one line per span and one write() per
+line, so every process can share the file. Summarize it with
+
+    python tracing.py [TRACE_FILE]
+
+Settings:
+    TRACING_ENABLED:   true to record spans (default false)
+    TRACE_FILE:        Span file (default traces/spans.jsonl next to this module)
+    TRACE_SAMPLE_RATE: Fraction of new traces that are recorded (default 1.0)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import redis
+from redis.client import Pipeline
+from dotenv import load_dotenv
+
+from log_utils import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3, 'producer': 4, 'consumer': 5}
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class SpanContext:
+    """Identity of a span, e.g. a remote parent parsed from a traceparent header"""
+
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled=True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+class Span(SpanContext):
+    __slots__ = ('parent_id', 'name', 'kind', 'start_ns', 'attributes', 'error')
+
+    def __init__(self, name, parent=None, kind='internal', attributes=None, sampled=True):
+        if parent is not None:
+            super().__init__(parent.trace_id, new_id(8), parent.sampled)
+            self.parent_id = parent.span_id
+        else:
+            super().__init__(new_id(16), new_id(8), sampled)
+            self.parent_id = None
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.error = message
+
+    def to_dict(self, end_ns):
+        record = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS.get(self.kind, 1),
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(end_ns),
+            'attributes': [
+                {'key': key, 'value': attribute_value(value)} for key, value in self.attributes.items()
+            ],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+            'resource': {'service.name': TRACE_SERVICE_NAME, 'process.pid': os.getpid()},
+        }
+        if self.parent_id:
+            record['parentSpanId'] = self.parent_id
+        return record
+
+def new_id(size):
+    return os.urandom(size).hex()
+
+def attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def parse_traceparent(header):
+    """SpanContext of a W3C traceparent header, None if it is missing or malformed"""
+    if not header:
+        return None
+    parts = header.strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = bool(int(parts[3][:2], 16) & 1)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return SpanContext(parts[1], parts[2], sampled)
+
+class FileSpanExporter:
+    """Appends spans as JSON lines; the file is opened once per process"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def export(self, record):
+        line = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        with self.lock:
+            if self.pid != os.getpid():
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self.pid = os.getpid()
+            # O_APPEND + a single write keeps lines from different processes whole
+            os.write(self.fd, line)
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+TRACE_FILE = os.getenv('TRACE_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traces', 'spans.jsonl')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'image-to-video-backend')
+
+exporter = FileSpanExporter(TRACE_FILE)
+
+def configure(enabled=None, path=None, sample_rate=None):
+    """Override the environment settings"""
+    global TRACING_ENABLED, TRACE_SAMPLE_RATE, exporter
+    if enabled is not None:
+        TRACING_ENABLED = enabled
+    if sample_rate is not None:
+        TRACE_SAMPLE_RATE = sample_rate
+    if path is not None and path != exporter.path:
+        exporter = FileSpanExporter(path)
+
+def current_span():
+    return _current_span.get()
+
+def current_traceparent():
+    """traceparent of the current span, None outside a trace"""
+    span_ = _current_span.get()
+    return span_.traceparent if span_ is not None else None
+
+def start_span(name, kind='internal', attributes=None, parent=None):
+    """
+    Start a span and make it current; finish it with end_span
+
+    Args:
+        parent: Parent span context, default the current span (a new trace without one)
+
+    Returns:
+        (span, token), (None, None) when tracing is disabled
+    """
+    if not TRACING_ENABLED:
+        return None, None
+    if parent is None:
+        parent = _current_span.get()
+    span_ = Span(name, parent, kind, attributes, sampled=random.random() < TRACE_SAMPLE_RATE)
+    return span_, _current_span.set(span_)
+
+def end_span(span_, token, error=None):
+    if span_ is None:
+        return
+    _current_span.reset(token)
+    if error is not None and span_.error is None:
+        span_.set_error(f"{type(error).__name__}: {error}")
+    if span_.sampled:
+        try:
+            exporter.export(span_.to_dict(time.time_ns()))
+        except OSError as e:
+            logger.warning("Failed to export span %s: %s", span_.name, e)
+
+@contextmanager
+def span(name, kind='internal', attributes=None, parent=None):
+    """Run a block in a span (yields None when tracing is disabled)"""
+    span_, token = start_span(name, kind, attributes, parent)
+    try:
+        yield span_
+    except BaseException as e:
+        end_span(span_, token, e)
+        raise
+    else:
+        end_span(span_, token)
+
+def bind(func):
+    """
+    Wrap a function to run in the caller's current span from any thread
+
+    Threads don't inherit context variables, so work handed to an executor is bound
+    before it is submitted.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return func
+
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run
+
+class TracedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        if _current_span.get() is None:
+            return super().execute(raise_on_error)
+        attributes = {'db.system': 'redis', 'db.redis.commands': len(self.command_stack)}
+        with span('redis pipeline', 'client', attributes):
+            return super().execute(raise_on_error)
+
+class TracedRedis(redis.Redis):
+    """Redis client recording a span per command (and per pipeline) inside a trace"""
+
+    def execute_command(self, *args, **options):
+        if _current_span.get() is None:
+            return super().execute_command(*args, **options)
+        with span(f"redis {args[0]}", 'client', {'db.system': 'redis', 'db.operation': args[0]}):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+def summarize(path):
+    """Duration percentiles per span name, slowest p95 first"""
+    durations = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            seconds = (int(record['endTimeUnixNano']) - int(record['startTimeUnixNano'])) / 1e9
+            durations.setdefault(record['name'], []).append(seconds)
+
+    def percentile(values, fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append((percentile(values, 0.95), name, len(values), percentile(values, 0.5), values[-1]))
+    rows.sort(reverse=True)
+    print(f"{'span':<48} {'count':>7} {'p50 s':>9} {'p95 s':>9} {'max s':>9}")
+    for p95, name, count, p50, longest in rows:
+        print(f"{name[:48]:<48} {count:>7} {p50:>9.3f} {p95:>9.3f} {longest:>9.3f}")
+
+if __name__ == '__main__':
+    summarize(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE)
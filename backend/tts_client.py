@@ -1,17 +1,23 @@
 import os
+import asyncio
 import requests
+import httpx
 import json
 import time
 import shutil
 from dotenv import load_dotenv
 import glob
-from dotenv import load_dotenv
 from elevenlabs.client import ElevenLabs
 from elevenlabs import play
 
+from log_utils import get_logger, redact
+from metrics import time_stage
+
 # 加载环境变量
 load_dotenv()
 
+logger = get_logger(__name__)
+
 class TTSClient:
     """Base Text-to-Speech client"""
     
@@ -19,7 +25,7 @@ class TTSClient:
         """Initialize the TTS client"""
         self.api_key = os.getenv('TTS_API_KEY', '')
         if not self.api_key:
-            print("Warning: TTS_API_KEY environment variable not set")
+            logger.warning("TTS_API_KEY environment variable not set")
         
         # 创建语音输出目录
         self.speech_folder = os.getenv('SPEECH_FOLDER', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'speeches'))
@@ -39,6 +45,39 @@ class TTSClient:
             Path to the generated speech file
         """
         raise NotImplementedError("Subclasses must implement generate_speech method")
+    
+    async def agenerate_speech(self, text, project_id, language="zh-CN"):
+        """
+        Async version of generate_speech, used by the ASGI server
+        
+        Providers without a native async implementation run the blocking call in a thread.
+        """
+        return await asyncio.to_thread(self.generate_speech, text, project_id, language)
+    
+    def prepare_output(self, project_id):
+        """
+        Remove old speeches and pick the output file for a new one
+        
+        Returns:
+            (output_filename, output_path)
+        """
+        # 首先清理旧的语音文件
+        self.clean_old_speeches(project_id)
+        
+        # 创建项目特定的语音目录
+        project_speech_folder = os.path.join(self.speech_folder, project_id)
+        os.makedirs(project_speech_folder, exist_ok=True)
+        
+        # 创建输出文件路径
+        timestamp = int(time.time())
+        output_filename = f"speech_{timestamp}.mp3"
+        return output_filename, os.path.join(project_speech_folder, output_filename)
+    
+    async def apost(self, url, headers, data):
+        """POST with a shared async HTTP client (created on first use)"""
+        if getattr(self, 'async_http', None) is None:
+            self.async_http = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0))
+        return await self.async_http.post(url, headers=headers, json=data)
         
     def clean_old_speeches(self, project_id):
         """
@@ -55,9 +94,9 @@ class TTSClient:
             for file in glob.glob(os.path.join(project_speech_folder, "*.mp3")):
                 try:
                     os.remove(file)
-                    print(f"Removed old speech file: {file}")
+                    logger.info("Removed old speech file: %s", file)
                 except Exception as e:
-                    print(f"Error removing file {file}: {str(e)}")
+                    logger.error("Error removing file %s: %s", file, e)
 
 class ElevenLabsClient(TTSClient):
     """Eleven Labs TTS Client"""
@@ -91,66 +130,92 @@ class ElevenLabsClient(TTSClient):
             Path to the generated speech file
         """
         try:
-            # 首先清理旧的语音文件
-            self.clean_old_speeches(project_id)
-            
-            # 根据语言选择适当的声音ID
-            voice_id = self.default_voice_id
-            
-            # 创建项目特定的语音目录
-            project_speech_folder = os.path.join(self.speech_folder, project_id)
-            os.makedirs(project_speech_folder, exist_ok=True)
+            output_filename, output_path = self.prepare_output(project_id)
+            url, headers, data = self.build_request(text, language)
             
-            # 创建输出文件路径
-            timestamp = int(time.time())
-            output_filename = f"speech_{timestamp}.mp3"
-            output_path = os.path.join(project_speech_folder, output_filename)
+            logger.info("Generating speech for project %s using Eleven Labs API", project_id)
+            logger.debug("Text: %s", redact(text, 100))
             
-            # 构建API请求URL
-            url = f"{self.api_endpoint}/{voice_id}?output_format=mp3_44100_128"
-            
-            # 构建请求头和数据
-            headers = {
-                "xi-api-key": self.api_key,
-                "Content-Type": "application/json"
+            # 发送请求并保存结果
+            with time_stage('tts_synthesis', 'elevenlabs') as stage:
+                response = requests.post(url, headers=headers, json=data)
+                stage.outcome = 'ok' if response.status_code == 200 else 'error'
+            return self.handle_response(response, project_id, output_filename, output_path)
+                
+        except Exception as e:
+            error_msg = f"Exception generating speech: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "error": error_msg
             }
+    
+    async def agenerate_speech(self, text, project_id, language="zh-CN"):
+        """
+        Generate speech using Eleven Labs API with the async HTTP client
+        """
+        try:
+            # Removing old speeches and writing the file are blocking
+            output_filename, output_path = await asyncio.to_thread(self.prepare_output, project_id)
+            url, headers, data = self.build_request(text, language)
             
-            data = {
-                "text": text,
-                "model_id": self.default_model_id
+            logger.info("Generating speech for project %s using Eleven Labs API (async)", project_id)
+            with time_stage('tts_synthesis', 'elevenlabs') as stage:
+                response = await self.apost(url, headers, data)
+                stage.outcome = 'ok' if response.status_code == 200 else 'error'
+            return await asyncio.to_thread(self.handle_response, response, project_id, output_filename, output_path)
+        except Exception as e:
+            error_msg = f"Exception generating speech: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "error": error_msg
             }
+    
+    def build_request(self, text, language="zh-CN"):
+        """
+        Build the Eleven Labs request
+        
+        Returns:
+            (url, headers, data)
+        """
+        # 根据语言选择适当的声音ID
+        voice_id = self.default_voice_id
+        
+        # 构建API请求URL
+        url = f"{self.api_endpoint}/{voice_id}?output_format=mp3_44100_128"
+        
+        # 构建请求头和数据
+        headers = {
+            "xi-api-key": self.api_key,
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "text": text,
+            "model_id": self.default_model_id
+        }
+        return url, headers, data
+    
+    def handle_response(self, response, project_id, output_filename, output_path):
+        """Save the audio of a successful response (requests or httpx)"""
+        if response.status_code == 200:
+            # 保存音频文件
+            with open(output_path, 'wb') as f:
+                f.write(response.content)
             
-            print(f"Generating speech for project {project_id} using Eleven Labs API")
-            print(f"Text: {text[:100]}{'...' if len(text) > 100 else ''}")
-            
-            # 发送请求并保存结果
-            response = requests.post(url, headers=headers, json=data)
+            logger.info("Speech generated successfully: %s", output_path)
             
-            if response.status_code == 200:
-                # 保存音频文件
-                with open(output_path, 'wb') as f:
-                    f.write(response.content)
-                
-                print(f"Speech generated successfully: {output_path}")
-                
-                # 返回相对于speeches目录的路径，用于API响应
-                relative_path = f"/speeches/{project_id}/{output_filename}"
-                return {
-                    "status": "success",
-                    "path": relative_path,
-                    "full_path": output_path
-                }
-            else:
-                error_msg = f"Error generating speech: {response.status_code} - {response.text}"
-                print(error_msg)
-                return {
-                    "status": "error",
-                    "error": error_msg
-                }
-                
-        except Exception as e:
-            error_msg = f"Exception generating speech: {str(e)}"
-            print(error_msg)
+            # 返回相对于speeches目录的路径，用于API响应
+            relative_path = f"/speeches/{project_id}/{output_filename}"
+            return {
+                "status": "success",
+                "path": relative_path,
+                "full_path": output_path
+            }
+        else:
+            error_msg = f"Error generating speech: {response.status_code} - {response.text[:500]}"
+            logger.error(error_msg)
             return {
                 "status": "error",
                 "error": error_msg
@@ -163,12 +228,12 @@ class OpenAITTSClient(TTSClient):
         """Initialize the OpenAI TTS client"""
         super().__init__()
         self.api_key = os.getenv('OPENAI_API_KEY', self.api_key)
-        self.api_endpoint = "https://api.openai.com/v1/audio/speech"
+        self.api_endpoint = f"{(os.getenv('OPENAI_BASE_URL') or 'https://api.openai.com/v1').rstrip('/')}/audio/speech"
         self.model = os.getenv('OPENAI_TTS_MODEL', 'gpt-4o-mini-tts')
         self.voice = os.getenv('OPENAI_TTS_VOICE', 'sage')  # alloy, echo, fable, onyx, nova, shimmer
         
         if not self.api_key:
-            print("Warning: OPENAI_API_KEY environment variable not set")
+            logger.warning("OPENAI_API_KEY environment variable not set")
     
     def generate_speech(self, text, project_id, language="zh-CN"):
         """
@@ -183,75 +248,102 @@ class OpenAITTSClient(TTSClient):
             Path to the generated speech file
         """
         try:
-            # 首先清理旧的语音文件
-            self.clean_old_speeches(project_id)
-            
-            # 创建项目特定的语音目录
-            project_speech_folder = os.path.join(self.speech_folder, project_id)
-            os.makedirs(project_speech_folder, exist_ok=True)
+            output_filename, output_path = self.prepare_output(project_id)
+            headers, data = self.build_request(text)
             
-            # 创建输出文件路径
-            timestamp = int(time.time())
-            output_filename = f"speech_{timestamp}.mp3"
-            output_path = os.path.join(project_speech_folder, output_filename)
-            
-            # 构建请求头和数据
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.model,
-                "input": text,
-                "voice": self.voice
-            }
-            
-            print(f"Generating speech for project {project_id} using OpenAI TTS API")
-            print(f"Text: {text[:100]}{'...' if len(text) > 100 else ''}")
+            logger.info("Generating speech for project %s using OpenAI TTS API", project_id)
+            logger.debug("Text: %s", redact(text, 100))
             
             # 发送请求并保存结果
-            response = requests.post(self.api_endpoint, headers=headers, json=data)
-            response.raise_for_status()
-            
-            # 保存音频文件
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
-            
-            # 返回相对路径（用于API响应）
-            relative_path = f"/speeches/{project_id}/{output_filename}"
+            with time_stage('tts_synthesis', 'openai'):
+                response = requests.post(self.api_endpoint, headers=headers, json=data)
+                response.raise_for_status()
+            return self.save_response(response, project_id, output_filename, output_path)
             
+        except Exception as e:
+            logger.error("Error generating speech with OpenAI TTS: %s", e)
             return {
-                "status": "success",
-                "path": relative_path,
-                "duration": None  # OpenAI API doesn't provide duration info
+                "status": "error",
+                "error": str(e)
             }
+    
+    async def agenerate_speech(self, text, project_id, language="zh-CN"):
+        """
+        Generate speech using OpenAI TTS API with the async HTTP client
+        """
+        try:
+            # Removing old speeches and writing the file are blocking
+            output_filename, output_path = await asyncio.to_thread(self.prepare_output, project_id)
+            headers, data = self.build_request(text)
             
+            logger.info("Generating speech for project %s using OpenAI TTS API (async)", project_id)
+            with time_stage('tts_synthesis', 'openai'):
+                response = await self.apost(self.api_endpoint, headers, data)
+                response.raise_for_status()
+            return await asyncio.to_thread(self.save_response, response, project_id, output_filename, output_path)
         except Exception as e:
-            print(f"Error generating speech with OpenAI TTS: {str(e)}")
+            logger.error("Error generating speech with OpenAI TTS: %s", e)
             return {
                 "status": "error",
                 "error": str(e)
             }
+    
+    def build_request(self, text):
+        """
+        Build the OpenAI TTS request
+        
+        Returns:
+            (headers, data)
+        """
+        # 构建请求头和数据
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "model": self.model,
+            "input": text,
+            "voice": self.voice
+        }
+        return headers, data
+    
+    def save_response(self, response, project_id, output_filename, output_path):
+        """Save the audio of a successful response (requests or httpx)"""
+        # 保存音频文件
+        with open(output_path, 'wb') as f:
+            f.write(response.content)
+        
+        # 返回相对路径（用于API响应）
+        relative_path = f"/speeches/{project_id}/{output_filename}"
+        
+        return {
+            "status": "success",
+            "path": relative_path,
+            "duration": None  # OpenAI API doesn't provide duration info
+        }
 
-def get_tts_client():
+def get_tts_client(provider=None):
     """
     Factory function to get the appropriate TTS client
     based on environment configuration
     
+    Args:
+        provider: Optional provider name, overrides TTS_PROVIDER
+    
     Returns:
         TTS client instance
     """
     # 获取TTS提供商配置
-    provider = os.getenv('TTS_PROVIDER', 'elevenlabs').lower()
+    provider = (provider or os.getenv('TTS_PROVIDER', 'elevenlabs')).lower()
     
     if provider == 'openai':
-        print("Using OpenAI TTS client")
+        logger.info("Using OpenAI TTS client")
         return OpenAITTSClient()
     elif provider == 'elevenlabs':
-        print("Using Eleven Labs TTS client")
+        logger.info("Using Eleven Labs TTS client")
         return ElevenLabsClient()
     else:
         # Default to Eleven Labs if provider not recognized
-        print(f"Warning: Unrecognized TTS provider '{provider}', using Eleven Labs")
+        logger.warning("Unrecognized TTS provider '%s', using Eleven Labs", provider)
         return ElevenLabsClient() 
\ No newline at end of file
@@ -150,6 +150,6 @@ def health_check():
     return jsonify({"status": "healthy"})
 
 if __name__ == '__main__':
-    # 在开发环境中运行
+    # 在开发环境中运行；生产环境使用 gunicorn video_audio_api:app
     port = int(os.environ.get('PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('DEBUG', 'false').lower() == 'true')
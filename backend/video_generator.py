@@ -1,5 +1,7 @@
 import os
+import asyncio
 import requests
+import httpx
 import time
 import json
 import uuid
@@ -9,10 +11,17 @@ import base64
 import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
+from python_ffmpeg import remux_faststart
+from blob_store import load_image, image_value_to_data_url
+from kling_image import get_kling_image_target, load_kling_image
+from log_utils import get_logger, redact, mask_secret
+from metrics import time_stage, count_bytes
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
 class VideoGenerator:
     """Base class for video generation API clients"""
     
@@ -20,7 +29,7 @@ class VideoGenerator:
         """Initialize the video generator"""
         self.redis_client = redis_client
     
-    def generate_video(self, image_path, script, output_dir=None, image_data=None):
+    def generate_video(self, image_path, script, output_dir=None, image_data=None, duration=None):
         """
         Generate a sales video from image and script
         
@@ -29,11 +38,32 @@ class VideoGenerator:
             script: Marketing script to use for the video
             output_dir: Directory to save the video (if applicable)
             image_data: Base64 encoded image data (if provided directly)
+            duration: Clip duration in seconds (defaults to the provider setting)
             
         Returns:
             Dict with video generation result
         """
         raise NotImplementedError("Subclasses must implement generate_video method")
+    
+    async def agenerate_video(self, image_path, script, output_dir=None, image_data=None, duration=None):
+        """
+        Async version of generate_video, used by the ASGI server
+        
+        Providers without a native async implementation run the blocking call in a thread.
+        """
+        return await asyncio.to_thread(
+            self.generate_video, image_path, script,
+            output_dir=output_dir, image_data=image_data, duration=duration
+        )
+    
+    def prepare_image(self, image_value):
+        """
+        Image data to pass as image_data for a Redis image value
+        
+        Returns:
+            Data URL of the stored image
+        """
+        return image_value_to_data_url(image_value)
         
     def _get_image_from_redis(self, image_path):
         """
@@ -68,30 +98,14 @@ class VideoGenerator:
         else:
             raise ValueError(f"Invalid image path format: {image_path}")
         
-        # Get image from Redis
+        # Get image from Redis (or the blob store it points at)
         image_key = f"image:{project_id}:{filename}"
-        data_url = self.redis_client.get(image_key)
+        image = load_image(self.redis_client, image_key)
         
-        if not data_url:
+        if not image:
             raise ValueError(f"Image not found in Redis: {image_key}")
-            
-        # Handle data URL format if present
-        if data_url.startswith('data:'):
-            # Extract the MIME type and base64 data
-            parts = data_url.split(',', 1)
-            if len(parts) < 2:
-                raise ValueError(f"Invalid data URL format: {data_url[:20]}...")
-            
-            base64_data = parts[1]
-        else:
-            # Assume it's just base64 data
-            base64_data = data_url
-            
-        # Return decoded image data
-        try:
-            return base64.b64decode(base64_data)
-        except Exception as e:
-            raise ValueError(f"Failed to decode base64 data: {str(e)}")
+        
+        return image[1]
 
 class KlingGenerator(VideoGenerator):
     """Kling AI Video Generator Client"""
@@ -99,7 +113,7 @@ class KlingGenerator(VideoGenerator):
     def __init__(self, redis_client=None):
         """Initialize the Kling video generator"""
 
-        print(f"Initializing KlingGenerator with access key: {os.getenv('KLING_ACCESS_KEY')}")
+        logger.info("Initializing KlingGenerator with access key: %s", mask_secret(os.getenv('KLING_ACCESS_KEY')))
         super().__init__(redis_client)
         self.access_key = os.getenv('KLING_ACCESS_KEY', '')
         self.secret_key = os.getenv('KLING_SECRET_KEY', '')
@@ -108,9 +122,16 @@ class KlingGenerator(VideoGenerator):
         self.max_duration = os.getenv('KLING_MAX_DURATION', '10')  # Default 5 seconds
         self.mode = os.getenv('KLING_MODE', 'std')  # Default to professional mode
         self.cfg_scale = float(os.getenv('KLING_CFG_SCALE', '0.5'))  # Default cfg scale value
+        # 提交前把图片缩小到Kling输出分辨率并重新编码为JPEG
+        self.image_target = get_kling_image_target(self.mode, os.getenv('KLING_IMAGE_SIZE'))
+        self.image_quality = int(os.getenv('KLING_IMAGE_QUALITY', 90))
+        self.image_cache_ttl = int(os.getenv('KLING_IMAGE_CACHE_TTL', 86400))
+        self.max_poll_attempts = 100  # 尝试次数限制
+        self.poll_interval = float(os.getenv('KLING_POLL_INTERVAL', 5))  # 轮询间隔(秒)
+        self.async_http = None
         
         if not self.access_key or not self.secret_key:
-            print("Warning: KLING API credentials not set properly")
+            logger.warning("KLING API credentials not set properly")
     
     def _generate_jwt_token(self):
         """
@@ -121,8 +142,7 @@ class KlingGenerator(VideoGenerator):
         """
         # 手动实现JWT令牌生成
         try:
-            print(f"Generating JWT token for Kling API with access key: {self.access_key}"
-                  f"and secret key: {self.secret_key}")
+            logger.debug("Generating JWT token for Kling API with access key: %s", mask_secret(self.access_key))
             # 创建header部分
             header = {
                 "alg": "HS256",
@@ -161,7 +181,7 @@ class KlingGenerator(VideoGenerator):
             token = f"{message}.{signature_b64}"
             return token
         except Exception as e:
-            print(f"Error generating JWT token: {str(e)}")
+            logger.error("Error generating JWT token: %s", e)
             raise
     
     def _extract_image_from_redis_new_format(self, image_path):
@@ -188,22 +208,13 @@ class KlingGenerator(VideoGenerator):
                     project_id = img_parts[0]
                     img_id = img_parts[1]
                     image_key = f"image:{project_id}-image-{img_id}"
-                    data_url = self.redis_client.get(image_key)
+                    image = load_image(self.redis_client, image_key)
                     
-                    if not data_url:
+                    if not image:
                         raise ValueError(f"Image not found in Redis: {image_key}")
                     
-                    # 处理data URL格式
-                    if data_url.startswith('data:'):
-                        # Extract the base64 data without the prefix
-                        parts = data_url.split(',', 1)
-                        if len(parts) < 2:
-                            raise ValueError(f"Invalid data URL format: {data_url[:20]}...")
-                        
-                        return parts[1]  # Return only the base64 part without the prefix
-                    else:
-                        # Assume it's just base64 data
-                        return data_url
+                    # Return only the base64 data without the data URL prefix
+                    return base64.b64encode(image[1]).decode('utf-8')
         
         raise ValueError(f"Invalid image path format: {image_path}")
     
@@ -228,7 +239,7 @@ class KlingGenerator(VideoGenerator):
                 base64_data = self._extract_image_from_redis_new_format(image_path)
                 return base64_data
             except Exception as e:
-                print(f"Failed to get image from Redis: {str(e)}")
+                logger.error("Failed to get image from Redis: %s", e)
                 raise
         
         # If it's a local file path, read and convert to base64
@@ -238,12 +249,187 @@ class KlingGenerator(VideoGenerator):
                     file_data = f.read()
                     return base64.b64encode(file_data).decode('utf-8')
             except Exception as e:
-                print(f"Failed to read local file: {str(e)}")
+                logger.error("Failed to read local file: %s", e)
                 raise
                 
         raise ValueError(f"Unsupported image path format: {image_path}")
     
-    def generate_video(self, image_path, script, output_dir=None, image_data=None, static_mask=None, dynamic_masks=None):
+    def _auth_headers(self):
+        """Request headers with a fresh JWT token"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self._generate_jwt_token()}"
+        }
+    
+    def prepare_image(self, image_value):
+        """
+        Image sized for Kling's output resolution (cached per image and target)
+        
+        Returns:
+            Base64 encoded JPEG without a data URL prefix
+        """
+        return load_kling_image(self.redis_client, image_value, self.image_target,
+                                self.image_quality, self.image_cache_ttl)
+    
+    def get_async_http(self):
+        """Shared async HTTP client for the ASGI server (created on first use)"""
+        if self.async_http is None:
+            self.async_http = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+        return self.async_http
+    
+    def build_request_data(self, image_path, script, image_data=None, static_mask=None, dynamic_masks=None, duration=None):
+        """
+        Build the image2video request body
+        
+        Returns:
+            Request data dict
+        """
+        logger.debug("Prompt: %s", redact(script))
+        logger.debug("Image path: %s", image_path)
+        # 准备请求数据
+        data = {
+            "model_name": self.model,
+            "mode": self.mode,
+            "duration": str(duration or self.max_duration),
+            "prompt": script,
+            "cfg_scale": self.cfg_scale
+        }
+        
+        # 处理图片数据
+        if image_data:
+            # base64编码的字符串（prepare_image的结果），或data URL
+            # 去除data:image/jpeg;base64,前缀
+            data["image"] = image_data.split(',', 1)[1] if image_data.startswith('data:') else image_data
+        else:
+            # 通过路径获取图片数据
+            data["image"] = self._get_image_as_url_or_base64(image_path)
+        
+        # 处理可选的静态遮罩
+        if static_mask:
+            if static_mask.startswith('http://') or static_mask.startswith('https://'):
+                data["static_mask"] = static_mask
+            else:
+                # 读取本地文件或Redis中的数据
+                data["static_mask"] = self._get_image_as_url_or_base64(static_mask)
+        
+        # 处理可选的动态遮罩
+        if dynamic_masks and isinstance(dynamic_masks, list):
+            data["dynamic_masks"] = []
+            for mask_config in dynamic_masks:
+                if not isinstance(mask_config, dict):
+                    continue
+                    
+                mask_item = {}
+                
+                # 处理遮罩图片
+                if "mask_path" in mask_config:
+                    mask_path = mask_config["mask_path"]
+                    mask_item["mask"] = self._get_image_as_url_or_base64(mask_path)
+                
+                # 处理轨迹
+                if "trajectories" in mask_config and isinstance(mask_config["trajectories"], list):
+                    mask_item["trajectories"] = mask_config["trajectories"]
+                
+                if mask_item:
+                    data["dynamic_masks"].append(mask_item)
+        
+        logger.debug("Request data: %s", redact(data))
+        return data
+    
+    def encode_request_body(self, data):
+        """
+        Serialize the request data to JSON bytes
+        
+        The base64 image is most of the body and needs no escaping, so it is spliced
+        in instead of going through json.dumps (which would scan and copy it again).
+        """
+        image = data.get("image")
+        if not image or image.startswith(('http://', 'https://')):
+            return json.dumps(data).encode('utf-8')
+        fields = json.dumps({k: v for k, v in data.items() if k != "image"})
+        return b''.join((fields[:-1].encode('utf-8'), b', "image": "', image.encode('ascii'), b'"}'))
+    
+    def parse_submit_response(self, response):
+        """
+        Extract the task ID from an image2video response (requests or httpx)
+        
+        Returns:
+            Task ID
+        """
+        # 检查响应状态
+        if response.status_code != 200:
+            logger.error("API error: %s - %s", response.status_code, redact(response.text))
+            raise RuntimeError(f"Video generation request failed with status code {response.status_code}")
+        
+        result = response.json()
+        
+        # 检查API响应
+        if result.get('code') != 0:
+            error_message = result.get('message', 'Unknown error')
+            raise RuntimeError(f"Video generation request failed: {error_message}")
+        
+        task_id = result.get('data', {}).get('task_id')
+        
+        if not task_id:
+            raise ValueError("Failed to get video generation task ID")
+        
+        logger.info("Video generation task submitted, ID: %s", task_id)
+        return task_id
+    
+    def parse_task_status(self, result):
+        """
+        Interpret a task query result
+        
+        Returns:
+            Result dict once the task succeeded or failed, None while it is still running
+        """
+        task_status = result.get('data', {}).get('task_status')
+        task_result = result.get('data', {}).get('task_result', {})
+        
+        logger.debug("Task status: %s", task_status)
+        
+        if task_status == "failed":
+            # 任务失败
+            error_message = result.get('data', {}).get('task_status_msg', 'Unknown error')
+            logger.error("Task failed Reason: %s", redact(result))
+            return {
+                "status": "failed",
+                "error": error_message
+            }
+            
+        elif task_status == "succeed":
+            # 任务成功
+            videos = task_result.get('videos', [])
+            if not videos:
+                return {
+                    "status": "failed",
+                    "error": "No video in result"
+                }
+            
+            video_info = videos[0]
+            return {
+                "status": "completed",
+                "url": video_info.get('url'),
+                "duration": video_info.get('duration')
+            }
+        
+        # 任务仍在处理中
+        return None
+    
+    def finish_download(self, video_file, video_result):
+        """Remux a downloaded clip for faststart and record its local path"""
+        # 把moov原子移到文件开头（只重新封装），使视频可以边下载边播放
+        try:
+            remux_faststart(video_file)
+        except Exception as e:
+            logger.warning("Failed to remux %s for faststart: %s", video_file, e)
+        
+        # 添加本地文件路径到结果
+        video_result['local_path'] = video_file
+        # 添加相对路径，供前端使用
+        video_result['path'] = f"/api/videos/{os.path.basename(video_file)}"
+    
+    def generate_video(self, image_path, script, output_dir=None, image_data=None, static_mask=None, dynamic_masks=None, duration=None):
         """
         Generate a sales video using Kling AI
         
@@ -254,102 +440,27 @@ class KlingGenerator(VideoGenerator):
             image_data: Base64 encoded image data (if provided directly)
             static_mask: Path to static mask image (optional)
             dynamic_masks: List of dynamic mask configurations (optional)
+            duration: Clip duration in seconds, "5" or "10" (defaults to KLING_MAX_DURATION)
             
         Returns:
             Dict with status and video URL
         """
         try:
-            # 生成JWT令牌进行认证
-            jwt_token = self._generate_jwt_token()
-            
-            # 设置请求头部信息
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {jwt_token}"
-            }
-
-            print(f"JWT token: {jwt_token}")
-            print(f"Prompt: {script}")
-            print(f"Image path: {image_path}")
-            print(f"Image data: {image_data}")
-            # 准备请求数据
-            data = {
-                "model_name": self.model,
-                "mode": self.mode,
-                "duration": self.max_duration,
-                "prompt": script,
-                "cfg_scale": self.cfg_scale
-            }
-            
-            # 处理图片数据
-            if image_data:
-                # 假设已经是base64编码的字符串
-                # 去除data:image/jpeg;base64,前缀
-                data["image"] = image_data.split(',', 1)[1]
-            else:
-                # 通过路径获取图片数据
-                data["image"] = self._get_image_as_url_or_base64(image_path)
-            
-            # 处理可选的静态遮罩
-            if static_mask:
-                if static_mask.startswith('http://') or static_mask.startswith('https://'):
-                    data["static_mask"] = static_mask
-                else:
-                    # 读取本地文件或Redis中的数据
-                    data["static_mask"] = self._get_image_as_url_or_base64(static_mask)
-            
-            # 处理可选的动态遮罩
-            if dynamic_masks and isinstance(dynamic_masks, list):
-                data["dynamic_masks"] = []
-                for mask_config in dynamic_masks:
-                    if not isinstance(mask_config, dict):
-                        continue
-                        
-                    mask_item = {}
-                    
-                    # 处理遮罩图片
-                    if "mask_path" in mask_config:
-                        mask_path = mask_config["mask_path"]
-                        mask_item["mask"] = self._get_image_as_url_or_base64(mask_path)
-                    
-                    # 处理轨迹
-                    if "trajectories" in mask_config and isinstance(mask_config["trajectories"], list):
-                        mask_item["trajectories"] = mask_config["trajectories"]
-                    
-                    if mask_item:
-                        data["dynamic_masks"].append(mask_item)
-            
-
-            print(f"Request headers: {headers}")
-            print(f"Request data: {data}")
+            data = self.build_request_data(image_path, script, image_data, static_mask, dynamic_masks, duration)
 
             # 发送请求到Kling API
             url = f"{self.endpoint}/v1/videos/image2video"
-            print(f"Sending video generation request to Kling API: {url}")
-            print(f"Request data (excluding image content): {json.dumps({k: v for k, v in data.items() if k not in ['static_mask','image']}, indent=2)}")
-            response = requests.post(url, headers=headers, json=data)
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                print(f"API error: {response.status_code} - {response.text}")
-                raise RuntimeError(f"Video generation request failed with status code {response.status_code}")
-            
-            result = response.json()
-            
-            # 检查API响应
-            if result.get('code') != 0:
-                error_message = result.get('message', 'Unknown error')
-                raise RuntimeError(f"Video generation request failed: {error_message}")
-            
-            task_id = result.get('data', {}).get('task_id')
-            
-            if not task_id:
-                raise ValueError("Failed to get video generation task ID")
-            
-            print(f"Video generation task submitted, ID: {task_id}")
+            logger.info("Sending video generation request to Kling API: %s", url)
+            body = self.encode_request_body(data)
+            count_bytes('kling_submit', 'kling', len(body))
+            with time_stage('kling_submit', 'kling'):
+                response = requests.post(url, headers=self._auth_headers(), data=body)
+                task_id = self.parse_submit_response(response)
             
             # 等待任务完成
-            video_result = self._poll_task_status(task_id)
+            with time_stage('kling_queue_wait', 'kling') as stage:
+                video_result = self._poll_task_status(task_id)
+                stage.outcome = 'ok' if video_result.get('status') == 'completed' else 'error'
             
             # 如果需要保存视频到本地，下载它
             if output_dir and video_result.get('url'):
@@ -360,32 +471,82 @@ class KlingGenerator(VideoGenerator):
                 os.makedirs(output_dir, exist_ok=True)
                 
                 # 下载视频
-                print(f"Downloading video from {video_url}")
-                video_response = requests.get(video_url, stream=True)
-                video_response.raise_for_status()
-                
-                with open(video_file, 'wb') as f:
-                    for chunk in video_response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+                logger.info("Downloading video from %s", video_url)
+                with time_stage('download', 'kling'):
+                    video_response = requests.get(video_url, stream=True)
+                    video_response.raise_for_status()
+                    
+                    with open(video_file, 'wb') as f:
+                        for chunk in video_response.iter_content(chunk_size=8192):
+                            f.write(chunk)
+                count_bytes('download', 'kling', os.path.getsize(video_file))
                 
-                # 添加本地文件路径到结果
-                video_result['local_path'] = video_file
-                # 添加相对路径，供前端使用
-                relative_path = video_file.replace(os.path.dirname(output_dir), '')
-                if relative_path.startswith('/'):
-                    relative_path = relative_path[1:]
-                video_result['path'] = f"/api/videos/{os.path.basename(video_file)}"
+                self.finish_download(video_file, video_result)
             
             return video_result
         except Exception as e:
             error_message = str(e)
-            print(f"Error generating video with Kling: {error_message}")
+            logger.error("Error generating video with Kling: %s", error_message)
             # 返回错误状态
             return {
                 "status": "failed",
                 "error": error_message
             }
     
+    async def agenerate_video(self, image_path, script, output_dir=None, image_data=None, static_mask=None, dynamic_masks=None, duration=None):
+        """
+        Async version of generate_video: submits, polls and downloads with httpx,
+        so waiting on Kling doesn't hold a thread
+        
+        Returns:
+            Dict with status and video URL
+        """
+        try:
+            http = self.get_async_http()
+            data = self.build_request_data(image_path, script, image_data, static_mask, dynamic_masks, duration)
+            
+            url = f"{self.endpoint}/v1/videos/image2video"
+            logger.info("Sending video generation request to Kling API: %s", url)
+            body = self.encode_request_body(data)
+            count_bytes('kling_submit', 'kling', len(body))
+            with time_stage('kling_submit', 'kling'):
+                response = await http.post(url, headers=self._auth_headers(), content=body)
+                task_id = self.parse_submit_response(response)
+            
+            with time_stage('kling_queue_wait', 'kling') as stage:
+                video_result = await self._apoll_task_status(task_id)
+                stage.outcome = 'ok' if video_result.get('status') == 'completed' else 'error'
+            
+            if output_dir and video_result.get('url'):
+                video_file = os.path.join(output_dir, f"{uuid.uuid4()}.mp4")
+                await asyncio.to_thread(os.makedirs, output_dir, exist_ok=True)
+                
+                logger.info("Downloading video from %s", video_result['url'])
+                size = 0
+                with time_stage('download', 'kling'):
+                    async with http.stream('GET', video_result['url']) as video_response:
+                        video_response.raise_for_status()
+                        # Disk writes run in a thread, a slow disk doesn't stall the event loop
+                        f = await asyncio.to_thread(open, video_file, 'wb')
+                        try:
+                            async for chunk in video_response.aiter_bytes(chunk_size=1024 * 1024):
+                                await asyncio.to_thread(f.write, chunk)
+                                size += len(chunk)
+                        finally:
+                            await asyncio.to_thread(f.close)
+                count_bytes('download', 'kling', size)
+                
+                await asyncio.to_thread(self.finish_download, video_file, video_result)
+            
+            return video_result
+        except Exception as e:
+            error_message = str(e)
+            logger.error("Error generating video with Kling: %s", error_message)
+            return {
+                "status": "failed",
+                "error": error_message
+            }
+    
     def _poll_task_status(self, task_id):
         """
         Poll for task status until completion
@@ -396,22 +557,13 @@ class KlingGenerator(VideoGenerator):
         Returns:
             Dict with task result info
         """
-        max_attempts = 100  # 尝试次数限制
-        poll_interval = 5  # 轮询间隔(秒)
-        
-        # 生成JWT令牌进行认证
-        jwt_token = self._generate_jwt_token()
-        
         # 设置请求头部信息
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {jwt_token}"
-        }
+        headers = self._auth_headers()
         
         # 查询API端点
         url = f"{self.endpoint}/v1/videos/image2video/{task_id}"
         
-        for attempt in range(max_attempts):
+        for attempt in range(self.max_poll_attempts):
             try:
                 # 发送查询请求
                 response = requests.get(url, headers=headers)
@@ -422,66 +574,72 @@ class KlingGenerator(VideoGenerator):
                 # 检查API响应
                 if result.get('code') != 0:
                     error_message = result.get('message', 'Unknown error')
-                    print(f"Query task status failed: {error_message}")
+                    logger.error("Query task status failed: %s", error_message)
                     
                     # 如果是认证过期，重新生成JWT令牌
                     if "token" in error_message.lower() or "auth" in error_message.lower():
-                        jwt_token = self._generate_jwt_token()
-                        headers["Authorization"] = f"Bearer {jwt_token}"
+                        headers = self._auth_headers()
                     
                     # 继续下一次尝试
-                    time.sleep(poll_interval)
+                    time.sleep(self.poll_interval)
                     continue
                 
-                task_status = result.get('data', {}).get('task_status')
-                task_result = result.get('data', {}).get('task_result', {})
-                
-                print(f"Task status: {task_status}")
-                
-                if task_status == "failed":
-                    # 任务失败
-                    error_message = result.get('data', {}).get('task_status_msg', 'Unknown error')
-                    print(f"Task failed Reason: {result}")
-                    return {
-                        "status": "failed",
-                        "error": error_message
-                    }
-                    
-                elif task_status == "succeed":
-                    # 任务成功
-                    videos = task_result.get('videos', [])
-                    if not videos:
-                        return {
-                            "status": "failed",
-                            "error": "No video in result"
-                        }
-                    
-                    video_info = videos[0]
-                    return {
-                        "status": "completed",
-                        "url": video_info.get('url'),
-                        "duration": video_info.get('duration')
-                    }
+                video_result = self.parse_task_status(result)
+                if video_result is not None:
+                    return video_result
                     
                 # 任务仍在处理中，继续等待
-                time.sleep(poll_interval)
+                time.sleep(self.poll_interval)
                 
             except Exception as e:
-                print(f"Error polling task status: {str(e)}")
+                logger.error("Error polling task status: %s", e)
                 # 继续尝试
-                time.sleep(poll_interval)
+                time.sleep(self.poll_interval)
         
         # 达到最大尝试次数
         return {
             "status": "failed",
             "error": "Maximum polling attempts reached"
         }
+    
+    async def _apoll_task_status(self, task_id):
+        """
+        Async version of _poll_task_status
+        """
+        http = self.get_async_http()
+        headers = self._auth_headers()
+        url = f"{self.endpoint}/v1/videos/image2video/{task_id}"
+        
+        for attempt in range(self.max_poll_attempts):
+            try:
+                response = await http.get(url, headers=headers)
+                response.raise_for_status()
+                result = response.json()
+                
+                if result.get('code') != 0:
+                    error_message = result.get('message', 'Unknown error')
+                    logger.error("Query task status failed: %s", error_message)
+                    if "token" in error_message.lower() or "auth" in error_message.lower():
+                        headers = self._auth_headers()
+                else:
+                    video_result = self.parse_task_status(result)
+                    if video_result is not None:
+                        return video_result
+            except Exception as e:
+                logger.error("Error polling task status: %s", e)
+            
+            await asyncio.sleep(self.poll_interval)
+        
+        return {
+            "status": "failed",
+            "error": "Maximum polling attempts reached"
+        }
 
 # Mock implementation for testing without API credentials
 class MockVideoGenerator(VideoGenerator):
     """Mock video generator for testing without credentials"""
     
-    def generate_video(self, image_path, script, output_dir=None, image_data=None):
+    def generate_video(self, image_path, script, output_dir=None, image_data=None, duration=None):
         """
         Mock video generation
         
@@ -490,14 +648,26 @@ class MockVideoGenerator(VideoGenerator):
             script: Marketing script to use for the video
             output_dir: Directory to save the video (if needed)
             image_data: Base64 encoded image data (if provided directly)
+            duration: Clip duration in seconds
             
         Returns:
             Dict with mock video details
         """
-        print("Using mock video generator")
+        logger.info("Using mock video generator")
         # Simulate processing time
         time.sleep(3)
-        
+        return self._mock_result(duration)
+    
+    async def agenerate_video(self, image_path, script, output_dir=None, image_data=None, duration=None):
+        """
+        Mock video generation without holding a thread
+        """
+        logger.info("Using mock video generator (async)")
+        await asyncio.sleep(3)
+        return self._mock_result(duration)
+    
+    def _mock_result(self, duration=None):
+        """Mock video details"""
         # Create a mock video URL
         mock_video_id = str(uuid.uuid4())
         mock_url = f"/api/videos/{mock_video_id}"
@@ -505,7 +675,7 @@ class MockVideoGenerator(VideoGenerator):
         return {
             "status": "completed",
             "url": mock_url,
-            "duration": 10,
+            "duration": int(duration or 10),
             "mock": True
         }
 
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Background job worker
+
+Runs the jobs queued by the API when JOB_BACKEND=redis:
+
+    python worker.py
+"""
+
+import os
+
+from app import redis_client, init_clients, start_media_gc, JOB_HANDLERS
+from job_queue import run_worker
+
+if __name__ == '__main__':
+    init_clients()
+    start_media_gc()
+    run_worker(
+        redis_client,
+        JOB_HANDLERS,
+        concurrency=int(os.getenv('JOB_WORKER_CONCURRENCY', 4))
+    )
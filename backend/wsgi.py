@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers
+
+    gunicorn -c gunicorn.conf.py
+"""
+
+from app import app, init_clients
+
+# Build the provider clients once; with preload_app the workers inherit them
+init_clients()
+
+application = app
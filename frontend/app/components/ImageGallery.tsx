@@ -19,7 +19,7 @@ import AddCircleIcon from '@mui/icons-material/AddCircle';
 import CheckCircleIcon from '@mui/icons-material/CheckCircle';
 import ZoomInIcon from '@mui/icons-material/ZoomIn';
 import CloseIcon from '@mui/icons-material/Close';
-import { uploadImage, createProject, getProjectImages, deleteProjectImage, ProjectImage } from '../services/api.service';
+import { uploadImage, uploadImages, createProject, getProjectImages, deleteProjectImage, ProjectImage } from '../services/api.service';
 import { useLanguage } from '../contexts/LanguageContext';
 import { getImageUrl } from '../config/env';
 
@@ -366,9 +366,42 @@ export default function ImageGallery({
     const notUploadedImages = images.filter(img => !img.uploaded && img.file);
     if (notUploadedImages.length === 0) return;
     
-    // 依次上传每张图片
-    for (const img of notUploadedImages) {
-      await handleUpload(img);
+    // 所有图片在一个请求中上传
+    setLoading(true);
+    setError(null);
+    
+    try {
+      let currentProjectId = projectId;
+      if (!currentProjectId) {
+        const projectResponse = await createProject({
+          name: t('new.project'),
+          description: t('from.image.upload')
+        });
+        currentProjectId = projectResponse.project.id;
+      }
+      
+      const result = await uploadImages(currentProjectId, notUploadedImages.map(img => img.file as File));
+      const uploaded = result.images;
+      
+      // 更新图片为已上传状态
+      setImages(prevImages => 
+        prevImages.map(img => {
+          const index = notUploadedImages.findIndex(item => item.id === img.id);
+          return index >= 0
+            ? {
+                ...img,
+                uploaded: true,
+                numericId: uploaded[index].image_id
+              }
+            : img;
+        })
+      );
+      
+      onImageUploaded(currentProjectId);
+    } catch (err) {
+      setError(err instanceof Error ? err.message : t('upload.failed'));
+    } finally {
+      setLoading(false);
     }
   };
 
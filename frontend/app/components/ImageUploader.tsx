@@ -17,7 +17,7 @@ import CloudUploadIcon from '@mui/icons-material/CloudUpload';
 import InsertPhotoIcon from '@mui/icons-material/InsertPhoto';
 import DeleteIcon from '@mui/icons-material/Delete';
 import AddCircleIcon from '@mui/icons-material/AddCircle';
-import { uploadImage, createProject, getProjectImages, ProjectImage } from '../services/api.service';
+import { uploadImage, uploadImages, createProject, getProjectImages, ProjectImage } from '../services/api.service';
 import { useLanguage } from '../contexts/LanguageContext';
 
 const VisuallyHiddenInput = styled('input')({
@@ -279,9 +279,38 @@ export default function ImageUploader({ onImageUploaded, projectId, existingImag
     const notUploadedImages = images.filter(img => !img.uploaded && img.file);
     if (notUploadedImages.length === 0) return;
     
-    // 依次上传每张图片
-    for (const img of notUploadedImages) {
-      await handleUpload(img);
+    // 所有图片在一个请求中上传
+    setLoading(true);
+    setError(null);
+    
+    try {
+      let currentProjectId = projectId;
+      if (!currentProjectId) {
+        const projectResponse = await createProject({
+          name: t('new.project'),
+          description: t('from.image.upload')
+        });
+        currentProjectId = projectResponse.project.id;
+      }
+      
+      const result = await uploadImages(currentProjectId, notUploadedImages.map(img => img.file as File));
+      const uploaded = result.images;
+      
+      // 更新图片为已上传状态
+      setImages(prevImages => 
+        prevImages.map(img => {
+          const index = notUploadedImages.findIndex(item => item.id === img.id);
+          return index >= 0
+            ? { ...img, uploaded: true }
+            : img;
+        })
+      );
+      
+      onImageUploaded(currentProjectId);
+    } catch (err) {
+      setError(err instanceof Error ? err.message : t('upload.failed'));
+    } finally {
+      setLoading(false);
     }
   };
 
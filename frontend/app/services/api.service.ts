@@ -14,6 +14,7 @@ export interface Project {
   image_path: string | null;
   script: string | null;
   video: VideoStatus | null;
+  version?: number;
 }
 
 export interface CreateProjectRequest {
@@ -48,6 +49,20 @@ export interface ProjectImage {
   path: string;
 }
 
+export interface BatchUploadResponse {
+  success: boolean;
+  message: string;
+  images: Array<{
+    image_id: number;
+    sha256: string;
+    image_path: string;
+    // Existing images with the same content / a similar perceptual hash
+    duplicate_of: string[];
+    similar: Array<{ image: string; sha256: string; distance: number }>;
+  }>;
+  project: Project;
+}
+
 export interface GetProjectImagesResponse {
   success: boolean;
   images: ProjectImage[];
@@ -61,15 +76,20 @@ export interface GenerateScriptResponse {
 
 export interface UpdateScriptRequest {
   script: string;
+  // Version the script was loaded at; the update fails with 409 if the project changed since
+  version?: number;
 }
 
 export interface UpdateScriptResponse {
   success: boolean;
   message: string;
   script: string;
+  version: number;
 }
 
 // Video interfaces
+const VIDEO_STATUS_POLL_INTERVAL = 5000;
+
 export interface GenerateVideoResponse {
   success: boolean;
   video: VideoStatus;
@@ -122,6 +142,26 @@ export interface TemplatesListResponse {
   templates: PromptTemplate[];
 }
 
+export interface ProjectSpeech {
+  path: string;
+  created_at: string;
+  language: string;
+}
+
+// Everything the project page needs, from GET /projects/<id>/bundle
+export interface ProjectBundle {
+  success: boolean;
+  project: Project;
+  images: ProjectImage[];
+  speeches: ProjectSpeech[];
+  template: {
+    system_prompt: string;
+    user_prompt: string;
+    updated_at: string | null;
+  };
+  templates: PromptTemplate[];
+}
+
 // Define API base URL - using our environment configuration
 const getApiBaseUrl = () => `${ENV.API_BASE_URL()}/api`;
 
@@ -166,13 +206,53 @@ export async function listProjects(): Promise<ListProjectsResponse> {
  * @returns A promise with the project details
  */
 export async function getProject(projectId: string): Promise<{success: boolean; project: Project}> {
-  const response = await fetch(`${getApiBaseUrl()}/projects/${projectId}`);
+  const bundle = await getProjectBundle(projectId);
+  return { success: bundle.success, project: bundle.project };
+}
+
+// Last bundle and its ETag per project, revalidated with If-None-Match
+const bundleCache = new Map<string, { etag: string; bundle: ProjectBundle }>();
+// Requests started in the same tick (components mounting together) share one fetch
+const pendingBundles = new Map<string, Promise<ProjectBundle>>();
+
+/**
+ * Get a project with its images, speeches and templates in one request
+ * @param projectId The ID of the project
+ * @returns A promise with the project bundle
+ */
+export function getProjectBundle(projectId: string): Promise<ProjectBundle> {
+  const pending = pendingBundles.get(projectId);
+  if (pending) {
+    return pending;
+  }
+
+  const request = fetchProjectBundle(projectId);
+  pendingBundles.set(projectId, request);
+  setTimeout(() => pendingBundles.delete(projectId), 0);
+  return request;
+}
+
+async function fetchProjectBundle(projectId: string): Promise<ProjectBundle> {
+  const cached = bundleCache.get(projectId);
+  const response = await fetch(`${getApiBaseUrl()}/projects/${projectId}/bundle`, {
+    headers: cached ? { 'If-None-Match': cached.etag } : undefined,
+  });
+
+  if (response.status === 304 && cached) {
+    return cached.bundle;
+  }
 
   if (!response.ok) {
+    bundleCache.delete(projectId);
     throw new Error(`Failed to fetch project: ${response.statusText}`);
   }
 
-  return response.json();
+  const bundle: ProjectBundle = await response.json();
+  const etag = response.headers.get('ETag');
+  if (etag) {
+    bundleCache.set(projectId, { etag, bundle });
+  }
+  return bundle;
 }
 
 /**
@@ -197,6 +277,28 @@ export async function uploadImage(projectId: string, file: File): Promise<Upload
   return response.json();
 }
 
+/**
+ * Upload several images to a project in one request
+ * @param projectId The ID of the project
+ * @param files The image files to upload
+ * @returns A promise with the uploaded images, in the order of the files
+ */
+export async function uploadImages(projectId: string, files: File[]): Promise<BatchUploadResponse> {
+  const formData = new FormData();
+  files.forEach(file => formData.append('images', file));
+
+  const response = await fetch(`${getApiBaseUrl()}/projects/${projectId}/images/batch`, {
+    method: 'POST',
+    body: formData,
+  });
+
+  if (!response.ok) {
+    throw new Error(`Upload failed: ${response.statusText}`);
+  }
+
+  return response.json();
+}
+
 /**
  * Generate a marketing script for a project using LLM
  * @param projectId The ID of the project
@@ -246,15 +348,41 @@ export async function updateScript(projectId: string, data: UpdateScriptRequest)
  * @returns A promise with the generate video response
  */
 export async function generateVideo(projectId: string): Promise<GenerateVideoResponse> {
+  // The backend queues the job and returns 202; poll the status endpoint until it finishes
   const response = await fetch(`${getApiBaseUrl()}/projects/${projectId}/video/generate`, {
     method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ async: true }),
   });
 
   if (!response.ok) {
     throw new Error(`Video generation failed: ${response.statusText}`);
   }
 
-  return response.json();
+  const result = await response.json();
+  if (response.status !== 202) {
+    return result;
+  }
+
+  while (true) {
+    await new Promise((resolve) => setTimeout(resolve, VIDEO_STATUS_POLL_INTERVAL));
+
+    const statusResponse = await fetch(`${getApiBaseUrl()}/projects/${projectId}/video/status`);
+    if (!statusResponse.ok) {
+      throw new Error(`Failed to check video status: ${statusResponse.statusText}`);
+    }
+
+    const status = await statusResponse.json();
+    if (status.status === 'processing') {
+      continue;
+    }
+    if (status.status === 'completed') {
+      return { success: true, video: status.video };
+    }
+    throw new Error(`Video generation failed: ${status.error || status.message || status.status}`);
+  }
 }
 
 /**
@@ -334,13 +462,8 @@ export async function deleteProject(projectId: string): Promise<DeleteProjectRes
  * @returns A promise with all project images
  */
 export async function getProjectImages(projectId: string): Promise<GetProjectImagesResponse> {
-  const response = await fetch(`${getApiBaseUrl()}/projects/${projectId}/images`);
-
-  if (!response.ok) {
-    throw new Error(`Failed to fetch project images: ${response.statusText}`);
-  }
-
-  return response.json();
+  const bundle = await getProjectBundle(projectId);
+  return { success: bundle.success, images: bundle.images };
 }
 
 /**
@@ -494,14 +617,9 @@ export async function generateSpeech(
  * @param projectId The ID of the project
  * @returns A promise with the list of speeches
  */
-export async function getProjectSpeeches(projectId: string): Promise<{success: boolean; speeches: Array<{path: string, created_at: string, language: string}>}> {
-  const response = await fetch(`${getApiBaseUrl()}/projects/${projectId}/speech`);
-
-  if (!response.ok) {
-    throw new Error(`Failed to fetch project speeches: ${response.statusText}`);
-  }
-
-  return response.json();
+export async function getProjectSpeeches(projectId: string): Promise<{success: boolean; speeches: ProjectSpeech[]}> {
+  const bundle = await getProjectBundle(projectId);
+  return { success: bundle.success, speeches: bundle.speeches };
 }
 
 /**